@@ -0,0 +1,346 @@
+from initialcondition_generator_254_idealized import (read_prm_file, read_gauges_file, write_rec_file, default_swc,
+                                                      default_k3, default_unix_time)
+from file_consistency_checker_rvr import read_rvr_file, check_network
+from file_converter_hlmodels_h5 import InitialConditionConverter
+from file_converter_hlmodels_h5 import memory_budget_default as hlmodels_memory_budget_default
+from def_lib import ArgumentsManager, JobsRunner, Profiler, ToolError
+from file_converter_rec_to_h5 import convert_file, asynch_version_default, memory_budget_default
+from file_converter_h5_to_rec import convert_file as convert_file_to_rec
+from file_converter_h5_to_rec import memory_budget_default as to_rec_memory_budget_default
+from file_converter_prm_h5 import convert_file as convert_prm_file
+import json
+import csv
+import sys
+import os
+
+# Job types: required and optional fields, with the function converting their values (manifest values may be strings)
+job_types = {
+    "check_rvr": {
+        "required": {"input": str},
+        "optional": {"check": str}
+    },
+    "rec_to_h5": {
+        "required": {"input": str, "output": str},
+        "optional": {"version": str, "mem_budget": float, "order": str, "rvr": str, "index": int}
+    },
+    "h5_to_rec": {
+        "required": {"input": str, "output": str},
+        "optional": {"precision": int, "mem_budget": float}
+    },
+    "prm_h5": {
+        "required": {"input": str, "output": str},
+        "optional": {"precision": int}
+    },
+    "hlmodels_h5": {
+        "required": {"input": str, "output": str, "out_hl": int},
+        "optional": {"mem_budget": float, "order": str, "rvr": str, "index": int}
+    },
+    "ic_254_idealized": {
+        "required": {"input": str},
+        "optional": {"output": str, "output_h5": str, "ref_linkid": int, "disc": float, "gauges": str, "rvr": str,
+                     "swc": float, "k3": float, "unix_time": int}
+    }
+}
+
+# fields of the jobs with the paths of the files they read and write, used to keep dependent jobs in order
+input_fields = ("input", "rvr", "gauges")
+output_fields = ("output", "output_h5")
+
+# last topology read in this process, reused by the following jobs on the same .rvr file
+_last_topology = {"key": None, "network": None}
+
+
+# ###################################################### DEFS ######################################################## #
+
+def read_manifest(manifest_file_path):
+    """
+    Reads a manifest of jobs. In .json format, a list of objects (or an object with a 'jobs' list). In .csv format, a
+    header line with field names and a line per job (empty fields are ignored). Each job has a 'tool' field (one of
+    'job_types'), its fields and, optionally, an 'id' used in the reports.
+    :param manifest_file_path:
+    :return: List of dictionaries, one per job. Raises ToolError if unable to read file
+    """
+
+    if not os.path.exists(manifest_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(manifest_file_path))
+
+    with open(manifest_file_path, "r") as rfile:
+        if manifest_file_path.lower().endswith(".csv"):
+            all_jobs = [dict([(k.strip(), v.strip()) for k, v in cur_row.items()
+                              if (k is not None) and v and v.strip()]) for cur_row in csv.DictReader(rfile)]
+        else:
+            try:
+                all_jobs = json.load(rfile)
+            except ValueError as e:
+                raise ToolError("Invalid .json file '{0}': {1}".format(manifest_file_path, e))
+            if isinstance(all_jobs, dict):
+                all_jobs = all_jobs.get("jobs", [])
+
+    if (not isinstance(all_jobs, list)) or (not all([isinstance(v, dict) for v in all_jobs])):
+        raise ToolError("Manifest '{0}' must describe a list of jobs.".format(manifest_file_path))
+    return all_jobs
+
+
+def parse_job(job):
+    """
+    Checks the fields of a job and converts their values.
+    :param job: Dictionary as in the manifest.
+    :return: Dictionary with 'tool' and the converted fields. Raises ToolError if the job is not valid
+    """
+
+    tool = job.get("tool")
+    if tool not in job_types:
+        raise ToolError("Unknown tool '{0}'. Expected one of: {1}.".format(tool, ", ".join(sorted(job_types.keys()))))
+
+    parsed_job = {"tool": tool}
+    job_type = job_types[tool]
+    for cur_field, cur_type in list(job_type["required"].items()) + list(job_type["optional"].items()):
+        if cur_field not in job:
+            if cur_field in job_type["required"]:
+                raise ToolError("Missing '{0}' field.".format(cur_field))
+            continue
+        try:
+            parsed_job[cur_field] = cur_type(job[cur_field])
+        except (TypeError, ValueError):
+            raise ToolError("Invalid '{0}' field: '{1}'.".format(cur_field, job[cur_field]))
+
+    unknown_fields = set(job.keys()) - set(parsed_job.keys()) - {"id"}
+    if unknown_fields:
+        raise ToolError("Unknown field(s) for '{0}': {1}.".format(tool, ", ".join(sorted(unknown_fields))))
+
+    return parsed_job
+
+
+def get_topology_key(job):
+    """
+
+    :param job: Dictionary as returned by 'parse_job'.
+    :return: Absolute path of the .rvr file read by the job, None if it does not read one
+    """
+
+    if job["tool"] == "check_rvr":
+        return os.path.abspath(job["input"])
+    elif (job["tool"] in ("ic_254_idealized", "rec_to_h5", "hlmodels_h5")) and ("rvr" in job):
+        return os.path.abspath(job["rvr"])
+    return None
+
+
+def get_job_groups(all_jobs):
+    """
+    Groups jobs that must run in the same process: jobs reading the same .rvr file (see 'get_topology_key') and jobs
+    reading a file written by an earlier job of the manifest, which must run after it.
+    :param all_jobs: List of dictionaries as returned by 'parse_job', in the order of the manifest.
+    :return: List with the group key (the position of the first job of the group) of each job
+    """
+
+    # union-find over job positions
+    parents = list(range(len(all_jobs)))
+
+    def find_root(position):
+        while parents[position] != position:
+            parents[position] = parents[parents[position]]
+            position = parents[position]
+        return position
+
+    def join(position_a, position_b):
+        root_a, root_b = find_root(position_a), find_root(position_b)
+        parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    topology_positions, output_positions = {}, {}
+    for cur_position, cur_job in enumerate(all_jobs):
+        cur_topology_key = get_topology_key(cur_job)
+        if cur_topology_key is not None:
+            join(cur_position, topology_positions.setdefault(cur_topology_key, cur_position))
+        for cur_field in input_fields:
+            if (cur_field in cur_job) and (os.path.abspath(cur_job[cur_field]) in output_positions):
+                join(cur_position, output_positions[os.path.abspath(cur_job[cur_field])])
+        for cur_field in output_fields:
+            if cur_field in cur_job:
+                output_positions[os.path.abspath(cur_job[cur_field])] = cur_position
+
+    return [find_root(v) for v in range(len(all_jobs))]
+
+
+def get_topology(rvr_file_path, use_cache=True):
+    """
+    Reads a .rvr file, or reuses it if it was the last one read by this process.
+    :param rvr_file_path:
+    :param use_cache: Boolean. If True, uses and updates the binary cache file of the .rvr file.
+    :return: RvrNetwork object. Raises ToolError if unable to read file
+    """
+
+    topology_key = (os.path.abspath(rvr_file_path), use_cache)
+    if _last_topology["key"] != topology_key:
+        _last_topology["key"], _last_topology["network"] = None, None
+        _last_topology["network"] = read_rvr_file(rvr_file_path, use_cache=use_cache)
+        _last_topology["key"] = topology_key
+    return _last_topology["network"]
+
+
+def run_job(job, use_cache=True):
+    """
+    Runs a single job.
+    :param job: Dictionary as returned by 'parse_job'.
+    :param use_cache: Boolean. If True, uses and updates the binary cache files of .rvr and .prm files.
+    :return: True if the job succeeded, False otherwise. Raises ToolError if unable to process its files or if a
+    check failed
+    """
+
+    tool = job["tool"]
+    with Profiler.stage(tool):
+        if tool == "check_rvr":
+            check = job.get("check", "all")
+            if not check_network(get_topology(job["input"], use_cache=use_cache), check=check):
+                raise ToolError("Topology check '{0}' failed for file '{1}'.".format(check, job["input"]))
+            return True
+
+        elif tool == "rec_to_h5":
+            rvr_network = get_topology(job["rvr"], use_cache=use_cache) if "rvr" in job else None
+            return convert_file(job["input"], job["output"], job.get("version", asynch_version_default),
+                                memory_budget_mb=job.get("mem_budget", memory_budget_default),
+                                order=job.get("order", "input"), write_index=bool(job.get("index", 0)),
+                                rvr_network=rvr_network)
+
+        elif tool == "h5_to_rec":
+            return convert_file_to_rec(job["input"], job["output"], precision=job.get("precision"),
+                                       memory_budget_mb=job.get("mem_budget", to_rec_memory_budget_default))
+
+        elif tool == "prm_h5":
+            return convert_prm_file(job["input"], job["output"], precision=job.get("precision"), use_cache=use_cache)
+
+        elif tool == "hlmodels_h5":
+            rvr_network = get_topology(job["rvr"], use_cache=use_cache) if "rvr" in job else None
+            return InitialConditionConverter.convert_file(job["input"], job["output"], job["out_hl"],
+                                                          memory_budget_mb=job.get("mem_budget",
+                                                                                   hlmodels_memory_budget_default),
+                                                          order=job.get("order", "input"),
+                                                          write_index=bool(job.get("index", 0)),
+                                                          rvr_network=rvr_network)
+
+        elif tool == "ic_254_idealized":
+            if ("output" not in job) and ("output_h5" not in job):
+                raise ToolError("Missing 'output' or 'output_h5' field.")
+            if "gauges" in job:
+                if "rvr" not in job:
+                    raise ToolError("Missing 'rvr' field.")
+                ref_linkids, ref_discharges = read_gauges_file(job["gauges"])
+                rvr_network = get_topology(job["rvr"], use_cache=use_cache)
+            elif ("ref_linkid" in job) and ("disc" in job):
+                ref_linkids, ref_discharges = job["ref_linkid"], job["disc"]
+                rvr_network = get_topology(job["rvr"], use_cache=use_cache) if "rvr" in job else None
+            else:
+                raise ToolError("Missing 'ref_linkid' and 'disc' fields or 'gauges' field.")
+            return write_rec_file(job.get("output"), read_prm_file(job["input"], use_cache=use_cache), ref_linkids,
+                                  ref_discharges, job.get("swc", default_swc), job.get("k3", default_k3),
+                                  output_h5_fpath=job.get("output_h5"),
+                                  unix_time=job.get("unix_time", default_unix_time), rvr_network=rvr_network)
+
+        raise ToolError("Unknown tool '{0}'.".format(tool))
+
+
+def run_manifest(manifest_file_path, num_workers=1, use_cache=True):
+    """
+    Runs all jobs of a manifest in this process or in a pool of processes. Jobs reading the same .rvr file run in the
+    same process, one after the other, so the file is read only once. Jobs reading the output of an earlier job run
+    after it, in the same process (see 'get_job_groups').
+    :param manifest_file_path:
+    :param num_workers: Integer. Maximum number of processes running jobs at the same time.
+    :param use_cache: Boolean. If True, uses and updates the binary cache files of .rvr and .prm files.
+    :return: List of tuples (job label, tool, success boolean, error message or None), in the order of the manifest
+    """
+
+    all_jobs, all_labels, all_tools, all_invalid = [], [], [], {}
+    for cur_idx, cur_job in enumerate(read_manifest(manifest_file_path)):
+        cur_label = str(cur_job.get("id", "#{0} {1} {2}".format(cur_idx + 1, cur_job.get("tool"),
+                                                                cur_job.get("input"))))
+        all_labels.append(cur_label)
+        all_tools.append(cur_job.get("tool"))
+        try:
+            cur_job = parse_job(cur_job)
+        except ToolError as e:
+            all_invalid[cur_idx] = str(e)
+            continue
+        all_jobs.append((cur_label, (cur_job, use_cache)))
+
+    all_groups = get_job_groups([cur_job for _, (cur_job, _) in all_jobs])
+    all_run_results = iter(JobsRunner.run(run_job, all_jobs, num_workers=num_workers, groups=all_groups))
+    all_results = []
+    for cur_idx, (cur_label, cur_tool) in enumerate(zip(all_labels, all_tools)):
+        if cur_idx in all_invalid:
+            all_results.append((cur_label, cur_tool, False, all_invalid[cur_idx]))
+        else:
+            _, cur_ok, cur_msg = next(all_run_results)
+            all_results.append((cur_label, cur_tool, cur_ok, cur_msg))
+    return all_results
+
+
+def write_report(report_file_path, all_results):
+    """
+    Writes the status of each job, as .csv (if the file path ends with .csv) or .json.
+    :param report_file_path:
+    :param all_results: List of tuples as returned by 'run_manifest'.
+    :return:
+    """
+
+    all_rows = [{"id": cur_label, "tool": cur_tool, "ok": cur_ok, "message": cur_msg}
+                for cur_label, cur_tool, cur_ok, cur_msg in all_results]
+    with open(report_file_path, "w") as wfile:
+        if report_file_path.lower().endswith(".csv"):
+            csv_writer = csv.DictWriter(wfile, fieldnames=["id", "tool", "ok", "message"])
+            csv_writer.writeheader()
+            csv_writer.writerows(all_rows)
+        else:
+            json.dump(all_rows, wfile, indent=2)
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all jobs succeeded, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Runs a list of jobs of the other tools (conversions, checks, initial conditions) in a single process or in a pool of processes.")
+        print("Usage: python batch_runner.py -manifest MANIFEST [-workers WORKERS] [-report REPORT] [-no_cache] [-profile PROFILE]")
+        print("  MANIFEST  : File path for a .json or .csv file with one job per entry/line. Each job has a 'tool' field and the fields of the tool:")
+        for cur_tool, cur_type in sorted(job_types.items()):
+            print("              {0}: {1}{2}".format(cur_tool, ", ".join(cur_type["required"].keys()),
+                                                    "" if not cur_type["optional"] else " [{0}]".format(
+                                                        ", ".join(cur_type["optional"].keys()))))
+        print("  WORKERS   : Number of processes running jobs in parallel. Jobs reading the same .rvr file, or the output of an earlier job, run in the same process and in manifest order. If not provided, it is assumed 1.")
+        print("  REPORT    : File path for a .json or .csv file with the status of each job.")
+        print("  -no_cache : If provided, neither reads nor writes the binary cache files of .rvr and .prm files.")
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    manifest_arg = ArgumentsManager.get_str(sys_args, '-manifest')
+    work_arg = ArgumentsManager.get_int(sys_args, '-workers')
+    report_arg = ArgumentsManager.get_str(sys_args, '-report')
+    use_cache_arg = '-no_cache' not in sys_args
+
+    # basic checks
+    if manifest_arg is None:
+        print("Missing '-manifest' argument.")
+        return 1
+    work_arg = 1 if work_arg is None else work_arg
+
+    try:
+        all_results = run_manifest(manifest_arg, num_workers=work_arg, use_cache=use_cache_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+
+    all_ok = JobsRunner.print_summary([(cur_label, cur_ok, cur_msg) for cur_label, _, cur_ok, cur_msg in all_results])
+    if report_arg is not None:
+        write_report(report_arg, all_results)
+        print("Wrote file '{0}'.".format(report_arg))
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
@@ -0,0 +1,356 @@
+from initialcondition_generator_254_idealized import read_prm_file, write_rec_file, default_swc, default_k3
+from file_converter_hlmodels_h5 import InitialConditionConverter
+from def_lib import ArgumentsManager, RvrNetwork, SnapshotFile, Profiler
+from file_consistency_checker_rvr import check_file
+from file_converter_rec_to_h5 import convert_file
+from contextlib import redirect_stdout
+import subprocess
+import platform
+import numpy as np
+import json
+import h5py
+import time
+import sys
+import os
+
+default_sizes = "10000,100000"
+default_repeat = 1
+default_seed = 0
+bench_unix_time = 1577836800
+
+# ###################################################### DEFS ######################################################## #
+
+def get_file_paths(work_dir, num_links):
+    """
+
+    :param work_dir:
+    :param num_links:
+    :return: Dictionary with the file paths of the synthetic files of a given size
+    """
+
+    base_path = os.path.join(work_dir, "bench{0}".format(num_links))
+    return {
+        "rvr": base_path + ".rvr",
+        "prm": base_path + ".prm",
+        "rec": "{0}_{1}.rec".format(base_path, bench_unix_time),
+        "h5": "{0}_{1}.h5".format(base_path, bench_unix_time),
+        "out": base_path + "_out"
+    }
+
+
+def generate_network(num_links, seed=default_seed):
+    """
+    Creates a random binary river network by splitting random leaves (each split adds two upstream links).
+    :param num_links: Integer. Number of links (rounded down to an odd number).
+    :param seed: Integer. Seed of the random generator.
+    :return: Tuple (link ids, parent positions (-1 for the outlet), depth of each link)
+    """
+
+    rng = np.random.RandomState(seed)
+    num_splits = (num_links - 1) // 2
+    num_links = 2 * num_splits + 1
+
+    parents = np.full(num_links, -1, dtype=np.int64)
+    depths = np.zeros(num_links, dtype=np.int64)
+    leaves = [0]
+    picks = rng.random_sample(num_splits)
+    for cur_split in range(num_splits):
+        cur_leaf_idx = int(picks[cur_split] * len(leaves))
+        cur_parent = leaves[cur_leaf_idx]
+        cur_first = 2 * cur_split + 1
+        parents[cur_first] = parents[cur_first + 1] = cur_parent
+        depths[cur_first] = depths[cur_first + 1] = depths[cur_parent] + 1
+        leaves[cur_leaf_idx] = cur_first
+        leaves.append(cur_first + 1)
+
+    link_ids = (rng.permutation(num_links) + 1).astype(np.uint32)
+    return link_ids, parents, depths
+
+
+def write_rvr_file(rvr_file_path, link_ids, parents):
+    """
+
+    :param rvr_file_path:
+    :param link_ids:
+    :param parents:
+    :return:
+    """
+
+    # children of each link (binary network: 0 or 2)
+    children = [[] for _ in range(link_ids.size)]
+    for cur_child, cur_parent in enumerate(parents.tolist()):
+        if cur_parent >= 0:
+            children[cur_parent].append(cur_child)
+
+    all_ids = link_ids.tolist()
+    with open(rvr_file_path, "w") as wfile:
+        wfile.write("{0}\n\n".format(link_ids.size))
+        for cur_first in range(0, link_ids.size, 100000):
+            cur_lines = []
+            for cur_pos in range(cur_first, min(cur_first + 100000, link_ids.size)):
+                cur_ups = " ".join([str(all_ids[v]) for v in children[cur_pos]])
+                cur_lines.append("{0}\n{1}{2}{3}\n\n".format(all_ids[cur_pos], len(children[cur_pos]),
+                                                             " " if cur_ups else "", cur_ups))
+            wfile.write("".join(cur_lines))
+
+
+def write_records_file(file_path, header_lines, link_ids, values):
+    """
+    Writes a file in the "id line / values line" layout of .prm and .rec files.
+    :param file_path:
+    :param header_lines: List of strings.
+    :param link_ids:
+    :param values: 2-D array of float64, one row per link.
+    :return:
+    """
+
+    record_format = "%d\n" + " ".join(["%r"] * values.shape[1]) + "\n\n"
+    with open(file_path, "w") as wfile:
+        wfile.write("\n".join(header_lines) + "\n\n")
+        for cur_first in range(0, link_ids.size, 100000):
+            cur_ids = link_ids[cur_first:cur_first + 100000].tolist()
+            cur_values = values[cur_first:cur_first + 100000].tolist()
+            cur_items = []
+            for cur_id, cur_row in zip(cur_ids, cur_values):
+                cur_items.append(cur_id)
+                cur_items.extend(cur_row)
+            wfile.write((record_format * len(cur_ids)) % tuple(cur_items))
+
+
+def generate_files(work_dir, num_links, seed=default_seed):
+    """
+    Creates synthetic .rvr, .prm (model 254), .rec and .h5 (model 254) files describing the same network.
+    Files already existing are kept.
+    :param work_dir:
+    :param num_links:
+    :param seed:
+    :return: Dictionary of file paths (see 'get_file_paths') and reference link id (the outlet)
+    """
+
+    file_paths = get_file_paths(work_dir, num_links)
+    link_ids, parents, depths = generate_network(num_links, seed=seed)
+    rng = np.random.RandomState(seed + 1)
+
+    if not os.path.exists(file_paths["rvr"]):
+        print("Creating {0}...".format(file_paths["rvr"]))
+        write_rvr_file(file_paths["rvr"], link_ids, parents)
+
+    # parameters: upstream area (km2), length (km) and hillslope area (m2)
+    if not os.path.exists(file_paths["prm"]):
+        print("Creating {0}...".format(file_paths["prm"]))
+        hill_areas = rng.uniform(0.01, 0.2, link_ids.size)
+        up_areas = hill_areas.copy()
+        for cur_depth in range(int(depths.max()), 0, -1):
+            cur_positions = np.flatnonzero(depths == cur_depth)
+            np.add.at(up_areas, parents[cur_positions], up_areas[cur_positions])
+        lengths = rng.uniform(0.1, 1.0, link_ids.size)
+        write_records_file(file_paths["prm"], [str(link_ids.size)], link_ids,
+                           np.column_stack((up_areas, lengths, hill_areas * 1e6)))
+
+    # states of model 254
+    states = rng.uniform(0.0, 10.0, (link_ids.size, 7))
+    if not os.path.exists(file_paths["rec"]):
+        print("Creating {0}...".format(file_paths["rec"]))
+        write_records_file(file_paths["rec"], ["254", str(link_ids.size), "0.0"], link_ids, states)
+
+    if not os.path.exists(file_paths["h5"]):
+        print("Creating {0}...".format(file_paths["h5"]))
+        snapshot = np.empty(link_ids.size, dtype=SnapshotFile.get_dtype(7))
+        snapshot["link_id"] = link_ids
+        for cur_idx in range(7):
+            snapshot["state_{0}".format(cur_idx)] = states[:, cur_idx]
+        with h5py.File(file_paths["h5"], 'w') as wfile:
+            wfile.attrs.create('model', [254], dtype='uint16')
+            wfile.attrs.create('unix_time', [bench_unix_time], dtype='uint32')
+            wfile.attrs.create('version', "1.3.2", dtype='S6')
+            wfile.create_dataset('snapshot', data=snapshot, compression="gzip", compression_opts=5)
+
+    return file_paths, int(link_ids[0])
+
+
+def get_cases(file_paths, ref_linkid):
+    """
+    Lists the benchmarked entry points. Each case includes reading its input files.
+    :param file_paths: Dictionary as returned by 'get_file_paths'.
+    :param ref_linkid: Integer. A link id of the network.
+    :return: Dictionary of functions without arguments, by case name
+    """
+
+    return {
+        "read_rvr_file": lambda: RvrNetwork.read_file(file_paths["rvr"], use_cache=False),
+        "check_loop": lambda: check_file(file_paths["rvr"], check="loop", use_cache=False),
+        "convert_file_1_3": lambda: convert_file(file_paths["rec"], file_paths["out"] + "_1_3.h5", "1.3"),
+        "convert_from_254_to_195": lambda: InitialConditionConverter.convert_from_254_to_195(
+            file_paths["h5"], file_paths["out"] + "_195.h5"),
+        "write_rec_file": lambda: write_rec_file(file_paths["out"] + ".rec",
+                                                 read_prm_file(file_paths["prm"], use_cache=False), ref_linkid, 100.0,
+                                                 default_swc, default_k3)
+    }
+
+
+def run_case(case_name, work_dir, num_links):
+    """
+    Runs one case in the current process and prints its measures as a JSON line.
+    :param case_name:
+    :param work_dir:
+    :param num_links:
+    :return:
+    """
+
+    file_paths = get_file_paths(work_dir, num_links)
+    with open(file_paths["rec"], "r") as rfile:
+        for _ in range(4):
+            rfile.readline()
+        ref_linkid = int(rfile.readline())
+    case_function = get_cases(file_paths, ref_linkid)[case_name]
+
+    init_cpu_time, init_time = time.process_time(), time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        case_function()
+    wall_time = time.perf_counter() - init_time
+    cpu_time = time.process_time() - init_cpu_time
+
+    print(json.dumps({
+        "wall_s": wall_time,
+        "cpu_s": cpu_time,
+        "peak_rss_mb": Profiler.get_peak_rss_mb()
+    }))
+
+
+def run_benchmark(work_dir, sizes, repeat):
+    """
+
+    :param work_dir:
+    :param sizes: List of integers.
+    :param repeat: Integer.
+    :return: List of dictionaries, one per case and size
+    """
+
+    all_results = []
+    for cur_size in sizes:
+        cur_file_paths, cur_ref_linkid = generate_files(work_dir, cur_size)
+        for cur_case in get_cases(cur_file_paths, cur_ref_linkid).keys():
+            cur_runs = []
+            for _ in range(repeat):
+                cur_process = subprocess.run([sys.executable, os.path.abspath(__file__), "-run_case", cur_case,
+                                              "-work_dir", work_dir, "-size", str(cur_size)],
+                                             stdout=subprocess.PIPE, universal_newlines=True)
+                if cur_process.returncode != 0:
+                    break
+                cur_runs.append(json.loads(cur_process.stdout.strip().split("\n")[-1]))
+
+            cur_result = {"case": cur_case, "num_links": cur_size, "ok": len(cur_runs) == repeat}
+            if cur_runs:
+                cur_result.update(min(cur_runs, key=lambda v: v["wall_s"]))
+                cur_result["peak_rss_mb"] = max([v["peak_rss_mb"] for v in cur_runs])
+            all_results.append(cur_result)
+            print("{0:>24} {1:>10} links: {2}".format(cur_case, cur_size, "{0:.3f} s, {1:.0f} MB".format(
+                cur_result["wall_s"], cur_result["peak_rss_mb"]) if cur_result["ok"] else "FAIL"))
+
+    return all_results
+
+
+def get_commit_id():
+    """
+
+    :return: String with the current git commit id, None if not available
+    """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old_results, new_results):
+    """
+    Prints the wall time and peak RSS ratios (new / old) of the cases present in both results.
+    :param old_results: List of dictionaries as returned by 'run_benchmark'.
+    :param new_results: List of dictionaries as returned by 'run_benchmark'.
+    :return:
+    """
+
+    old_by_key = dict([((v["case"], v["num_links"]), v) for v in old_results if v["ok"]])
+    print("Comparison (new / old):")
+    for cur_new in new_results:
+        cur_old = old_by_key.get((cur_new["case"], cur_new["num_links"]))
+        if (cur_old is None) or (not cur_new["ok"]):
+            continue
+        print("{0:>24} {1:>10} links: wall x{2:.2f}, peak RSS x{3:.2f}".format(
+            cur_new["case"], cur_new["num_links"], cur_new["wall_s"] / max(cur_old["wall_s"], 1e-9),
+            cur_new["peak_rss_mb"] / max(cur_old["peak_rss_mb"], 1e-9)))
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all cases ran, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Times the entry points of the tools on synthetic files and records wall time, CPU time and peak RSS.")
+        print("Usage: python benchmark_suite.py -work_dir WORK_DIR -out_json OUT_JSON [-sizes SIZES] [-repeat REPEAT] [-compare OLD_JSON]")
+        print("  WORK_DIR : Folder in which synthetic .rvr, .prm, .rec and .h5 files are created (and reused).")
+        print("  OUT_JSON : File path for the .json file with the results.")
+        print("  SIZES    : Comma-separated numbers of links (example: 10000,1000000). If not provided, it is assumed {0}.".format(default_sizes))
+        print("  REPEAT   : Number of runs of each case; the fastest is kept. If not provided, it is assumed {0}.".format(default_repeat))
+        print("  OLD_JSON : File path for the results of a previous run, compared to the new results.")
+        print("Each case runs in a separate Python process, so peak RSS is measured for that case only.")
+        return 0
+
+    # child process: run one case
+    if '-run_case' in sys_args:
+        run_case(ArgumentsManager.get_str(sys_args, '-run_case'), ArgumentsManager.get_str(sys_args, '-work_dir'),
+                 ArgumentsManager.get_int(sys_args, '-size'))
+        return 0
+
+    # get arguments
+    work_dir_arg = ArgumentsManager.get_str(sys_args, '-work_dir')
+    out_json_arg = ArgumentsManager.get_str(sys_args, '-out_json')
+    sizes_arg = ArgumentsManager.get_str(sys_args, '-sizes')
+    repeat_arg = ArgumentsManager.get_int(sys_args, '-repeat')
+    compare_arg = ArgumentsManager.get_str(sys_args, '-compare')
+
+    # basic checks
+    if work_dir_arg is None:
+        print("Missing '-work_dir' argument.")
+        return 1
+    if out_json_arg is None:
+        print("Missing '-out_json' argument.")
+        return 1
+    try:
+        sizes_arg = [int(v) for v in (default_sizes if sizes_arg is None else sizes_arg).split(",")]
+    except ValueError:
+        print("Invalid '-sizes' argument: '{0}'.".format(sizes_arg))
+        return 1
+    repeat_arg = default_repeat if repeat_arg is None else repeat_arg
+
+    if not os.path.isdir(work_dir_arg):
+        os.makedirs(work_dir_arg)
+
+    results = run_benchmark(work_dir_arg, sizes_arg, repeat_arg)
+    with open(out_json_arg, "w") as wfile:
+        json.dump({
+            "commit": get_commit_id(),
+            "created": int(time.time()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "h5py": h5py.__version__,
+            "repeat": repeat_arg,
+            "results": results
+        }, wfile, indent=2)
+    print("Wrote file '{0}'.".format(out_json_arg))
+
+    if compare_arg is not None:
+        with open(compare_arg, "r") as rfile:
+            compare_results(json.load(rfile)["results"], results)
+
+    return 0 if all([v["ok"] for v in results]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,61 +1,2000 @@
-
-class ArgumentsManager:
-
-    @staticmethod
-    def get_str(sys_args, arg_id):
-        """
-
-        :param sys_args: Array of string. I would REALLY appreciate if you use the sys.argv here. Really.
-        :param arg_id: String. Example "-linkid".
-        :return:
-        """
-
-        # basic check
-        if (sys_args is None) or (arg_id is None):
-            return None
-
-        if (arg_id in sys_args) and (sys_args.index(arg_id) < (len(sys_args) - 1)):
-            return sys_args[sys_args.index(arg_id) + 1]
-        else:
-            return None
-
-    @staticmethod
-    def get_int(sys_args, arg_id):
-        """
-
-        :param sys_args:
-        :param arg_id:
-        :return:
-        """
-
-        arg_value = ArgumentsManager.get_str(sys_args, arg_id)
-        if arg_value is not None:
-            try:
-                return int(ArgumentsManager.get_str(sys_args, arg_id))
-            except ValueError:
-                print("Argument '{0}' is not an integer ({1}).".format(arg_id, arg_value))
-                return None
-        else:
-            return None
-
-    @staticmethod
-    def get_flt(sys_args, arg_id):
-        """
-
-        :param sys_args:
-        :param arg_id:
-        :return:
-        """
-
-        arg_value = ArgumentsManager.get_str(sys_args, arg_id)
-        if arg_value is not None:
-            try:
-                return float(ArgumentsManager.get_str(sys_args, arg_id))
-            except ValueError:
-                print("Argument '{0}' is not an float ({1}).".format(arg_id, arg_value))
-                return None
-        else:
-            return None
-
-    def __init__(self):
-        return
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import warnings
+import hashlib
+import json
+import h5py
+import math
+import time
+import sys
+import os
+
+
+class ArgumentsManager:
+
+    @staticmethod
+    def get_str(sys_args, arg_id):
+        """
+
+        :param sys_args: Array of string. I would REALLY appreciate if you use the sys.argv here. Really.
+        :param arg_id: String. Example "-linkid".
+        :return:
+        """
+
+        # basic check
+        if (sys_args is None) or (arg_id is None):
+            return None
+
+        if (arg_id in sys_args) and (sys_args.index(arg_id) < (len(sys_args) - 1)):
+            return sys_args[sys_args.index(arg_id) + 1]
+        else:
+            return None
+
+    @staticmethod
+    def get_int(sys_args, arg_id):
+        """
+
+        :param sys_args:
+        :param arg_id:
+        :return:
+        """
+
+        arg_value = ArgumentsManager.get_str(sys_args, arg_id)
+        if arg_value is not None:
+            try:
+                return int(ArgumentsManager.get_str(sys_args, arg_id))
+            except ValueError:
+                print("Argument '{0}' is not an integer ({1}).".format(arg_id, arg_value))
+                return None
+        else:
+            return None
+
+    @staticmethod
+    def get_flt(sys_args, arg_id):
+        """
+
+        :param sys_args:
+        :param arg_id:
+        :return:
+        """
+
+        arg_value = ArgumentsManager.get_str(sys_args, arg_id)
+        if arg_value is not None:
+            try:
+                return float(ArgumentsManager.get_str(sys_args, arg_id))
+            except ValueError:
+                print("Argument '{0}' is not an float ({1}).".format(arg_id, arg_value))
+                return None
+        else:
+            return None
+
+    def __init__(self):
+        return
+
+
+class ToolError(Exception):
+    """
+    Raised by the functions of the tools when an input cannot be processed. Command line wrappers print its message.
+    """
+    pass
+
+
+def find_in_sorted(sorted_ids, link_ids):
+    """
+
+    :param sorted_ids: 1-D array of sorted link ids.
+    :param link_ids: 1-D array of link ids to be found.
+    :return: Tuple (position of each link id in 'sorted_ids' (first occurrence), boolean array True if found)
+    """
+
+    positions = np.searchsorted(sorted_ids, link_ids)
+    found = positions < sorted_ids.size
+    found[found] = sorted_ids[positions[found]] == link_ids[found]
+    return positions, found
+
+
+class RvrNetwork:
+    """
+    Compact representation of a .rvr file as NumPy arrays.
+    Links are referred by their position in 'link_ids' (the order of the file). The upstream links of the link at
+    position 'i' are at positions 'upstream[offsets[i]:offsets[i+1]]' and 'downstream[i]' is the position of the link
+    it drains to (-1 for outlets). Upstream link ids not described in the file have position -1 in 'upstream'.
+    """
+
+    def __init__(self, link_ids, offsets, upstream_ids, num_links_header=None, sorted_positions=None,
+                 upstream=None, downstream=None):
+        """
+
+        :param link_ids: Array of uint32 with the link ids, in file order.
+        :param offsets: Array of int64 with len(link_ids) + 1 CSR offsets. Positions are stored as int32.
+        :param upstream_ids: Array of uint32 with the upstream link ids of all links, concatenated.
+        :param num_links_header: Integer. Number of links declared in the header of the file.
+        :param sorted_positions: Array of int32. Positions sorting 'link_ids'. Computed if not given.
+        :param upstream: Array of int32. Positions of 'upstream_ids'. Computed if not given.
+        :param downstream: Array of int32. Position of the link each link drains to. Computed if not given.
+        """
+
+        self.link_ids = link_ids
+        self.offsets = offsets
+        self.upstream_ids = upstream_ids
+        self.num_links_header = num_links_header
+
+        # link-id-to-position map: sorted link ids and their positions
+        if sorted_positions is None:
+            sorted_positions = np.argsort(link_ids, kind="stable").astype(np.int32)
+        self.sorted_positions = sorted_positions
+        self.sorted_link_ids = link_ids[sorted_positions]
+
+        # upstream positions and downstream position of each link
+        if upstream is None:
+            upstream = self.index_of(upstream_ids)
+        self.upstream = upstream
+        if downstream is None:
+            downstream = np.full(len(link_ids), -1, dtype=np.int32)
+            up_owners = np.repeat(np.arange(len(link_ids), dtype=np.int32), np.diff(offsets))
+            up_valid = upstream >= 0
+            downstream[upstream[up_valid]] = up_owners[up_valid]
+        self.downstream = downstream
+
+    @property
+    def num_links(self):
+        return len(self.link_ids)
+
+    def index_of(self, link_ids):
+        """
+        Maps link ids to positions using a binary search over the sorted link ids.
+        :param link_ids: Array of link ids.
+        :return: Array of int32 with the positions of the links, -1 for link ids not described.
+        """
+
+        link_ids = np.asarray(link_ids)
+        if self.sorted_link_ids.size == 0:
+            return np.full(link_ids.shape, -1, dtype=np.int32)
+        found_at = np.searchsorted(self.sorted_link_ids, link_ids)
+        found_at[found_at == self.sorted_link_ids.size] = 0
+        positions = self.sorted_positions[found_at]
+        positions[self.sorted_link_ids[found_at] != link_ids] = -1
+        return positions
+
+    def get_upstream(self, positions):
+        """
+        Gathers the upstream links of a set of links.
+        :param positions: Array of link positions.
+        :return: Tuple of arrays (upstream positions, position of the link each of them drains to)
+        """
+
+        return RvrNetwork.gather_upstream(self.offsets, self.upstream, positions)
+
+    @staticmethod
+    def gather_upstream(offsets, upstream, positions):
+        """
+        Gathers the upstream links of a set of links straight from the topology arrays (see 'get_upstream').
+        :param offsets: Array of CSR offsets, as 'RvrNetwork.offsets'.
+        :param upstream: Array of upstream positions, as 'RvrNetwork.upstream'.
+        :param positions: Array of link positions.
+        :return: Tuple of arrays (upstream positions, position of the link each of them drains to)
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        starts = offsets[positions]
+        counts = offsets[positions + 1] - starts
+        firsts = np.cumsum(counts) - counts
+        edges = np.repeat(starts - firsts, counts) + np.arange(counts.sum(), dtype=np.int64)
+        return upstream[edges], np.repeat(positions, counts)
+
+    def propagate_upstream(self, values, is_set):
+        """
+        Copies values from each link to its upstream links, in a single sweep from the outlets to the headwaters (one
+        vectorized step per level, each link visited once). Links with 'is_set' keep their own value and pass it on.
+        :param values: Array with one value per link. Only the values of links with 'is_set' are used.
+        :param is_set: Array of booleans with one value per link.
+        :return: Tuple of arrays (propagated values, boolean 'reached'). Links not reached from an outlet (in loops or
+        upstream of loops) keep their original value.
+        """
+
+        values = np.array(values, copy=True)
+        reached = np.zeros(self.num_links, dtype=bool)
+        frontier = np.flatnonzero(self.downstream < 0)
+        reached[frontier] = True
+        while frontier.size > 0:
+            up_positions, owners = self.get_upstream(frontier)
+            up_valid = up_positions >= 0
+            up_positions, owners = up_positions[up_valid], owners[up_valid]
+            up_new = ~reached[up_positions]
+            up_positions, owners = up_positions[up_new], owners[up_new]
+            up_positions, first_at = np.unique(up_positions, return_index=True)
+            owners = owners[first_at]
+            inherit = ~is_set[up_positions]
+            values[up_positions[inherit]] = values[owners[inherit]]
+            reached[up_positions] = True
+            frontier = up_positions
+        return values, reached
+
+    def get_topological_order(self):
+        """
+        Orders the links from the headwaters to the outlets, by decreasing number of links to their outlet (found with a
+        single sweep from the outlets, one vectorized step per level). Each link comes before the link it drains to.
+        :return: Array of link positions. Links not reached from an outlet (in loops or upstream of loops) are missing
+        """
+
+        reached = np.zeros(self.num_links, dtype=bool)
+        frontier = np.flatnonzero(self.downstream < 0)
+        reached[frontier] = True
+        all_levels = []
+        while frontier.size > 0:
+            all_levels.append(frontier)
+            up_positions, _ = self.get_upstream(frontier)
+            up_positions = np.unique(up_positions[up_positions >= 0])
+            frontier = up_positions[~reached[up_positions]]
+            reached[frontier] = True
+        return np.concatenate(all_levels[::-1]) if all_levels else np.empty(0, dtype=np.int64)
+
+    def to_arrays(self):
+        """
+
+        :return: Dictionary of arrays from which the object can be rebuilt with 'from_arrays'.
+        """
+
+        return {
+            "link_ids": self.link_ids,
+            "offsets": self.offsets,
+            "upstream_ids": self.upstream_ids,
+            "num_links_header": np.array([-1 if self.num_links_header is None else self.num_links_header]),
+            "sorted_positions": self.sorted_positions,
+            "upstream": self.upstream,
+            "downstream": self.downstream
+        }
+
+    @staticmethod
+    def from_arrays(arrays):
+        """
+
+        :param arrays: Dictionary of arrays as returned by 'to_arrays'.
+        :return: A RvrNetwork object.
+        """
+
+        num_links_header = int(arrays["num_links_header"][0])
+        return RvrNetwork(arrays["link_ids"], arrays["offsets"], arrays["upstream_ids"],
+                          num_links_header=None if num_links_header < 0 else num_links_header,
+                          sorted_positions=arrays["sorted_positions"], upstream=arrays["upstream"],
+                          downstream=arrays["downstream"])
+
+    def subset(self, positions):
+        """
+        Builds the network of some links, with their upstream link ids as in this network.
+        :param positions: Array of link positions, in the order of the new network.
+        :return: A RvrNetwork object
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        upstream_ids, _ = RvrNetwork.gather_upstream(self.offsets, self.upstream_ids, positions)
+        offsets = np.zeros(positions.size + 1, dtype=np.int64)
+        np.cumsum(self.offsets[positions + 1] - self.offsets[positions], out=offsets[1:])
+        return RvrNetwork(self.link_ids[positions], offsets, upstream_ids, num_links_header=positions.size)
+
+    def write_file(self, rvr_file_path, block_rows=65536):
+        """
+        Writes the network as a .rvr file: number of links, then a link id line and an upstream line (number of
+        upstream links and their ids) for each link.
+        :param rvr_file_path: File path for the new .rvr file.
+        :param block_rows: Integer. Number of links formatted at once.
+        :return:
+        """
+
+        with open(rvr_file_path, "w") as wfile:
+            wfile.write("{0}\n\n".format(self.num_links))
+            for cur_first in range(0, self.num_links, block_rows):
+                cur_last = min(cur_first + block_rows, self.num_links)
+                with Profiler.stage("rvr_write"):
+                    cur_offsets = self.offsets[cur_first:cur_last + 1].tolist()
+                    cur_upstream_ids = self.upstream_ids[cur_offsets[0]:cur_offsets[-1]].tolist()
+                    cur_base = cur_offsets[0]
+                    wfile.write("".join(["{0}\n{1}{2}\n\n".format(
+                        cur_link_id, cur_end - cur_start,
+                        "".join([" {0}".format(v) for v in cur_upstream_ids[cur_start - cur_base:cur_end - cur_base]]))
+                        for cur_link_id, cur_start, cur_end in zip(self.link_ids[cur_first:cur_last].tolist(),
+                                                                   cur_offsets[:-1], cur_offsets[1:])]))
+
+    @staticmethod
+    def read_file(rvr_file_path, use_cache=True):
+        """
+        Reads a .rvr file straight into NumPy arrays, without building per-link Python objects.
+        :param rvr_file_path: File path for the .rvr file.
+        :param use_cache: Boolean. If True, the parsed file is kept in a sidecar file (see SidecarCache).
+        :return: A RvrNetwork object, or None if file does not exist or is empty. Raises ToolError if the file has
+        content other than integers
+        """
+
+        # basic check
+        if not os.path.exists(rvr_file_path):
+            print("File '{0}' does not exits.".format(rvr_file_path))
+            return None
+
+        arrays = SidecarCache.load(rvr_file_path, "rvr", RvrNetwork._parse_file, use_cache=use_cache)
+        return None if arrays is None else RvrNetwork.from_arrays(arrays)
+
+    @staticmethod
+    def _parse_file(rvr_file_path):
+        """
+        Tokenizes a .rvr file.
+        :param rvr_file_path: File path for the .rvr file.
+        :return: Dictionary of arrays (see 'to_arrays'), or None if file is empty. Raises ToolError if the file has
+        content other than integers or ends with an incomplete record
+        """
+
+        with Profiler.stage("parse"):
+            # the file is a sequence of integers: header, then "link_id num_ups up_1 ... up_n" records
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error", DeprecationWarning)
+                    tokens = np.fromfile(rvr_file_path, dtype=np.uint32, sep=" ")
+            except (ValueError, DeprecationWarning):
+                raise ToolError("Unexpected content in file '{0}': expected only integers.".format(rvr_file_path))
+            if tokens.size == 0:
+                print("File '{0}' is empty.".format(rvr_file_path))
+                return None
+            num_links_header = int(tokens[0])
+
+            # locate the record starts: the record at position i is followed by the one at i + 2 + num_ups, so the
+            # records form a chain from position 1. It is followed by pointer doubling (each pass appends as many
+            # records as already known), with the end of the tokens (N) and any position past it (N + 1, incomplete
+            # record) as terminal positions
+            num_tokens = tokens.size
+            index_dtype = np.int32 if num_tokens < np.iinfo(np.int32).max else np.int64
+            next_positions = np.empty(num_tokens + 2, dtype=np.int64)
+            next_positions[:num_tokens - 1] = np.arange(2, num_tokens + 1, dtype=np.int64)
+            next_positions[:num_tokens - 1] += tokens[1:]
+            next_positions[num_tokens - 1:] = num_tokens + 1
+            np.minimum(next_positions, num_tokens + 1, out=next_positions)
+            next_positions[num_tokens] = num_tokens
+            next_positions = next_positions.astype(index_dtype)
+            record_positions = np.ones(1, dtype=index_dtype)
+            while record_positions[-1] < num_tokens:
+                record_positions = np.concatenate((record_positions, next_positions[record_positions]))
+                next_positions = next_positions[next_positions]
+            del next_positions
+
+            is_complete = record_positions[-1] == num_tokens
+            record_positions = record_positions[record_positions < num_tokens]
+
+            # basic check - last record is complete
+            if not is_complete:
+                raise ToolError("Incomplete description of link id {0} in file '{1}'.".format(
+                    tokens[record_positions[-1]], rvr_file_path))
+            count_positions = record_positions.astype(np.int64) + 1
+            del record_positions
+            num_links = count_positions.size
+
+            # build CSR arrays
+            up_counts = tokens[count_positions]
+            offsets = np.zeros(num_links + 1, dtype=np.int64)
+            np.cumsum(up_counts, out=offsets[1:])
+            up_positions = np.arange(offsets[-1], dtype=np.int64)
+            up_positions += np.repeat(count_positions + 1 - offsets[:-1], up_counts)
+            link_ids = tokens[count_positions - 1]
+            upstream_ids = tokens[up_positions]
+            del tokens, up_positions, count_positions
+
+            return RvrNetwork(link_ids, offsets, upstream_ids, num_links_header=num_links_header).to_arrays()
+
+
+class PrmFile:
+    """
+    Reader of .prm files into NumPy arrays: the link ids (uint32, file order) and a 2-D matrix of float64 with one
+    row of parameters per link (all parameters or only the requested ones).
+
+    Parameters can also be kept in a binary .h5 file (see 'write_binary_file'), accepted by all readers in place of
+    the .prm file. Its arrays are stored as in the sidecar files (see SidecarCache), so they are memory-mapped.
+    """
+
+    _BINARY_EXTENSION = ".h5"
+    _BINARY_VERSION = 1
+
+    @staticmethod
+    def is_binary_file(prm_file_path):
+        """
+
+        :param prm_file_path:
+        :return: True if the file path is of a binary parameters file (.h5), False if of a .prm file
+        """
+
+        return prm_file_path.lower().endswith(PrmFile._BINARY_EXTENSION)
+
+    @staticmethod
+    def read_file(prm_file_path, use_cache=True):
+        """
+
+        :param prm_file_path: File path for the .prm file or for a binary parameters file.
+        :param use_cache: Boolean. If True, the parsed file is kept in a sidecar file (see SidecarCache).
+        :return: Tuple (link ids, parameters matrix), or None if unable to read the file.
+        """
+
+        # basic check
+        if not os.path.exists(prm_file_path):
+            print("File '{0}' does not exits.".format(prm_file_path))
+            return None
+
+        if PrmFile.is_binary_file(prm_file_path):
+            arrays = PrmFile._read_binary_file(prm_file_path)
+        else:
+            arrays = SidecarCache.load(prm_file_path, "prm", PrmFile._parse_file, use_cache=use_cache)
+        if arrays is None:
+            return None
+
+        # basic check
+        num_links = int(arrays["num_links_header"][0])
+        if num_links != arrays["link_ids"].size:
+            print("Be careful! PRM file has a header of '{0}' but describes '{1}' links.".format(
+                num_links, arrays["link_ids"].size))
+
+        return arrays["link_ids"], arrays["parameters"]
+
+    @staticmethod
+    def read_columns(prm_file_path, columns, use_cache=True):
+        """
+        Reads only some parameters of each link. A valid sidecar file is used when available, otherwise the requested
+        columns are taken from the memory-mapped .prm file without converting the others (no sidecar is written, as it
+        keeps all parameters).
+        :param prm_file_path: File path for the .prm file or for a binary parameters file.
+        :param columns: List of integers. Indexes of the parameters (0 is the first parameter).
+        :param use_cache: Boolean. If True, an existing sidecar file (see SidecarCache) is used.
+        :return: Tuple (link ids, parameters matrix with one column per requested parameter), or None if unable to read
+        the file.
+        """
+
+        # basic check
+        if not os.path.exists(prm_file_path):
+            print("File '{0}' does not exits.".format(prm_file_path))
+            return None
+
+        if PrmFile.is_binary_file(prm_file_path):
+            arrays = PrmFile._read_binary_file(prm_file_path)
+            if arrays is None:
+                return None
+        else:
+            arrays = SidecarCache.read(prm_file_path, "prm") if use_cache else None
+        if arrays is not None:
+            num_links = int(arrays["num_links_header"][0])
+            link_ids, parameters = arrays["link_ids"], arrays["parameters"][:, columns]
+        else:
+            prm_header = TextRecordsReader.read_header(prm_file_path, 1)
+            if prm_header is None:
+                return None
+            (num_links_line, ), num_params = prm_header
+            try:
+                num_links = int(num_links_line)
+            except ValueError:
+                print("Invalid header in file '{0}'.".format(prm_file_path))
+                return None
+            records = TextRecordsReader.read_columns(prm_file_path, 1, num_params, [0] + [v + 1 for v in columns])
+            if records is None:
+                return None
+            link_ids, parameters = records[:, 0].astype(np.uint32), np.ascontiguousarray(records[:, 1:])
+
+        # basic check
+        if num_links != link_ids.size:
+            print("Be careful! PRM file has a header of '{0}' but describes '{1}' links.".format(
+                num_links, link_ids.size))
+
+        return link_ids, parameters
+
+    @staticmethod
+    def read_link_ids(prm_file_path, use_cache=True):
+        """
+        Reads only the link ids, from a valid sidecar file if available or from the memory-mapped .prm file.
+        :param prm_file_path: File path for the .prm file or for a binary parameters file.
+        :param use_cache: Boolean. If True, an existing sidecar file (see SidecarCache) is used.
+        :return: Tuple (link ids, number of links in the header), or None if unable to read the file.
+        """
+
+        # basic check
+        if not os.path.exists(prm_file_path):
+            print("File '{0}' does not exits.".format(prm_file_path))
+            return None
+
+        if PrmFile.is_binary_file(prm_file_path):
+            arrays = PrmFile._read_binary_file(prm_file_path)
+            return None if arrays is None else (arrays["link_ids"], int(arrays["num_links_header"][0]))
+
+        arrays = SidecarCache.read(prm_file_path, "prm") if use_cache else None
+        if arrays is not None:
+            return arrays["link_ids"], int(arrays["num_links_header"][0])
+
+        prm_header = TextRecordsReader.read_header(prm_file_path, 1)
+        if prm_header is None:
+            return None
+        (num_links_line, ), num_params = prm_header
+        try:
+            num_links = int(num_links_line)
+        except ValueError:
+            print("Invalid header in file '{0}'.".format(prm_file_path))
+            return None
+        records = TextRecordsReader.read_columns(prm_file_path, 1, num_params, [0])
+        return None if records is None else (records[:, 0].astype(np.uint32), num_links)
+
+    @staticmethod
+    def write_file(prm_file_path, link_ids, parameters, value_formats=None):
+        """
+        Writes a .prm file from arrays in memory (see TextRecordsWriter).
+        :param prm_file_path: File path for the new .prm file.
+        :param link_ids: 1-D array of link ids.
+        :param parameters: 2-D array with one row per link and one column per parameter.
+        :param value_formats: List of '%' formats, one per parameter. If None, all parameters are written as '%r'.
+        :return:
+        """
+
+        with open(prm_file_path, "w") as wfile:
+            wfile.write("{0}\n\n".format(len(link_ids)))
+            TextRecordsWriter.write_blocks(wfile, [(link_ids, parameters)], value_formats=value_formats,
+                                           record_end="\n\n", stage_name="prm_write")
+
+    @staticmethod
+    def write_binary_file(h5_file_path, link_ids, parameters):
+        """
+        Writes the parameters as a binary file: 'link_ids' (uint32) and 'parameters' (float64, one row per link)
+        datasets, uncompressed and contiguous, so readers memory-map them instead of reading them.
+        :param h5_file_path: File path for the new .h5 file.
+        :param link_ids: 1-D array of link ids.
+        :param parameters: 2-D array with one row per link and one column per parameter.
+        :return:
+        """
+
+        with Profiler.stage("h5_write"), h5py.File(h5_file_path, "w") as wfile:
+            wfile.attrs["kind"] = "prm"
+            wfile.attrs["version"] = PrmFile._BINARY_VERSION
+            Profiler.count_dataset(wfile.create_dataset("link_ids", data=np.asarray(link_ids, dtype=np.uint32)))
+            Profiler.count_dataset(wfile.create_dataset("parameters", data=np.asarray(parameters, dtype=np.float64)))
+            wfile.create_dataset("num_links_header", data=np.array([len(link_ids)]))
+
+    @staticmethod
+    def _read_binary_file(h5_file_path):
+        """
+
+        :param h5_file_path: File path for the binary parameters file.
+        :return: Dictionary with 'link_ids', 'parameters' and 'num_links_header' arrays (memory-mapped), None if the
+        file is not valid.
+        """
+
+        try:
+            with Profiler.stage("h5_read"), h5py.File(h5_file_path, "r") as rfile:
+                if (rfile.attrs.get("kind") != "prm") or (rfile.attrs.get("version") != PrmFile._BINARY_VERSION) or \
+                        any([cur_name not in rfile for cur_name in ("link_ids", "parameters", "num_links_header")]):
+                    print("File '{0}' is not a binary parameters file.".format(h5_file_path))
+                    return None
+                array_locations = SidecarCache.locate_arrays(rfile)
+        except OSError:
+            print("Unable to read file '{0}'.".format(h5_file_path))
+            return None
+
+        return SidecarCache.map_arrays(h5_file_path, array_locations)
+
+    @staticmethod
+    def _parse_file(prm_file_path):
+        """
+
+        :param prm_file_path: File path for the .prm file.
+        :return: Dictionary with 'link_ids', 'parameters' and 'num_links_header' arrays, None if file is not valid.
+        """
+
+        # read header
+        prm_header = TextRecordsReader.read_header(prm_file_path, 1)
+        if prm_header is None:
+            return None
+        (num_links_line, ), num_params = prm_header
+        try:
+            num_links = int(num_links_line)
+        except ValueError:
+            print("Invalid header in file '{0}'.".format(prm_file_path))
+            return None
+
+        # read records
+        all_records = list(TextRecordsReader.iterate_blocks(prm_file_path, 1, num_params))
+        if any([cur_records is None for cur_records in all_records]):
+            return None
+        records = np.concatenate(all_records) if all_records else np.empty((0, num_params + 1))
+
+        return {
+            "link_ids": records[:, 0].astype(np.uint32),
+            "parameters": np.ascontiguousarray(records[:, 1:]),
+            "num_links_header": np.array([num_links])
+        }
+
+
+class RecFile:
+    """
+    Reader and writer of .rec files: hl-model id, number of links and time in the first three lines, then a link id
+    line and a states line for each link.
+    """
+
+    _NUM_HEADER_LINES = 3
+    _WRITE_BLOCK_ROWS = 65536
+
+    @staticmethod
+    def read_header(rec_file_path):
+        """
+
+        :param rec_file_path: File path for the .rec file.
+        :return: Tuple (hl-model id, number of links, number of states), None if file is not valid.
+        """
+
+        rec_header = TextRecordsReader.read_header(rec_file_path, RecFile._NUM_HEADER_LINES)
+        if rec_header is None:
+            return None
+        header_lines, num_states = rec_header
+
+        try:
+            return int(header_lines[0]), int(header_lines[1]), num_states
+        except ValueError:
+            print("Invalid header in file '{0}'.".format(rec_file_path))
+            return None
+
+    @staticmethod
+    def iterate_blocks(rec_file_path, num_states, block_rows):
+        """
+        Reads a .rec file in a single streaming pass, filling a preallocated structured array of at most 'block_rows'
+        rows. The same array is reused for every block, so each block must be consumed before asking for the next one.
+        :param rec_file_path: File path for the .rec file.
+        :param num_states: Integer. Number of states of each link, as returned by 'read_header'.
+        :param block_rows: Integer. Maximum number of links of each block.
+        :return: Generator of structured arrays (see SnapshotFile.get_dtype)
+        """
+
+        block = np.empty(max(block_rows, 1), dtype=SnapshotFile.get_dtype(num_states))
+        state_names = block.dtype.names[1:]
+        num_rows = 0
+        for cur_records in TextRecordsReader.iterate_blocks(rec_file_path, RecFile._NUM_HEADER_LINES, num_states):
+            if cur_records is None:
+                raise ValueError("Unable to parse file '{0}'.".format(rec_file_path))
+
+            # copy records to the block, column by column
+            cur_first = 0
+            while cur_first < cur_records.shape[0]:
+                cur_count = min(block.size - num_rows, cur_records.shape[0] - cur_first)
+                cur_slice = slice(num_rows, num_rows + cur_count)
+                block["link_id"][cur_slice] = cur_records[cur_first:cur_first + cur_count, 0]
+                for cur_idx, cur_name in enumerate(state_names, start=1):
+                    block[cur_name][cur_slice] = cur_records[cur_first:cur_first + cur_count, cur_idx]
+                num_rows += cur_count
+                cur_first += cur_count
+                if num_rows == block.size:
+                    yield block
+                    num_rows = 0
+
+        if num_rows > 0:
+            yield block[:num_rows]
+
+    @staticmethod
+    def read_link_ids(rec_file_path):
+        """
+        Reads only the link ids from the memory-mapped .rec file.
+        :param rec_file_path: File path for the .rec file.
+        :return: Tuple (link ids, number of links in the header), None if unable to read the file.
+        """
+
+        # basic check
+        if not os.path.exists(rec_file_path):
+            print("File '{0}' does not exits.".format(rec_file_path))
+            return None
+
+        rec_header = RecFile.read_header(rec_file_path)
+        if rec_header is None:
+            return None
+        _, num_links, num_states = rec_header
+        records = TextRecordsReader.read_columns(rec_file_path, RecFile._NUM_HEADER_LINES, num_states, [0])
+        return None if records is None else (records[:, 0].astype(np.uint32), num_links)
+
+    @staticmethod
+    def read_file(rec_file_path):
+        """
+
+        :param rec_file_path: File path for the .rec file.
+        :return: Tuple (hl-model id, link ids, 2-D array of states with one row per link), None if unable to read the
+        file.
+        """
+
+        # basic check
+        if not os.path.exists(rec_file_path):
+            print("File '{0}' does not exits.".format(rec_file_path))
+            return None
+
+        rec_header = RecFile.read_header(rec_file_path)
+        if rec_header is None:
+            return None
+        hlm_id, num_links, num_states = rec_header
+
+        all_records = list(TextRecordsReader.iterate_blocks(rec_file_path, RecFile._NUM_HEADER_LINES, num_states))
+        if any([cur_records is None for cur_records in all_records]):
+            return None
+        records = np.concatenate(all_records) if all_records else np.empty((0, num_states + 1))
+
+        # basic check
+        if num_links != records.shape[0]:
+            print("REC file '{0}' has a header of '{1}' but describes '{2}' links.".format(
+                rec_file_path, num_links, records.shape[0]))
+            return None
+
+        return hlm_id, records[:, 0].astype(np.uint32), np.ascontiguousarray(records[:, 1:])
+
+    @staticmethod
+    def write_file(rec_file_path, hlm_id, link_ids, states, value_formats=None, block_rows=_WRITE_BLOCK_ROWS):
+        """
+        Writes a .rec file from arrays in memory (see 'write_blocks').
+        :param rec_file_path: File path for the new .rec file.
+        :param hlm_id: Integer. Hillslope-Link model id.
+        :param link_ids: 1-D array of link ids.
+        :param states: 2-D array with one row per link and one column per state.
+        :param value_formats: List of '%' formats, one per state. If None, all states are written as '%r'.
+        :param block_rows: Integer. Number of links formatted at once.
+        :return:
+        """
+
+        RecFile.write_blocks(rec_file_path, hlm_id, len(link_ids), [(link_ids, states)], value_formats=value_formats,
+                             block_rows=block_rows)
+
+    @staticmethod
+    def write_blocks(rec_file_path, hlm_id, num_links, blocks, value_formats=None, block_rows=_WRITE_BLOCK_ROWS):
+        """
+        Writes a .rec file from a sequence of blocks of links (see TextRecordsWriter).
+        :param rec_file_path: File path for the new .rec file.
+        :param hlm_id: Integer. Hillslope-Link model id.
+        :param num_links: Integer. Number of links written in the header.
+        :param blocks: Iterable of tuples (1-D array of link ids, 2-D array with one row per link and one column per
+        state).
+        :param value_formats: List of '%' formats, one per state. If None, all states are written as '%r' (the shortest
+        representation that reads back as the same float).
+        :param block_rows: Integer. Number of links formatted at once.
+        :return:
+        """
+
+        with open(rec_file_path, "w") as wfile:
+            wfile.write("{0}\n{1}\n0.0\n\n".format(hlm_id, num_links))
+            TextRecordsWriter.write_blocks(wfile, blocks, value_formats=value_formats, block_rows=block_rows,
+                                           stage_name="rec_write")
+
+
+class SnapshotFile:
+    """
+    Helpers for snapshot files in Asynch 1.3 format: a 'snapshot' dataset of rows (link_id, state_0, state_1, ...).
+    A snapshot may also have an index: a 'link_id' dataset with its link ids sorted and a 'row' dataset with the row of
+    'snapshot' of each of them.
+    """
+
+    ORDERS = ('input', 'link_id', 'topological')
+    _READ_BLOCK_ROWS = 262144
+
+    @staticmethod
+    def get_dtype(num_states):
+        """
+
+        :param num_states: Integer.
+        :return: NumPy structured data type with 'link_id' and 'num_states' states.
+        """
+
+        dtype_arg = list()
+        dtype_arg.append(("link_id", np.uint32))
+        for cur_idx in range(num_states):
+            dtype_arg.append(("state_{0}".format(cur_idx), np.float64))
+        return np.dtype(dtype_arg)
+
+    @staticmethod
+    def get_row_order(link_ids, order, rvr_network=None):
+        """
+
+        :param link_ids: 1-D array with the link id of each row of a snapshot.
+        :param order: String. One of 'ORDERS': 'input' (rows are kept in their order), 'link_id' (increasing link id) or
+        'topological' (from the headwaters to the outlets, each link before the link it drains to).
+        :param rvr_network: RvrNetwork object with all links of the snapshot. Required for 'topological' order.
+        :return: Array with the rows in the new order, None for 'input' order. Raises ToolError if the order cannot be
+        computed
+        """
+
+        if order == 'input':
+            return None
+        elif order == 'link_id':
+            return np.argsort(link_ids, kind='stable')
+        elif order != 'topological':
+            raise ToolError("Invalid order: '{0}'. Expected one of {1}.".format(order, SnapshotFile.ORDERS))
+
+        if rvr_network is None:
+            raise ToolError("A .rvr file is required for topological order.")
+        link_order = rvr_network.get_topological_order()
+        if link_order.size != rvr_network.num_links:
+            raise ToolError("Unable to sort links topologically: {0} link(s) do not drain to an outlet.".format(
+                rvr_network.num_links - link_order.size))
+        ranks = np.empty(rvr_network.num_links, dtype=np.int64)
+        ranks[link_order] = np.arange(link_order.size)
+        positions = rvr_network.index_of(link_ids)
+        if np.any(positions < 0):
+            raise ToolError("{0} link id(s) of the snapshot not described in the .rvr file (first: {1}).".format(
+                int(np.count_nonzero(positions < 0)), link_ids[positions < 0][0]))
+        return np.argsort(ranks[positions], kind='stable')
+
+    @staticmethod
+    def write_index(wfile, link_ids, layout=None):
+        """
+        Writes the 'link_id' and 'row' datasets of the index of a snapshot.
+        :param wfile: h5py File object opened for writing.
+        :param link_ids: 1-D array with the link id of each row of the 'snapshot' dataset.
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :return:
+        """
+
+        rows = np.argsort(link_ids, kind='stable')
+        layout = Hdf5Layout() if layout is None else layout
+        with Profiler.stage("h5_write"):
+            Profiler.count_dataset(wfile.create_dataset('link_id', data=np.asarray(link_ids, dtype=np.uint32)[rows],
+                                                        **layout.get_dataset_args(rows.shape)))
+            Profiler.count_dataset(wfile.create_dataset('row', data=rows.astype(np.uint32),
+                                                        **layout.get_dataset_args(rows.shape)))
+
+    @staticmethod
+    def read_index(h5_file_path):
+        """
+
+        :param h5_file_path: File path for the .h5 file.
+        :return: Tuple (sorted link ids, row of each of them), None if the file has no index or is not readable.
+        """
+
+        try:
+            with Profiler.stage("h5_read"), h5py.File(h5_file_path, 'r') as rfile:
+                if ('snapshot' in rfile) and ('link_id' in rfile) and ('row' in rfile):
+                    return rfile['link_id'][()], rfile['row'][()].astype(np.int64)
+        except (KeyError, OSError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def read_file(h5_file_path, rows=None):
+        """
+        Reads a snapshot file in Asynch 1.3 format or in Asynch 1.2 format ('index' and 'state' datasets).
+        :param h5_file_path: File path for the .h5 file.
+        :param rows: Sorted array of positions of the links to be read (positions beyond the end of the file are
+        ignored). Only the chunks holding them are read. If None, all links are read.
+        :return: Tuple (hlm id, unix time, link ids, 2-D array of states with one row per link), or None if unable to
+        read the file.
+        """
+
+        # basic check
+        if not os.path.exists(h5_file_path):
+            print("File '{0}' does not exits.".format(h5_file_path))
+            return None
+
+        try:
+            with Profiler.stage("h5_read"), h5py.File(h5_file_path, 'r') as rfile:
+                hlm_id = int(rfile.attrs['model'][0])
+                unix_time = int(rfile.attrs['unix_time'][0])
+                if 'snapshot' in rfile:
+                    snapshot_dataset = rfile['snapshot']
+                    num_links, state_names = snapshot_dataset.shape[0], snapshot_dataset.dtype.names[1:]
+                    if rows is None:
+                        all_ranges = [(v, min(v + SnapshotFile._READ_BLOCK_ROWS, num_links))
+                                      for v in range(0, num_links, SnapshotFile._READ_BLOCK_ROWS)]
+                    else:
+                        rows = np.asarray(rows, dtype=np.int64)
+                        rows = rows[rows < num_links]
+                        all_ranges = SnapshotFile._get_row_ranges(rows, snapshot_dataset.chunks)
+                    num_read = num_links if rows is None else rows.size
+                    link_ids = np.empty(num_read, dtype=np.uint32)
+                    states = np.empty((num_read, len(state_names)), dtype=np.float64)
+                    cur_position = 0
+                    for cur_first, cur_last in all_ranges:
+                        cur_block = snapshot_dataset[cur_first:cur_last]
+                        if rows is not None:
+                            cur_block = cur_block[rows[np.searchsorted(rows, cur_first):
+                                                       np.searchsorted(rows, cur_last)] - cur_first]
+                        cur_slice = slice(cur_position, cur_position + cur_block.size)
+                        link_ids[cur_slice] = cur_block['link_id']
+                        for cur_idx, cur_name in enumerate(state_names):
+                            states[cur_slice, cur_idx] = cur_block[cur_name]
+                        cur_position += cur_block.size
+                elif ('index' in rfile) and ('state' in rfile):
+                    if rows is None:
+                        link_ids = rfile['index'][()].astype(np.uint32)
+                        states = rfile['state'][()].astype(np.float64)
+                    else:
+                        rows = np.asarray(rows, dtype=np.int64)
+                        rows = rows[rows < rfile['index'].shape[0]]
+                        link_ids = rfile['index'][()][rows].astype(np.uint32)
+                        states = rfile['state'][()][rows].astype(np.float64)
+                else:
+                    print("Unable to find 'snapshot' dataset in file '{0}'.".format(h5_file_path))
+                    return None
+        except (IndexError, KeyError, OSError, ValueError):
+            print("Invalid snapshot file '{0}'.".format(h5_file_path))
+            return None
+
+        return hlm_id, unix_time, link_ids, states
+
+    @staticmethod
+    def _get_row_ranges(rows, chunks):
+        """
+        Groups rows into ranges of whole chunks holding at least one of them, consecutive chunks merged up to
+        '_READ_BLOCK_ROWS' rows.
+        :param rows: Sorted array of row positions.
+        :param chunks: Tuple with the chunk shape of the dataset, None if it is contiguous.
+        :return: List of tuples (first row, last row + 1)
+        """
+
+        chunk_rows = SnapshotFile._READ_BLOCK_ROWS if chunks is None else chunks[0]
+        max_chunks = max(SnapshotFile._READ_BLOCK_ROWS // chunk_rows, 1)
+        all_ranges = []
+        for cur_chunk in np.unique(rows // chunk_rows).tolist():
+            if all_ranges and (all_ranges[-1][1] == cur_chunk) and (all_ranges[-1][1] - all_ranges[-1][0] < max_chunks):
+                all_ranges[-1][1] = cur_chunk + 1
+            else:
+                all_ranges.append([cur_chunk, cur_chunk + 1])
+        return [(v[0] * chunk_rows, min(v[1] * chunk_rows, rows[-1] + 1)) for v in all_ranges]
+
+    @staticmethod
+    def read_link_ids(h5_file_path):
+        """
+        Reads only the link ids of a snapshot file in Asynch 1.3 format (from its index if available, otherwise from the
+        'link_id' field) or in Asynch 1.2 format ('index' dataset).
+        :param h5_file_path: File path for the .h5 file.
+        :return: 1-D array of link ids, None if unable to read the file.
+        """
+
+        # basic check
+        if not os.path.exists(h5_file_path):
+            print("File '{0}' does not exits.".format(h5_file_path))
+            return None
+
+        try:
+            with Profiler.stage("h5_read"), h5py.File(h5_file_path, 'r') as rfile:
+                if ('snapshot' in rfile) and ('link_id' in rfile) and ('row' in rfile):
+                    link_ids = np.empty(rfile['snapshot'].shape[0], dtype=np.uint32)
+                    link_ids[rfile['row'][()]] = rfile['link_id'][()]
+                    return link_ids
+                elif 'snapshot' in rfile:
+                    return rfile['snapshot']['link_id'].astype(np.uint32)
+                elif 'index' in rfile:
+                    return rfile['index'][()].astype(np.uint32)
+        except (KeyError, OSError, ValueError):
+            pass
+        print("Unable to find link ids in file '{0}'.".format(h5_file_path))
+        return None
+
+    @staticmethod
+    def write_file(h5_file_path, hlm_id, unix_time, link_ids, states, layout=None):
+        """
+        Writes a snapshot file in Asynch 1.3 format from arrays in memory.
+        :param h5_file_path: File path for the new .h5 file.
+        :param hlm_id: Integer. Hillslope-Link model id.
+        :param unix_time: Integer. Timestamp of the snapshot.
+        :param link_ids: 1-D array of link ids.
+        :param states: 2-D array with one row per link and one column per state.
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :return:
+        """
+
+        snapshot = np.empty(len(link_ids), dtype=SnapshotFile.get_dtype(states.shape[1]))
+        snapshot["link_id"] = link_ids
+        for cur_idx, cur_name in enumerate(snapshot.dtype.names[1:]):
+            snapshot[cur_name] = states[:, cur_idx]
+
+        layout = Hdf5Layout() if layout is None else layout
+        with Profiler.stage("h5_write"), h5py.File(h5_file_path, 'w') as wfile:
+            wfile.attrs.create('model', [hlm_id], dtype='uint16')
+            wfile.attrs.create('unix_time', [unix_time], dtype='uint32')
+            wfile.attrs.create('version', "1.3.2", dtype='S6')
+            Profiler.count_dataset(wfile.create_dataset('snapshot', data=snapshot,
+                                                        **layout.get_dataset_args(snapshot.shape)))
+
+
+class TextRecordsReader:
+    """
+    Bulk reader of the text layout shared by .rec and .prm files: a few header lines, then, for each link, a line with
+    the link id and a line with its values. The file is read in large blocks of full lines and each block is converted
+    at once by NumPy, after checking that its non-blank lines alternate between 1 token and (number of values) tokens.
+    """
+
+    _BLOCK_BYTES = 4 * 1024 * 1024
+    _NEWLINE_SEARCH_BYTES = 64 * 1024
+
+    @staticmethod
+    def check_lines(data, num_values, is_id_line):
+        """
+        Checks the number of tokens of each non-blank line of a block of full lines.
+        :param data: 1-D uint8 array with the bytes of the block.
+        :param num_values: Integer. Number of values in each values line.
+        :param is_id_line: Boolean. True if the first non-blank line of the block is expected to be a link id line.
+        :return: Tuple (True if all lines have the expected number of tokens, True if the first non-blank line after the
+        block is expected to be a link id line)
+        """
+
+        # tokens start at a non-whitespace byte (above 32) after a whitespace byte or at the first byte
+        is_space = data <= 32
+        token_starts = np.flatnonzero(is_space[:-1] & ~is_space[1:]) + 1
+        if (data.size > 0) and not is_space[0]:
+            token_starts = np.concatenate(([0], token_starts))
+        line_ends = np.flatnonzero(data == 10)
+        if (data.size > 0) and (data[-1] != 10):
+            line_ends = np.append(line_ends, data.size)
+        tokens_per_line = np.diff(np.searchsorted(token_starts, line_ends), prepend=0)
+        tokens_per_line = tokens_per_line[tokens_per_line > 0]
+
+        id_lines = tokens_per_line[0::2] if is_id_line else tokens_per_line[1::2]
+        values_lines = tokens_per_line[1::2] if is_id_line else tokens_per_line[0::2]
+        is_valid = np.all(id_lines == 1) and np.all(values_lines == num_values)
+        return bool(is_valid), is_id_line != (tokens_per_line.size % 2 == 1)
+
+    @staticmethod
+    def read_header(file_path, num_header_lines):
+        """
+
+        :param file_path:
+        :param num_header_lines: Integer. Number of non-blank lines of the header.
+        :return: Tuple (list of stripped header lines, number of values of the first record), None if file is empty.
+        """
+
+        header_lines = []
+        is_id_line = True
+        with open(file_path, "r") as rfile:
+            for cur_line in rfile:
+                cur_line = cur_line.strip()
+                if cur_line == "":
+                    continue
+                if len(header_lines) < num_header_lines:
+                    header_lines.append(cur_line)
+                elif is_id_line:
+                    is_id_line = False
+                else:
+                    return header_lines, len(cur_line.split())
+
+        if len(header_lines) < num_header_lines:
+            print("File '{0}' is empty.".format(file_path))
+            return None
+        return header_lines, 0
+
+    @staticmethod
+    def iterate_blocks(file_path, num_header_lines, num_values, block_bytes=_BLOCK_BYTES):
+        """
+
+        :param file_path:
+        :param num_header_lines: Integer. Number of non-blank lines of the header, skipped.
+        :param num_values: Integer. Number of values in each values line.
+        :param block_bytes: Integer. Approximated size of the text blocks converted at once.
+        :return: Generator of 2-D float64 arrays with one row [link id, value_1, value_2, ...] per link. None is
+        generated (and the iteration stops) if the file is not in the expected layout, including a record with missing
+        values or an incomplete last record.
+        """
+
+        record_size = num_values + 1
+        carried_tokens = np.empty(0, dtype=np.float64)
+        is_id_line = True
+        with open(file_path, "rb") as rfile:
+
+            # skip header
+            num_skipped = 0
+            while num_skipped < num_header_lines:
+                cur_line = rfile.readline()
+                if cur_line == b"":
+                    return
+                if cur_line.strip() != b"":
+                    num_skipped += 1
+
+            # read blocks of full lines
+            line_remainder = b""
+            while True:
+                with Profiler.stage("parse"):
+                    cur_data = rfile.read(block_bytes)
+                    if cur_data == b"":
+                        cur_text, line_remainder = line_remainder, b""
+                    else:
+                        cur_cut = cur_data.rfind(b"\n") + 1
+                        cur_text, line_remainder = line_remainder + cur_data[:cur_cut], cur_data[cur_cut:]
+
+                    cur_valid, is_id_line = TextRecordsReader.check_lines(np.frombuffer(cur_text, dtype=np.uint8),
+                                                                          num_values, is_id_line)
+                    try:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("error", DeprecationWarning)
+                            cur_tokens = np.fromstring(cur_text, dtype=np.float64, sep=" ")
+                    except (ValueError, DeprecationWarning):
+                        cur_tokens = None
+
+                if not cur_valid:
+                    print("Records with unexpected number of values in file '{0}'.".format(file_path))
+                    yield None
+                    return
+                if cur_tokens is None:
+                    print("Unexpected content in file '{0}'.".format(file_path))
+                    yield None
+                    return
+
+                # complete records
+                if carried_tokens.size > 0:
+                    cur_tokens = np.concatenate((carried_tokens, cur_tokens))
+                cur_num_records = cur_tokens.size // record_size
+                carried_tokens = cur_tokens[cur_num_records * record_size:].copy()
+                cur_records = cur_tokens[:cur_num_records * record_size].reshape(cur_num_records, record_size)
+
+                # basic check - misaligned records would place values in the link id column
+                cur_ids = cur_records[:, 0]
+                if np.any((cur_ids != np.floor(cur_ids)) | (cur_ids < 0)):
+                    print("Records with unexpected number of values in file '{0}'.".format(file_path))
+                    yield None
+                    return
+
+                if cur_num_records > 0:
+                    yield cur_records
+
+                if cur_data == b"":
+                    break
+
+        if carried_tokens.size > 0:
+            print("Incomplete last record in file '{0}'.".format(file_path))
+            yield None
+
+    @staticmethod
+    def read_columns(file_path, num_header_lines, num_values, columns, block_bytes=_BLOCK_BYTES):
+        """
+        Reads only some columns of the records. The file is memory-mapped and split into tokens by byte comparisons,
+        then the bytes of the tokens not requested are replaced by spaces, so only the requested ones are converted.
+        :param file_path:
+        :param num_header_lines: Integer. Number of non-blank lines of the header, skipped.
+        :param num_values: Integer. Number of values in each values line.
+        :param columns: List of integers. Column 0 is the link id, column 1 is the first value and so on.
+        :param block_bytes: Integer. Approximated size of the text blocks processed at once.
+        :return: 2-D float64 array with one row per link and one column per requested column (in the given order), None
+        if the file is not in the expected layout (see 'iterate_blocks').
+        """
+
+        record_size = num_values + 1
+        sorted_columns = np.unique(columns)
+        if (sorted_columns.size == 0) or (sorted_columns[0] < 0) or (sorted_columns[-1] >= record_size):
+            print("Invalid columns {0} for records of {1} values.".format(list(columns), record_size))
+            return None
+        is_selected = np.zeros(record_size, dtype=bool)
+        is_selected[sorted_columns] = True
+
+        # skip header
+        with open(file_path, "rb") as rfile:
+            num_skipped = 0
+            while num_skipped < num_header_lines:
+                cur_line = rfile.readline()
+                if cur_line == b"":
+                    break
+                if cur_line.strip() != b"":
+                    num_skipped += 1
+            first_byte = rfile.tell()
+
+        file_size = os.path.getsize(file_path)
+        all_values = []
+        num_tokens = 0
+        is_id_line = True
+        with Profiler.stage("parse"):
+            if first_byte < file_size:
+                file_bytes = np.memmap(file_path, dtype=np.uint8, mode="r")
+                cur_first = first_byte
+                while cur_first < file_size:
+
+                    # blocks end after a line break, so no line is split
+                    cur_last = min(cur_first + block_bytes, file_size)
+                    while cur_last < file_size:
+                        cur_breaks = np.flatnonzero(
+                            file_bytes[cur_last:cur_last + TextRecordsReader._NEWLINE_SEARCH_BYTES] == 10)
+                        if cur_breaks.size > 0:
+                            cur_last += int(cur_breaks[0]) + 1
+                            break
+                        cur_last = min(cur_last + TextRecordsReader._NEWLINE_SEARCH_BYTES, file_size)
+                    cur_data = np.asarray(file_bytes[cur_first:cur_last])
+                    cur_first = cur_last
+
+                    cur_valid, is_id_line = TextRecordsReader.check_lines(cur_data, num_values, is_id_line)
+                    if not cur_valid:
+                        print("Records with unexpected number of values in file '{0}'.".format(file_path))
+                        return None
+
+                    # token boundaries
+                    is_space = cur_data <= 32
+                    is_start = ~is_space
+                    is_start[1:] &= is_space[:-1]
+                    is_end = ~is_space
+                    is_end[:-1] &= is_space[1:]
+                    cur_starts = np.flatnonzero(is_start)
+                    cur_ends = np.flatnonzero(is_end) + 1
+
+                    # blank the bytes of the tokens not requested
+                    cur_keep = is_selected[(num_tokens + np.arange(cur_starts.size)) % record_size]
+                    num_tokens += cur_starts.size
+                    cur_num_kept = int(np.count_nonzero(cur_keep))
+                    if cur_num_kept == 0:
+                        continue
+                    cur_marks = np.zeros(cur_data.size + 1, dtype=np.int8)
+                    cur_marks[cur_starts[~cur_keep]] = 1
+                    cur_marks[cur_ends[~cur_keep]] = -1
+                    cur_text = cur_data.copy()
+                    cur_text[np.cumsum(cur_marks[:-1], dtype=np.int8).view(bool)] = 32
+
+                    try:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("error", DeprecationWarning)
+                            cur_values = np.fromstring(cur_text.tobytes(), dtype=np.float64, sep=" ")
+                    except (ValueError, DeprecationWarning):
+                        cur_values = None
+                    if (cur_values is None) or (cur_values.size != cur_num_kept):
+                        print("Unexpected content in file '{0}'.".format(file_path))
+                        return None
+                    all_values.append(cur_values)
+                del file_bytes
+
+        # complete records only
+        num_records = num_tokens // record_size
+        if num_tokens % record_size != 0:
+            print("Incomplete last record in file '{0}'.".format(file_path))
+            return None
+        values = np.concatenate(all_values) if all_values else np.empty(0, dtype=np.float64)
+        values = values[:num_records * sorted_columns.size].reshape(num_records, sorted_columns.size)
+
+        # basic check - misaligned records would place values in the link id column
+        if is_selected[0] and np.any((values[:, 0] != np.floor(values[:, 0])) | (values[:, 0] < 0)):
+            print("Records with unexpected number of values in file '{0}'.".format(file_path))
+            return None
+
+        return values[:, np.searchsorted(sorted_columns, columns)]
+
+
+class TextRecordsWriter:
+    """
+    Bulk writer of the text layout shared by .rec and .prm files (see TextRecordsReader). Links are formatted in parts
+    of 'block_rows' links with a single '%' operation, and values that are constant in a part are formatted once and
+    embedded in the record format.
+    """
+
+    _BLOCK_ROWS = 65536
+
+    @staticmethod
+    def write_blocks(wfile, blocks, value_formats=None, block_rows=_BLOCK_ROWS, record_end="\n",
+                     stage_name="text_write"):
+        """
+
+        :param wfile: File object opened for writing, after the header.
+        :param blocks: Iterable of tuples (1-D array of link ids, 2-D array with one row per link and one column per
+        value).
+        :param value_formats: List of '%' formats, one per value. If None, all values are written as '%r' (the shortest
+        representation that reads back as the same float).
+        :param block_rows: Integer. Number of links formatted at once.
+        :param record_end: String written after the values line of each link.
+        :param stage_name: String. Name of the profiled stage (see Profiler).
+        :return:
+        """
+
+        for link_ids, values in blocks:
+            num_values = values.shape[1]
+            cur_value_formats = ["%r"] * num_values if value_formats is None else value_formats
+            for cur_first in range(0, len(link_ids), block_rows):
+                cur_last = min(cur_first + block_rows, len(link_ids))
+                cur_values = values[cur_first:cur_last]
+
+                # constant values are formatted only once
+                cur_formats = list(cur_value_formats)
+                cur_variables = []
+                for cur_idx in range(num_values):
+                    if np.all(cur_values[:, cur_idx] == cur_values[0, cur_idx]):
+                        cur_value = cur_value_formats[cur_idx] % cur_values[0, cur_idx].item()
+                        cur_formats[cur_idx] = cur_value.replace("%", "%%")
+                    else:
+                        cur_variables.append(cur_idx)
+                record_format = "%d\n" + " ".join(cur_formats) + record_end
+
+                with Profiler.stage(stage_name):
+                    cur_items = np.empty((cur_last - cur_first, len(cur_variables) + 1), dtype=object)
+                    cur_items[:, 0] = link_ids[cur_first:cur_last].tolist()
+                    cur_items[:, 1:] = cur_values[:, cur_variables].tolist()
+                    wfile.write((record_format * (cur_last - cur_first)) % tuple(cur_items.ravel().tolist()))
+
+
+class Hdf5Layout:
+    """
+    Storage options of the datasets written by the converters: compression filter, shuffle, fletcher32 checksum and
+    number of rows of each chunk. Default is gzip (level 5) compression with chunks chosen by h5py, except for datasets
+    of more than one dimension, chunked by rows so each row is in a single chunk.
+    """
+
+    _COMPRESSIONS = ("none", "lzf", "gzip")
+    _DEFAULT_CHUNK_ROWS = 16384
+
+    def __init__(self, compression="gzip", gzip_level=5, shuffle=False, fletcher32=False, chunk_rows=None):
+        """
+
+        :param compression: String. One of 'none', 'lzf' or 'gzip'.
+        :param gzip_level: Integer from 0 to 9. Only used if compression is 'gzip'.
+        :param shuffle: Boolean. If True, applies the shuffle filter before compression.
+        :param fletcher32: Boolean. If True, adds a checksum to each chunk.
+        :param chunk_rows: Integer. Number of rows of each chunk. If None, chunks are chosen by h5py when needed (see
+        above).
+        """
+
+        self.compression = compression
+        self.gzip_level = gzip_level
+        self.shuffle = shuffle
+        self.fletcher32 = fletcher32
+        self.chunk_rows = chunk_rows
+
+    def get_dataset_args(self, shape):
+        """
+
+        :param shape: Tuple. Shape of the dataset to be created.
+        :return: Dictionary of keyword arguments for h5py 'create_dataset'.
+        """
+
+        dataset_args = {}
+        if self.compression == "gzip":
+            dataset_args["compression"] = "gzip"
+            dataset_args["compression_opts"] = self.gzip_level
+        elif self.compression == "lzf":
+            dataset_args["compression"] = "lzf"
+        if self.shuffle:
+            dataset_args["shuffle"] = True
+        if self.fletcher32:
+            dataset_args["fletcher32"] = True
+        if (self.chunk_rows is not None) or (len(shape) > 1):
+            chunk_rows = Hdf5Layout._DEFAULT_CHUNK_ROWS if self.chunk_rows is None else self.chunk_rows
+            dataset_args["chunks"] = (max(1, min(chunk_rows, shape[0])), ) + tuple(max(1, v) for v in shape[1:])
+        return dataset_args
+
+    @staticmethod
+    def get_slice_rows(num_rows, row_bytes, memory_budget_mb, in_chunk_rows=None, out_chunk_rows=None):
+        """
+        Defines the number of rows converted at once: as many as fit the memory budget, rounded down to a multiple of
+        the chunk rows of both datasets (or of the input dataset only, if both cannot be matched within the budget), so
+        each chunk is read and written only once.
+        :param num_rows: Integer. Number of rows of the snapshot.
+        :param row_bytes: Integer. Bytes of an input row plus an output row.
+        :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+        :param in_chunk_rows: Integer. Rows of each chunk of the input dataset, None if not chunked.
+        :param out_chunk_rows: Integer. Rows of each chunk of the output dataset, None if not chunked.
+        :return: Integer
+        """
+
+        budget_rows = max(1, int(memory_budget_mb * 1024 * 1024) // row_bytes)
+        align_rows = 1
+        for cur_chunk_rows in (in_chunk_rows, out_chunk_rows):
+            if cur_chunk_rows is None:
+                continue
+            cur_align_rows = align_rows * cur_chunk_rows // math.gcd(align_rows, cur_chunk_rows)
+            if cur_align_rows > budget_rows:
+                break
+            align_rows = cur_align_rows
+        if in_chunk_rows is not None:
+            align_rows = max(align_rows, in_chunk_rows)
+        return min(max(align_rows, budget_rows // align_rows * align_rows), max(num_rows, 1))
+
+    @staticmethod
+    def from_args(sys_args):
+        """
+        Reads the '-compression', '-gzip_level', '-shuffle', '-fletcher32' and '-chunk' arguments.
+        :param sys_args: Array of string. Usually sys.argv.
+        :return: A Hdf5Layout object, None if some argument is invalid.
+        """
+
+        compression = ArgumentsManager.get_str(sys_args, "-compression")
+        if compression is None:
+            compression = "gzip"
+        elif compression not in Hdf5Layout._COMPRESSIONS:
+            print("Invalid '-compression' argument: '{0}'. Expected one of {1}.".format(compression,
+                                                                                      Hdf5Layout._COMPRESSIONS))
+            return None
+
+        gzip_level = ArgumentsManager.get_int(sys_args, "-gzip_level")
+        if gzip_level is None:
+            gzip_level = 5
+        elif not (0 <= gzip_level <= 9):
+            print("Invalid '-gzip_level' argument: '{0}'. Expected a value from 0 to 9.".format(gzip_level))
+            return None
+
+        chunk_rows = ArgumentsManager.get_int(sys_args, "-chunk")
+        if (chunk_rows is not None) and (chunk_rows < 1):
+            print("Invalid '-chunk' argument: '{0}'. Expected a positive integer.".format(chunk_rows))
+            return None
+
+        return Hdf5Layout(compression=compression, gzip_level=gzip_level, shuffle="-shuffle" in sys_args,
+                          fletcher32="-fletcher32" in sys_args, chunk_rows=chunk_rows)
+
+    @staticmethod
+    def print_help():
+        """
+        Prints the description of the arguments read by 'from_args'.
+        :return:
+        """
+
+        print("  H5_OPTIONS  : Any of the following, for the written .h5 datasets:")
+        print("    -compression COMP : 'none', 'lzf' or 'gzip'. If not provided, it is assumed 'gzip'.")
+        print("    -gzip_level LEVEL : Level of gzip compression, from 0 to 9. If not provided, it is assumed 5.")
+        print("    -shuffle          : If provided, applies the shuffle filter before compression.")
+        print("    -fletcher32       : If provided, adds a checksum to each chunk.")
+        print("    -chunk ROWS       : Number of rows of each chunk. If not provided, it is chosen by h5py ({0} rows for the 2-D 'state' dataset of Asynch 1.2 files).".format(Hdf5Layout._DEFAULT_CHUNK_ROWS))
+
+
+class SidecarCache:
+    """
+    Keeps the parsed content of a text input file (a dictionary of NumPy arrays) in a binary sidecar file named
+    '<input file path>.cache.h5'. The sidecar records size, modification time and SHA-1 hash of the input file and is
+    discarded when they do not match anymore. Arrays are stored uncompressed and contiguous, so they are memory-mapped
+    instead of read when loaded.
+    """
+
+    _CACHE_VERSION = 1
+    _FILE_EXTENSION = ".cache.h5"
+
+    @staticmethod
+    def get_file_path(source_file_path):
+        """
+
+        :param source_file_path:
+        :return: File path of the sidecar file of the given input file.
+        """
+
+        return source_file_path + SidecarCache._FILE_EXTENSION
+
+    @staticmethod
+    def load(source_file_path, kind, parse_function, use_cache=True):
+        """
+        Gets the parsed content of a file, from its sidecar when valid or by parsing it (and updating the sidecar).
+        :param source_file_path: File path of the input file.
+        :param kind: String identifying the parser (example: 'rvr'). Sidecars of other kinds are not reused.
+        :param parse_function: Function receiving the file path and returning a dictionary of arrays (or None).
+        :param use_cache: Boolean. If False, the file is parsed and the sidecar is neither read nor written.
+        :return: Dictionary of arrays, or None if the parse function returned None
+        """
+
+        if not use_cache:
+            return parse_function(source_file_path)
+
+        cache_file_path = SidecarCache.get_file_path(source_file_path)
+        with Profiler.stage("cache_read"):
+            arrays = SidecarCache._read(cache_file_path, source_file_path, kind)
+        if arrays is not None:
+            return arrays
+
+        arrays = parse_function(source_file_path)
+        if arrays is not None:
+            with Profiler.stage("cache_write"):
+                SidecarCache._write(cache_file_path, source_file_path, kind, arrays)
+        return arrays
+
+    @staticmethod
+    def read(source_file_path, kind):
+        """
+        Gets the parsed content of a file from its sidecar only.
+        :param source_file_path: File path of the input file.
+        :param kind: String identifying the parser (example: 'rvr').
+        :return: Dictionary of arrays, None if the sidecar does not exist or is outdated
+        """
+
+        with Profiler.stage("cache_read"):
+            return SidecarCache._read(SidecarCache.get_file_path(source_file_path), source_file_path, kind)
+
+    @staticmethod
+    def get_file_hash(file_path):
+        """
+
+        :param file_path:
+        :return: String with the hexadecimal SHA-1 digest of the file content.
+        """
+
+        file_hash = hashlib.sha1()
+        with open(file_path, "rb") as rfile:
+            for cur_block in iter(lambda: rfile.read(4 * 1024 * 1024), b""):
+                file_hash.update(cur_block)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def _read(cache_file_path, source_file_path, kind):
+        """
+
+        :param cache_file_path:
+        :param source_file_path:
+        :param kind:
+        :return: Dictionary of (memory-mapped) arrays, None if sidecar does not exist or is outdated.
+        """
+
+        if not os.path.exists(cache_file_path):
+            return None
+
+        source_stat = os.stat(source_file_path)
+        try:
+            with h5py.File(cache_file_path, "r") as hdf_file:
+                if (hdf_file.attrs["cache_version"] != SidecarCache._CACHE_VERSION) or \
+                        (hdf_file.attrs["kind"] != kind) or (hdf_file.attrs["source_size"] != source_stat.st_size):
+                    return None
+                same_mtime = hdf_file.attrs["source_mtime_ns"] == source_stat.st_mtime_ns
+                source_hash = hdf_file.attrs["source_sha1"]
+                array_locations = SidecarCache.locate_arrays(hdf_file)
+        except (OSError, KeyError):
+            return None
+
+        # file touched but not changed (copied, checked out...): keep the sidecar and update its mtime
+        if not same_mtime:
+            if SidecarCache.get_file_hash(source_file_path) != source_hash:
+                return None
+            try:
+                with h5py.File(cache_file_path, "r+") as hdf_file:
+                    hdf_file.attrs["source_mtime_ns"] = source_stat.st_mtime_ns
+            except OSError:
+                pass
+
+        return SidecarCache.map_arrays(cache_file_path, array_locations)
+
+    @staticmethod
+    def locate_arrays(hdf_file):
+        """
+        Finds where the datasets of a .h5 file are stored. Contiguous uncompressed datasets are located by their offset
+        in the file, the others (as empty ones, never allocated) are read.
+        :param hdf_file: h5py File object.
+        :return: Dictionary of tuples (offset or None, dtype, shape, values or None), one per dataset
+        """
+
+        array_locations = {}
+        for cur_name, cur_dataset in hdf_file.items():
+            array_locations[cur_name] = (cur_dataset.id.get_offset(), cur_dataset.dtype, cur_dataset.shape,
+                                         cur_dataset[()] if cur_dataset.id.get_offset() is None else None)
+        return array_locations
+
+    @staticmethod
+    def map_arrays(hdf_file_path, array_locations):
+        """
+
+        :param hdf_file_path: File path of the .h5 file, closed.
+        :param array_locations: Dictionary as returned by 'locate_arrays'.
+        :return: Dictionary of arrays, memory-mapped when they have an offset
+        """
+
+        arrays = {}
+        for cur_name, (cur_offset, cur_dtype, cur_shape, cur_values) in array_locations.items():
+            if cur_offset is None:
+                arrays[cur_name] = cur_values
+            else:
+                arrays[cur_name] = np.memmap(hdf_file_path, mode="r", dtype=cur_dtype, offset=cur_offset,
+                                             shape=cur_shape)
+        return arrays
+
+    @staticmethod
+    def _write(cache_file_path, source_file_path, kind, arrays):
+        """
+
+        :param cache_file_path:
+        :param source_file_path:
+        :param kind:
+        :param arrays:
+        :return: True if sidecar was written, False otherwise
+        """
+
+        source_stat = os.stat(source_file_path)
+        temp_file_path = "{0}.{1}.tmp".format(cache_file_path, os.getpid())
+        try:
+            with h5py.File(temp_file_path, "w") as hdf_file:
+                hdf_file.attrs["cache_version"] = SidecarCache._CACHE_VERSION
+                hdf_file.attrs["kind"] = kind
+                hdf_file.attrs["source_size"] = source_stat.st_size
+                hdf_file.attrs["source_mtime_ns"] = source_stat.st_mtime_ns
+                hdf_file.attrs["source_sha1"] = SidecarCache.get_file_hash(source_file_path)
+                for cur_name, cur_array in arrays.items():
+                    hdf_file.create_dataset(cur_name, data=cur_array)
+            os.replace(temp_file_path, cache_file_path)
+        except OSError:
+            print("Unable to write cache file '{0}'.".format(cache_file_path))
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            return False
+
+        return True
+
+
+class JobsRunner:
+    """
+    Runs the same function over a list of jobs, sequentially or in a bounded pool of processes, and summarizes results.
+    Jobs can be grouped so that related jobs run in the same process.
+    """
+
+    @staticmethod
+    def run(function, jobs, num_workers=1, groups=None):
+        """
+
+        :param function: Module-level function called as 'function(*job_args)' for each job, returning True on success
+        or raising an exception.
+        :param jobs: List of tuples (job label, job args tuple).
+        :param num_workers: Integer. Maximum number of processes running jobs at the same time.
+        :param groups: List with a key for each job. Jobs with the same key run one after the other in the same process
+        (so they can share what the process keeps in memory). If None, each job is a group.
+        :return: List of tuples (job label, success boolean, error message or None), in the order of 'jobs'
+        """
+
+        # jobs of each group, groups in order of first appearance
+        groups = list(range(len(jobs))) if groups is None else groups
+        all_groups = {}
+        for cur_position, cur_key in enumerate(groups):
+            all_groups.setdefault(cur_key, []).append(cur_position)
+        all_groups = sorted(all_groups.values(), key=lambda v: v[0])
+
+        all_results = [None] * len(jobs)
+        if (num_workers is None) or (num_workers <= 1) or (len(all_groups) <= 1):
+            for cur_positions in all_groups:
+                cur_results, _, _ = JobsRunner._run_group(function, [jobs[v][1] for v in cur_positions])
+                for cur_position, cur_result in zip(cur_positions, cur_results):
+                    all_results[cur_position] = cur_result
+        else:
+            # workers profile their jobs if this process is profiled, and their stages and counters are accumulated here
+            profiler = Profiler._active
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                all_futures = [executor.submit(JobsRunner._run_group, function, [jobs[v][1] for v in cur_positions],
+                                               profiler is not None) for cur_positions in all_groups]
+                for cur_positions, cur_future in zip(all_groups, all_futures):
+                    cur_results, cur_stages, cur_counters = cur_future.result()
+                    for cur_position, cur_result in zip(cur_positions, cur_results):
+                        all_results[cur_position] = cur_result
+                    if profiler is not None:
+                        profiler.merge(OrderedDict([("workers/" + k, v) for k, v in cur_stages.items()]),
+                                       counters=cur_counters)
+
+        Profiler.count("jobs", len(jobs))
+        Profiler.count("failed_jobs", len([v for v in all_results if not v[0]]))
+        return [(cur_label, cur_ok, cur_msg) for (cur_label, _), (cur_ok, cur_msg) in zip(jobs, all_results)]
+
+    @staticmethod
+    def print_summary(all_results):
+        """
+
+        :param all_results: List of tuples as returned by 'run'.
+        :return: True if all jobs succeeded, False otherwise
+        """
+
+        num_fails = 0
+        for cur_label, cur_ok, cur_msg in all_results:
+            if cur_ok:
+                print("  OK   : {0}".format(cur_label))
+            else:
+                num_fails += 1
+                print("  FAIL : {0}{1}".format(cur_label, "" if cur_msg is None else " ({0})".format(cur_msg)))
+        print("Succeeded {0} of {1} jobs.".format(len(all_results) - num_fails, len(all_results)))
+
+        return num_fails == 0
+
+    @staticmethod
+    def _run_group(function, all_job_args, profile=False):
+        """
+
+        :param function:
+        :param all_job_args: List of job args tuples.
+        :param profile: Boolean. If True, jobs are profiled (see Profiler).
+        :return: Tuple (list of tuples (success boolean, error message or None), dictionary of profiled stages,
+        dictionary of counters)
+        """
+
+        if not profile:
+            return [JobsRunner._run_job(function, cur_args) for cur_args in all_job_args], {}, {}
+
+        with Profiler("worker") as profiler:
+            all_results = [JobsRunner._run_job(function, cur_args) for cur_args in all_job_args]
+        profiler.stages["total"] = dict(profiler.total, calls=len(all_job_args))
+        return all_results, profiler.stages, profiler.counters
+
+    @staticmethod
+    def _run_job(function, job_args):
+        """
+
+        :param function:
+        :param job_args:
+        :return: Tuple (success boolean, error message or None)
+        """
+
+        try:
+            return function(*job_args) is True, None
+        except ToolError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, "{0}: {1}".format(type(e).__name__, e)
+
+
+class SharedArrays:
+    """
+    NumPy arrays kept in shared memory blocks, so that pool processes read and write them without copies. The process
+    that creates them owns the blocks and releases them when leaving its 'with' statement; pool processes attach to
+    them with the dictionary returned by 'describe'. Views of the arrays must not outlive the 'with' statement.
+    """
+
+    def __init__(self, all_blocks, all_specs, is_owner):
+        """
+
+        :param all_blocks: Dictionary of SharedMemory objects, by array name.
+        :param all_specs: Dictionary of tuples (shape, dtype string), by array name.
+        :param is_owner: Boolean. If True, blocks are unlinked when closed.
+        """
+
+        self._blocks = all_blocks
+        self._specs = all_specs
+        self._is_owner = is_owner
+        self.arrays = dict([(k, np.ndarray(all_specs[k][0], dtype=all_specs[k][1], buffer=v.buf))
+                            for k, v in all_blocks.items()])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @staticmethod
+    def create(arrays):
+        """
+        Copies arrays into new shared memory blocks.
+        :param arrays: Dictionary of arrays, by name.
+        :return: A SharedArrays object owning the blocks
+        """
+
+        all_blocks, all_specs = {}, {}
+        try:
+            for cur_name, cur_array in arrays.items():
+                cur_array = np.ascontiguousarray(cur_array)
+                all_blocks[cur_name] = shared_memory.SharedMemory(create=True, size=max(cur_array.nbytes, 1))
+                all_specs[cur_name] = (cur_array.shape, cur_array.dtype.str)
+                np.ndarray(cur_array.shape, dtype=cur_array.dtype, buffer=all_blocks[cur_name].buf)[...] = cur_array
+        except (OSError, ValueError) as e:
+            for cur_block in all_blocks.values():
+                cur_block.close()
+                cur_block.unlink()
+            raise ToolError("Unable to allocate shared memory: {0}".format(e))
+        return SharedArrays(all_blocks, all_specs, True)
+
+    @staticmethod
+    def attach(description):
+        """
+
+        :param description: Dictionary as returned by 'describe'.
+        :return: A SharedArrays object using the blocks of another process
+        """
+
+        all_blocks = dict([(k, shared_memory.SharedMemory(name=v[0])) for k, v in description.items()])
+        return SharedArrays(all_blocks, dict([(k, v[1:]) for k, v in description.items()]), False)
+
+    def describe(self):
+        """
+
+        :return: Dictionary of tuples (block name, shape, dtype string), by array name, to be sent to other processes
+        """
+
+        return dict([(k, (v.name, ) + self._specs[k]) for k, v in self._blocks.items()])
+
+    def close(self):
+        """
+        Releases the blocks of this process (and removes them if it owns them).
+        :return:
+        """
+
+        self.arrays = {}
+        for cur_block in self._blocks.values():
+            cur_block.close()
+            if self._is_owner:
+                cur_block.unlink()
+        self._blocks = {}
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, peak resident memory and bytes read/written by each stage of a tool. Functions mark
+    their stages with 'Profiler.stage(name)', recorded by the active profiler (stages nested in other stages are named
+    'outer/inner'), and at no cost if there is none. A profiler is active inside a 'with Profiler(name)' block.
+    """
+
+    _active = None
+
+    def __init__(self, name):
+        """
+
+        :param name: String. Name of the profiled tool or job, written in the report.
+        """
+
+        self.name = name
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.total = None
+        self._path = []
+        self._previous = None
+        self._start_usage = None
+
+    def __enter__(self):
+        self._previous, Profiler._active = Profiler._active, self
+        self._start_usage = Profiler.get_usage()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.total = Profiler._get_difference(Profiler.get_usage(), self._start_usage)
+        self.total["peak_rss_mb"] = Profiler.get_peak_rss_mb()
+        Profiler._active = self._previous
+        return False
+
+    @staticmethod
+    @contextmanager
+    def stage(name):
+        """
+        Context manager recording a stage in the active profiler. Repeated stages are accumulated.
+        :param name: String. Example: 'parse'.
+        :return:
+        """
+
+        profiler = Profiler._active
+        if profiler is None:
+            yield
+            return
+
+        profiler._path.append(name)
+        stage_name = "/".join(profiler._path)
+        start_usage = Profiler.get_usage()
+        try:
+            yield
+        finally:
+            profiler._path.pop()
+            stage_usage = Profiler._get_difference(Profiler.get_usage(), start_usage)
+            stage_usage["calls"] = 1
+            stage_usage["peak_rss_mb"] = Profiler.get_peak_rss_mb()
+            profiler.merge({stage_name: stage_usage})
+
+    @staticmethod
+    def count(name, value=1):
+        """
+        Adds a value to a counter of the active profiler (example: number of links or files).
+        :param name: String.
+        :param value: Number.
+        :return:
+        """
+
+        profiler = Profiler._active
+        if profiler is not None:
+            profiler.counters[name] = profiler.counters.get(name, 0) + value
+
+    @staticmethod
+    def count_dataset(dataset):
+        """
+        Flushes the file of a dataset being written, so pending chunks are compressed within the current stage, and
+        counts the raw and stored bytes of the dataset in the active profiler.
+        :param dataset: h5py Dataset object.
+        :return:
+        """
+
+        if Profiler._active is None:
+            return
+        dataset.file.flush()
+        Profiler.count("h5_raw_bytes", int(dataset.size) * dataset.dtype.itemsize)
+        Profiler.count("h5_stored_bytes", int(dataset.id.get_storage_size()))
+
+    def merge(self, stages, counters=None):
+        """
+        Accumulates stages and counters recorded elsewhere (for example, by a worker process).
+        :param stages: Dictionary of stage name to usage dictionary, as in 'stages'.
+        :param counters: Dictionary of counter name to value, as in 'counters'. If None, no counter is accumulated.
+        :return:
+        """
+
+        for cur_name, cur_value in ({} if counters is None else counters).items():
+            self.counters[cur_name] = self.counters.get(cur_name, 0) + cur_value
+
+        for cur_name, cur_usage in stages.items():
+            if cur_name not in self.stages:
+                self.stages[cur_name] = dict(cur_usage)
+                continue
+            cur_stage = self.stages[cur_name]
+            for cur_key, cur_value in cur_usage.items():
+                if cur_key == "peak_rss_mb":
+                    cur_stage[cur_key] = max(cur_stage[cur_key], cur_value)
+                else:
+                    cur_stage[cur_key] += cur_value
+
+    def to_dict(self):
+        """
+
+        :return: Dictionary with the 'total' usage, the usage of each stage (with read/write throughput) and the
+        counters (with their rate per second of total wall time and the compression ratio of written datasets)
+        """
+
+        all_stages = OrderedDict()
+        for cur_name, cur_usage in self.stages.items():
+            cur_stage = OrderedDict(sorted(cur_usage.items()))
+            cur_stage["read_mb_s"] = Profiler._get_rate(cur_usage["read_bytes"] / 1048576.0, cur_usage["wall_s"])
+            cur_stage["written_mb_s"] = Profiler._get_rate(cur_usage["written_bytes"] / 1048576.0, cur_usage["wall_s"])
+            all_stages[cur_name] = cur_stage
+
+        total_wall = None if self.total is None else self.total["wall_s"]
+        all_counters = OrderedDict()
+        for cur_name, cur_value in self.counters.items():
+            all_counters[cur_name] = cur_value
+            if not cur_name.endswith("_bytes"):
+                all_counters[cur_name + "_per_s"] = Profiler._get_rate(cur_value, total_wall)
+        if self.counters.get("h5_stored_bytes"):
+            all_counters["h5_compression_ratio"] = \
+                self.counters["h5_raw_bytes"] / float(self.counters["h5_stored_bytes"])
+
+        return OrderedDict([("name", self.name), ("total", self.total), ("stages", all_stages),
+                            ("counters", all_counters)])
+
+    def write_file(self, json_file_path):
+        """
+
+        :param json_file_path: File path for the new .json file.
+        :return:
+        """
+
+        with open(json_file_path, "w") as wfile:
+            json.dump(self.to_dict(), wfile, indent=2)
+
+    @staticmethod
+    def get_usage():
+        """
+        Reads the current wall clock, CPU time and bytes read/written by this process ('rchar' and 'wchar' of
+        '/proc/self/io' when available, 0 otherwise).
+        :return: Dictionary
+        """
+
+        usage = {"wall_s": time.perf_counter(), "cpu_s": time.process_time(), "read_bytes": 0, "written_bytes": 0}
+        try:
+            with open("/proc/self/io", "r") as rfile:
+                for cur_line in rfile:
+                    if cur_line.startswith("rchar:"):
+                        usage["read_bytes"] = int(cur_line.split()[1])
+                    elif cur_line.startswith("wchar:"):
+                        usage["written_bytes"] = int(cur_line.split()[1])
+        except (IOError, ValueError):
+            pass
+        return usage
+
+    @staticmethod
+    def get_peak_rss_mb():
+        """
+        Reads the peak resident set size from '/proc/self/status' when available, as 'ru_maxrss' may keep the peak of
+        the parent process on Linux.
+        :return: Peak resident set size of this process, in MB (0 if not available on this platform)
+        """
+
+        try:
+            with open("/proc/self/status", "r") as rfile:
+                for cur_line in rfile:
+                    if cur_line.startswith("VmHWM:"):
+                        return int(cur_line.split()[1]) / 1024.0
+        except IOError:
+            pass
+
+        try:
+            import resource
+        except ImportError:
+            return 0.0
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else peak_rss / 1024.0
+
+    @staticmethod
+    def run_main(main_function, sys_args):
+        """
+        Calls the 'main' function of a tool, profiled if the '-profile' argument is given.
+        :param main_function: Function receiving 'sys_args' and returning an exit status.
+        :param sys_args: Array of string. Usually sys.argv.
+        :return: Integer. Exit status returned by 'main_function'
+        """
+
+        profile_file_path = ArgumentsManager.get_str(sys_args, "-profile")
+        if (profile_file_path is None) or ('-h' in sys_args):
+            return main_function(sys_args)
+
+        with Profiler(os.path.basename(sys_args[0])) as profiler:
+            exit_status = main_function(sys_args)
+        profiler.write_file(profile_file_path)
+        print("Wrote file '{0}'.".format(profile_file_path))
+        return exit_status
+
+    @staticmethod
+    def print_help():
+        """
+        Prints the description of the argument read by 'run_main'.
+        :return:
+        """
+
+        print("  -profile PROFILE : File path for a .json file with wall time, CPU time, peak memory and bytes read/written by each stage.")
+
+    @staticmethod
+    def _get_difference(end_usage, start_usage):
+        return dict([(k, end_usage[k] - start_usage[k]) for k in end_usage])
+
+    @staticmethod
+    def _get_rate(value, wall_time):
+        return None if not wall_time else value / wall_time
@@ -0,0 +1,190 @@
+from def_lib import ArgumentsManager, RvrNetwork, PrmFile, RecFile, SnapshotFile, Profiler, ToolError, find_in_sorted
+import numpy as np
+import json
+import sys
+
+file_kinds = ('rvr', 'prm', 'rec', 'h5')
+max_listed_links = 10
+
+
+# ###################################################### DEFS ######################################################## #
+
+def read_link_ids(file_path, kind, use_cache=True):
+    """
+    Reads only the link ids of a file.
+    :param file_path:
+    :param kind: String. One of 'file_kinds'.
+    :param use_cache: Boolean. If True, uses the binary cache files of .rvr and .prm files.
+    :return: Tuple (link ids, number of links in the header or None if the file has no header). Raises ToolError if
+    unable to read file
+    """
+
+    if kind == 'rvr':
+        rvr_network = RvrNetwork.read_file(file_path, use_cache=use_cache)
+        content = None if rvr_network is None else (rvr_network.link_ids, rvr_network.num_links_header)
+    elif kind == 'prm':
+        content = PrmFile.read_link_ids(file_path, use_cache=use_cache)
+    elif kind == 'rec':
+        content = RecFile.read_link_ids(file_path)
+    elif kind == 'h5':
+        link_ids = SnapshotFile.read_link_ids(file_path)
+        content = None if link_ids is None else (link_ids, None)
+    else:
+        raise ToolError("Unknown file kind '{0}'. Expected one of {1}.".format(kind, file_kinds))
+
+    if content is None:
+        raise ToolError("Unable to read file '{0}'.".format(file_path))
+    return content
+
+
+def list_link_ids(link_ids):
+    """
+
+    :param link_ids: List of link ids.
+    :return: String with the first link ids
+    """
+
+    return ", ".join([str(v) for v in link_ids[:max_listed_links]]) + (", ..." if len(link_ids) > max_listed_links
+                                                                        else "")
+
+
+def get_unique_link_ids(link_ids):
+    """
+
+    :param link_ids: 1-D array of link ids.
+    :return: Tuple of arrays (sorted unique link ids, sorted link ids repeated in 'link_ids')
+    """
+
+    sorted_ids = np.sort(link_ids)
+    is_first = np.ones(sorted_ids.size, dtype=bool)
+    is_first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    return sorted_ids[is_first], np.unique(sorted_ids[~is_first])
+
+
+def check_files(all_files, use_cache=True):
+    """
+    Checks that all files describe the same set of links, each link once, as many as declared in their headers. The
+    first file is the reference for the comparisons. Link ids of each file are sorted once and compared with binary
+    searches, unless they are identical to the ones of the reference.
+    :param all_files: List of tuples (kind, file path). Kinds are one of 'file_kinds'.
+    :param use_cache: Boolean. If True, uses the binary cache files of .rvr and .prm files.
+    :return: Dictionary with the report. Its 'valid' field is True if no mismatch was found. Raises ToolError if unable
+    to read a file
+    """
+
+    report = {"files": [], "comparisons": [], "valid": True}
+    ref_kind, ref_file_path, ref_link_ids, ref_unique_ids, ref_duplicated = None, None, None, None, None
+    for cur_kind, cur_file_path in all_files:
+        with Profiler.stage("read"):
+            cur_link_ids, cur_num_links_header = read_link_ids(cur_file_path, cur_kind, use_cache=use_cache)
+        Profiler.count("links", cur_link_ids.size)
+
+        # same link ids in the same order as the reference: nothing else to compare
+        with Profiler.stage("compare"):
+            if (ref_link_ids is not None) and np.array_equal(cur_link_ids, ref_link_ids):
+                cur_unique_ids, cur_duplicated = ref_unique_ids, ref_duplicated
+            else:
+                cur_unique_ids, cur_duplicated = get_unique_link_ids(cur_link_ids)
+        if ref_link_ids is None:
+            ref_kind, ref_file_path, ref_link_ids = cur_kind, cur_file_path, cur_link_ids
+            ref_unique_ids, ref_duplicated = cur_unique_ids, cur_duplicated
+
+        cur_report = {
+            "kind": cur_kind,
+            "file": cur_file_path,
+            "num_links": int(cur_link_ids.size),
+            "num_links_header": cur_num_links_header,
+            "duplicated": cur_duplicated.tolist()
+        }
+        report["files"].append(cur_report)
+        if (cur_num_links_header is not None) and (cur_num_links_header != cur_link_ids.size):
+            print("FAIL: {0} file has a header of {1} links but describes {2} links.".format(
+                cur_kind.upper(), cur_num_links_header, cur_link_ids.size))
+            report["valid"] = False
+        if cur_report["duplicated"]:
+            print("FAIL: {0} file describes {1} link id(s) more than once ({2}).".format(
+                cur_kind.upper(), len(cur_report["duplicated"]), list_link_ids(cur_report["duplicated"])))
+            report["valid"] = False
+
+        if cur_link_ids is ref_link_ids:
+            continue
+        with Profiler.stage("compare"):
+            if cur_unique_ids is ref_unique_ids:
+                missing, extra = [], []
+            else:
+                missing = ref_unique_ids[~find_in_sorted(cur_unique_ids, ref_unique_ids)[1]].tolist()
+                extra = cur_unique_ids[~find_in_sorted(ref_unique_ids, cur_unique_ids)[1]].tolist()
+        report["comparisons"].append({"reference": ref_file_path, "file": cur_file_path, "missing": missing,
+                                      "extra": extra})
+        if missing:
+            print("FAIL: {0} file lacks {1} link id(s) of {2} file ({3}).".format(
+                cur_kind.upper(), len(missing), ref_kind.upper(), list_link_ids(missing)))
+            report["valid"] = False
+        if extra:
+            print("FAIL: {0} file has {1} link id(s) not in {2} file ({3}).".format(
+                cur_kind.upper(), len(extra), ref_kind.upper(), list_link_ids(extra)))
+            report["valid"] = False
+
+    for cur_report in report["files"]:
+        print("  {0}: {1} links{2} - {3}".format(
+            cur_report["kind"].upper(), cur_report["num_links"],
+            "" if cur_report["num_links_header"] is None else " (header: {0})".format(cur_report["num_links_header"]),
+            cur_report["file"]))
+    if report["valid"]:
+        print("Link ids check: SUCCESS")
+    else:
+        print("Link ids check: FAIL")
+    return report
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all files are consistent, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Check if .rvr, .prm and initial state files describe the same links, each one once.")
+        print("Usage: python file_consistency_checker_links.py [-in_rvr RVR_PATH] [-in_prm PRM_PATH] [-in_rec REC_PATH] [-in_h5 H5_PATH] [-report REPORT] [-no_cache] [-profile PROFILE]")
+        print("  RVR_PATH  : Path for a .rvr file. If given, it is the reference for the other files.")
+        print("  PRM_PATH  : Path for a .prm file or a binary parameters file (.h5).")
+        print("  REC_PATH  : Path for a .rec file.")
+        print("  H5_PATH   : Path for a .h5 snapshot file (Asynch 1.2 or 1.3 format).")
+        print("  REPORT    : File path for a .json file with the full lists of mismatching link ids.")
+        print("  -no_cache : If provided, neither reads nor writes the binary cache files of .rvr and .prm files.")
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    all_files = []
+    for cur_kind in file_kinds:
+        cur_file_path = ArgumentsManager.get_str(sys_args, '-in_{0}'.format(cur_kind))
+        if cur_file_path is not None:
+            all_files.append((cur_kind, cur_file_path))
+    report_arg = ArgumentsManager.get_str(sys_args, '-report')
+    use_cache_arg = '-no_cache' not in sys_args
+
+    # basic checks
+    if not all_files:
+        print("Missing '-in_rvr', '-in_prm', '-in_rec' or '-in_h5' argument.")
+        return 1
+
+    try:
+        report = check_files(all_files, use_cache=use_cache_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+
+    if report_arg is not None:
+        with open(report_arg, "w") as wfile:
+            json.dump(report, wfile, indent=2)
+        print("Wrote file '{0}'.".format(report_arg))
+
+    return 0 if report["valid"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
@@ -1,193 +1,380 @@
-﻿from def_lib import ArgumentsManager
-import sys
-import os
-
-
-# ###################################################### HELP ######################################################## #
-
-if '-h' in sys.argv:
-    print("Check if a given .rvr file presents topological inconsistency (loops or downstream bifurcation).")
-    print("Usage: python file_consistency_checker.py -in_rvr RVR_PATH [ -check loop|downbif|all ]")
-    print("  RVR_PATH : Path for .rvr file to be evaluated.")
-    print("  -check   : Use this flag to perform only one type of check. If missing, perform all. NOT IMPLEMENTED YET.")
-    print("IMPORTANT: for big watersheds (50,000 links +), use processing queues (.job file).")
-    quit()
-
-
-# ###################################################### ARGS ######################################################## #
-
-# get arguments
-input_rvr_fpath_arg = ArgumentsManager.get_str(sys.argv, '-in_rvr')
-check_arg = ArgumentsManager.get_str(sys.argv, '-check')
-
-# basic checks
-if input_rvr_fpath_arg is None:
-    print("Missing '-in_rvr' argument.")
-    quit()
-
-if check_arg is not None:
-    if check_arg not in ('loop', 'downbif', 'all'):
-        print("Argument '-check' should be one of {0}.".format(check_arg))
-    quit()
-else:
-    check_arg = 'all'
-
-
-# ###################################################### SYST ######################################################## #
-
-print("Increasing recursion limit size...")
-
-# increase recursion limit
-sys.setrecursionlimit(100000)
-
-
-# ###################################################### DEFS ######################################################## #
-
-def read_rvr_file(rvr_file_path):
-    """
-    Reads .rvr file and converts it into into a dictionary.
-    :param rvr_file_path:
-    :return: Dictionary of integers with format "link_id":[contr_link_id1, contr_link_id2, contr_link_id3, ...]
-    """
-
-    # basic check
-    if not os.path.exists(rvr_file_path):
-        print("File '{0}' does not exits.".format(rvr_file_path))
-        return None
-
-    # build dictionary
-    return_dict = {}
-    with open(rvr_file_path, "r+") as rfile:
-        num_links = None
-        last_linkid = None
-        for cur_line in rfile:
-            cur_line_clear = cur_line.strip()
-
-            # ignore blank lines
-            if cur_line_clear == "":
-                continue
-
-            # get header
-            if num_links is None:
-                num_links = int(cur_line_clear)
-                continue
-
-            cur_line_split = cur_line_clear.split(" ")
-
-            # get link id
-            if (len(cur_line_split) == 1) and (last_linkid is None):
-                last_linkid = int(cur_line_split[0])
-                continue
-
-            # get parent links
-            if last_linkid is not None:
-
-                if len(cur_line_split) == 1:
-                    return_dict[last_linkid] = None
-                else:
-                    return_dict[last_linkid] = [int(v) for v in cur_line_split][1:]
-
-                last_linkid = None
-                continue
-
-    print("Tracked {0} of {1}.".format(len(return_dict.keys()), num_links))
-    return return_dict
-
-
-def check_downstream_bifurcation(network_dictionary):
-    """
-
-    :param network_dictionary:
-    :return:
-    """
-
-    # basic check
-    if network_dictionary is None:
-        return False
-
-    # count drainages
-    counts_drain = {}
-    for cur_up_linkids in network_dictionary.values():
-        if cur_up_linkids is None:
-            continue
-
-        for cur_up_linkid in cur_up_linkids:
-            if cur_up_linkid not in counts_drain.keys():
-                counts_drain[cur_up_linkid] = 0
-            counts_drain[cur_up_linkid] += 1
-
-    # check
-    is_valid = True
-    for cur_link_id, cur_count in counts_drain.items():
-        if cur_count > 1:
-            is_valid = False
-            print("FAIL: Link id {0} is the upstream of {1} links.".format(cur_link_id, cur_count))
-
-    if is_valid:
-        print("Downstream Bifurcation check: SUCCESS")
-    else:
-        print("Downstream Bifurcation check: FAIL")
-    return is_valid
-
-
-def check_loop(network_dictionary):
-    """
-
-    :param network_dictionary:
-    :return:
-    """
-
-    # basic check
-    if network_dictionary is None:
-        return False
-
-    def check_loop_recursive(network_dictionary, root_linkid, current_linkid):
-        """
-
-        :param network_dictionary:
-        :param root_linkid:
-        :param current_linkid:
-        :return:
-        """
-        if root_linkid == current_linkid:
-            print("FAIL: Link id '{0}' has a loop.".format(current_linkid))
-            return False
-
-        if current_linkid not in network_dictionary.keys():
-            print("FAIL: Link id '{0}' not described in rvr file.".format(current_linkid))
-            return False
-
-        upstream_link_ids = network_dictionary[current_linkid]
-
-        # basic check - node
-        if upstream_link_ids is None:
-            return True
-
-        # recursive it
-        all_ok = True
-        for cur_upstream_link_id in upstream_link_ids:
-            cur_rec_ok = check_loop_recursive(network_dictionary, root_linkid, cur_upstream_link_id)
-            all_ok = cur_rec_ok if not cur_rec_ok else all_ok
-
-        return all_ok
-
-    # base call
-    is_valid = True
-    for cur_link_id_down, cur_link_id_ups in network_dictionary.items():
-        if cur_link_id_ups is None:
-            continue
-        for cur_link_id_up in cur_link_id_ups:
-            cur_ok = check_loop_recursive(network_dictionary, cur_link_id_down, cur_link_id_up)
-            is_valid = cur_ok if not cur_ok else is_valid
-
-    if is_valid:
-        print("Looping check: SUCCESS")
-    else:
-        print("Looping check: FAIL")
-    return is_valid
-
-# ###################################################### CALL ######################################################## #
-
-rvr_network = read_rvr_file(input_rvr_fpath_arg)
-check_downstream_bifurcation(rvr_network)
-check_loop(rvr_network)
+﻿from def_lib import ArgumentsManager, RvrNetwork, SharedArrays, Profiler, ToolError
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sys
+
+
+check_options = ('loop', 'downbif', 'all')
+jobs_per_worker = 4
+
+
+# ###################################################### DEFS ######################################################## #
+
+def read_rvr_file(rvr_file_path, use_cache=True):
+    """
+    Reads .rvr file and converts it into a compact array representation.
+    :param rvr_file_path:
+    :param use_cache: Boolean. If True, uses and updates the binary cache file of the .rvr file.
+    :return: RvrNetwork object (see def_lib). Raises ToolError if unable to read file
+    """
+
+    rvr_network = RvrNetwork.read_file(rvr_file_path, use_cache=use_cache)
+    if rvr_network is None:
+        raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+
+    print("Tracked {0} of {1}.".format(rvr_network.num_links, rvr_network.num_links_header))
+    Profiler.count("links", rvr_network.num_links)
+    return rvr_network
+
+
+def check_downstream_bifurcation(rvr_network):
+    """
+
+    :param rvr_network: RvrNetwork object as returned by 'read_rvr_file'.
+    :return: True if no link drains into more than one link, False otherwise
+    """
+
+    # count drainages
+    counts_drain = np.bincount(rvr_network.upstream[rvr_network.upstream >= 0], minlength=rvr_network.num_links)
+
+    # check
+    is_valid = True
+    for cur_position in np.flatnonzero(counts_drain > 1):
+        is_valid = False
+        print("FAIL: Link id {0} is the upstream of {1} links.".format(rvr_network.link_ids[cur_position],
+                                                                       counts_drain[cur_position]))
+
+    if is_valid:
+        print("Downstream Bifurcation check: SUCCESS")
+    else:
+        print("Downstream Bifurcation check: FAIL")
+    return is_valid
+
+
+def find_loops_downstream(rvr_network, stuck_positions=None):
+    """
+    Finds loops in a network in which each link drains into at most one link.
+    Links whose downstream path never reaches an outlet are found by pointer jumping over the 'downstream' array
+    (log2(num. links) vectorized steps), then only those links are walked to extract the loops.
+    :param rvr_network: RvrNetwork object.
+    :param stuck_positions: Array of positions of the links that never reach an outlet. If None, they are found by
+    pointer jumping.
+    :return: List of loops, each one a list of link positions in upstream order
+    """
+
+    if stuck_positions is None:
+        # after k steps, 'jump_to[i]' is the link 2^k links downstream of 'i' (-1 if an outlet is reached before)
+        jump_to = rvr_network.downstream.copy()
+        for _ in range(max(rvr_network.num_links, 1).bit_length()):
+            not_outlet = np.flatnonzero(jump_to >= 0)
+            if not_outlet.size == 0:
+                break
+            jump_to[not_outlet] = jump_to[jump_to[not_outlet]]
+        stuck_positions = np.flatnonzero(jump_to >= 0)
+
+    # walk the links that never reach an outlet: they are in a loop or upstream of one
+    all_loops = []
+    walk_ids = np.zeros(rvr_network.num_links, dtype=np.int64)
+    for cur_walk_id, cur_start in enumerate(stuck_positions.tolist(), start=1):
+        if walk_ids[cur_start] != 0:
+            continue
+        cur_path = []
+        cur_position = cur_start
+        while walk_ids[cur_position] == 0:
+            walk_ids[cur_position] = cur_walk_id
+            cur_path.append(cur_position)
+            cur_position = int(rvr_network.downstream[cur_position])
+        if walk_ids[cur_position] == cur_walk_id:
+            all_loops.append(cur_path[cur_path.index(cur_position):][::-1])
+
+    return all_loops
+
+
+def label_basins(offsets, upstream, is_root, basin, root_positions):
+    """
+    Labels the links upstream of each root with the position of the root, one vectorized step per level, without
+    crossing other roots. Each link must drain into at most one link, so each one is labeled once.
+    :param offsets: Array of CSR offsets, as 'RvrNetwork.offsets'.
+    :param upstream: Array of upstream positions, as 'RvrNetwork.upstream'.
+    :param is_root: Array of booleans with one value per link. True for the roots of all sub-basins.
+    :param basin: Array of int32 with one value per link. Receives the labels.
+    :param root_positions: Array of positions of the roots to be labeled.
+    :return: Integer. Number of labeled links
+    """
+
+    frontier = np.asarray(root_positions, dtype=np.int64)
+    basin[frontier] = frontier
+    num_labeled = frontier.size
+    while frontier.size > 0:
+        up_positions, owners = RvrNetwork.gather_upstream(offsets, upstream, frontier)
+        up_valid = up_positions >= 0
+        up_valid[up_valid] = ~is_root[up_positions[up_valid]]
+        frontier = up_positions[up_valid].astype(np.int64)
+        basin[frontier] = basin[owners[up_valid]]
+        num_labeled += frontier.size
+    return num_labeled
+
+
+def label_basins_shared(shared_description, root_positions):
+    """
+    Runs 'label_basins' in a pool process over the topology arrays kept in shared memory.
+    :param shared_description: Dictionary as returned by 'SharedArrays.describe', with the arrays 'offsets',
+    'upstream', 'is_root' and 'basin'.
+    :param root_positions: Array of positions of the roots to be labeled.
+    :return: Integer. Number of labeled links
+    """
+
+    with SharedArrays.attach(shared_description) as shared:
+        return label_basins(shared.arrays["offsets"], shared.arrays["upstream"], shared.arrays["is_root"],
+                            shared.arrays["basin"], root_positions)
+
+
+def get_stuck_positions(downstream, basin, root_positions):
+    """
+    Merges the labels of all sub-basins. A root drains into an outlet if it is an outlet or if the link it drains to
+    is labeled by a root that drains into an outlet (resolved by pointer jumping over the roots).
+    :param downstream: Array of downstream positions, as 'RvrNetwork.downstream'.
+    :param basin: Array of labels as filled by 'label_basins' (-1 for links not labeled).
+    :param root_positions: Sorted array of positions of all roots.
+    :return: Array of positions of the links that never reach an outlet
+    """
+
+    # root each root drains into (itself for outlets, -1 if the link it drains to is not labeled)
+    root_downstream = downstream[root_positions]
+    parents = np.arange(root_positions.size, dtype=np.int64)
+    not_outlet = root_downstream >= 0
+    parent_labels = basin[root_downstream[not_outlet]]
+    parents[not_outlet] = np.where(parent_labels >= 0, np.searchsorted(root_positions, parent_labels), -1)
+    for _ in range(max(root_positions.size, 1).bit_length()):
+        parents = np.where(parents >= 0, parents[np.maximum(parents, 0)], -1)
+    reach_outlet = parents >= 0
+    reach_outlet[reach_outlet] = downstream[root_positions[parents[reach_outlet]]] < 0
+
+    stuck = basin < 0
+    labeled = np.flatnonzero(~stuck)
+    stuck[labeled] = ~reach_outlet[np.searchsorted(root_positions, basin[labeled])]
+    return np.flatnonzero(stuck)
+
+
+def find_loops_partitioned(rvr_network, num_workers, split_positions=None):
+    """
+    Finds loops in a network in which each link drains into at most one link, splitting it into sub-basins checked in
+    a pool of processes. Each outlet and each split link is the root of a sub-basin. The processes label the links of
+    their sub-basins over topology arrays kept in shared memory, then only the links that never reach an outlet are
+    walked (see 'find_loops_downstream').
+    :param rvr_network: RvrNetwork object.
+    :param num_workers: Integer. Number of processes.
+    :param split_positions: Array of positions of interior links also used as roots, so that large basins are split.
+    :return: List of loops, each one a list of link positions in upstream order
+    """
+
+    is_root = rvr_network.downstream < 0
+    if split_positions is not None:
+        is_root[split_positions] = True
+    root_positions = np.flatnonzero(is_root)
+    print("Checking {0} sub-basins in {1} processes.".format(root_positions.size, num_workers))
+
+    with SharedArrays.create({"offsets": rvr_network.offsets, "upstream": rvr_network.upstream, "is_root": is_root,
+                              "basin": np.full(rvr_network.num_links, -1, dtype=np.int32)}) as shared:
+        with Profiler.stage("label"):
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                all_futures = [executor.submit(label_basins_shared, shared.describe(), v)
+                               for v in np.array_split(root_positions, num_workers * jobs_per_worker) if v.size > 0]
+                num_labeled = sum([v.result() for v in all_futures])
+        with Profiler.stage("merge"):
+            stuck_positions = get_stuck_positions(rvr_network.downstream, shared.arrays["basin"], root_positions)
+    Profiler.count("labeled_links", num_labeled)
+
+    return find_loops_downstream(rvr_network, stuck_positions=stuck_positions)
+
+
+def find_loops_upstream(rvr_network):
+    """
+    Finds loops in any network with a single iterative depth-first search following the upstream links.
+    Links are colored as 'not visited', 'in current path' and 'done', so each link and connection is visited once.
+    :param rvr_network: RvrNetwork object.
+    :return: List of loops, each one a list of link positions in upstream order
+    """
+
+    # link colors: 0 = not visited, 1 = in the current path, 2 = done
+    in_path, done = 1, 2
+    link_colors = np.zeros(rvr_network.num_links, dtype=np.int8)
+    offsets = rvr_network.offsets
+    upstream = rvr_network.upstream
+
+    all_loops = []
+    for cur_root in range(rvr_network.num_links):
+        if link_colors[cur_root] != 0:
+            continue
+
+        link_colors[cur_root] = in_path
+        cur_path = [cur_root]
+        cur_next_edges = [int(offsets[cur_root])]
+        while cur_path:
+            cur_position = cur_path[-1]
+            cur_edge = cur_next_edges[-1]
+
+            # all upstream links evaluated
+            if cur_edge == offsets[cur_position + 1]:
+                link_colors[cur_position] = done
+                cur_path.pop()
+                cur_next_edges.pop()
+                continue
+
+            cur_next_edges[-1] += 1
+            cur_up_position = int(upstream[cur_edge])
+            if cur_up_position < 0:
+                continue
+            elif link_colors[cur_up_position] == 0:
+                # go deeper
+                link_colors[cur_up_position] = in_path
+                cur_path.append(cur_up_position)
+                cur_next_edges.append(int(offsets[cur_up_position]))
+            elif link_colors[cur_up_position] == in_path:
+                # reached a link of the current path again: loop
+                all_loops.append(cur_path[cur_path.index(cur_up_position):])
+
+    return all_loops
+
+
+def check_loop(rvr_network, num_workers=1, split_positions=None):
+    """
+    Looks for loops in linear time and without recursion. When no link drains into more than one link, the check is
+    fully vectorized (see 'find_loops_downstream'), and split into sub-basins checked in parallel if more than one
+    worker is given (see 'find_loops_partitioned'). Otherwise sub-basins are not independent and a depth-first search
+    is performed on the whole network.
+    :param rvr_network: RvrNetwork object as returned by 'read_rvr_file'.
+    :param num_workers: Integer. Number of processes.
+    :param split_positions: Array of positions of interior links that split large basins (if num_workers > 1).
+    :return: True if no loop was found, False otherwise
+    """
+
+    is_valid = True
+
+    # upstream links must be described
+    for cur_linkid in np.unique(rvr_network.upstream_ids[rvr_network.upstream < 0]):
+        print("FAIL: Link id '{0}' not described in rvr file.".format(cur_linkid))
+        is_valid = False
+
+    # look for loops
+    up_positions = rvr_network.upstream[rvr_network.upstream >= 0]
+    if np.any(np.bincount(up_positions, minlength=rvr_network.num_links) > 1):
+        if num_workers > 1:
+            print("Links drain into more than one link: checking the whole network in a single process.")
+        all_loops = find_loops_upstream(rvr_network)
+    elif num_workers > 1:
+        all_loops = find_loops_partitioned(rvr_network, num_workers, split_positions=split_positions)
+    else:
+        all_loops = find_loops_downstream(rvr_network)
+
+    for cur_loop in all_loops:
+        cur_loop_linkids = rvr_network.link_ids[cur_loop + cur_loop[:1]]
+        print("FAIL: Loop through link ids {0}.".format(" -> ".join([str(v) for v in cur_loop_linkids])))
+        is_valid = False
+
+    if is_valid:
+        print("Looping check: SUCCESS")
+    else:
+        print("Looping check: FAIL")
+    return is_valid
+
+
+def check_network(rvr_network, check='all', num_workers=1, split_link_ids=None):
+    """
+    Performs the requested checks on an already read network.
+    :param rvr_network: RvrNetwork object as returned by 'read_rvr_file'.
+    :param check: String. One of 'loop', 'downbif' or 'all'.
+    :param num_workers: Integer. Number of processes used by the loop check.
+    :param split_link_ids: List of link ids of interior links that split large basins (if num_workers > 1).
+    :return: True if all performed checks succeeded, False otherwise. Raises ToolError if a split link id is not
+    described in the network
+    """
+
+    if check not in check_options:
+        raise ToolError("Argument '-check' should be one of {0}.".format(check_options))
+
+    split_positions = None
+    if split_link_ids is not None:
+        split_positions = rvr_network.index_of(np.asarray(split_link_ids, dtype=rvr_network.link_ids.dtype))
+        if np.any(split_positions < 0):
+            raise ToolError("Split link id(s) not described in rvr file: {0}.".format(
+                ", ".join([str(v) for v in np.asarray(split_link_ids)[split_positions < 0]])))
+
+    is_valid = True
+    if check in ('downbif', 'all'):
+        with Profiler.stage("check_downbif"):
+            is_valid = check_downstream_bifurcation(rvr_network) and is_valid
+    if check in ('loop', 'all'):
+        with Profiler.stage("check_loop"):
+            is_valid = check_loop(rvr_network, num_workers=num_workers, split_positions=split_positions) and is_valid
+    return is_valid
+
+
+def check_file(rvr_file_path, check='all', use_cache=True, num_workers=1, split_link_ids=None):
+    """
+    Reads a .rvr file and performs the requested checks.
+    :param rvr_file_path:
+    :param check: String. One of 'loop', 'downbif' or 'all'.
+    :param use_cache: Boolean. If True, uses and updates the binary cache file of the .rvr file.
+    :param num_workers: Integer. Number of processes used by the loop check.
+    :param split_link_ids: List of link ids of interior links that split large basins (if num_workers > 1).
+    :return: True if all performed checks succeeded, False otherwise. Raises ToolError if unable to read file
+    """
+
+    if check not in check_options:
+        raise ToolError("Argument '-check' should be one of {0}.".format(check_options))
+
+    return check_network(read_rvr_file(rvr_file_path, use_cache=use_cache), check=check, num_workers=num_workers,
+                         split_link_ids=split_link_ids)
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all checks succeeded, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Check if a given .rvr file presents topological inconsistency (loops or downstream bifurcation).")
+        print("Usage: python file_consistency_checker.py -in_rvr RVR_PATH [ -check loop|downbif|all ] [-workers WORKERS [-split LINK_IDS]] [-no_cache] [-profile PROFILE]")
+        print("  RVR_PATH  : Path for .rvr file to be evaluated.")
+        print("  -check    : Use this flag to perform only one type of check. If missing, perform all.")
+        print("  WORKERS   : Number of processes checking sub-basins (split at the outlets) for loops. If not provided, it is assumed 1.")
+        print("  LINK_IDS  : Comma-separated link ids of interior links where large basins are also split (example: 367813,522398).")
+        print("  -no_cache : If provided, neither reads nor writes the binary cache file (RVR_PATH.cache.h5).")
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    input_rvr_fpath_arg = ArgumentsManager.get_str(sys_args, '-in_rvr')
+    check_arg = ArgumentsManager.get_str(sys_args, '-check')
+    workers_arg = ArgumentsManager.get_int(sys_args, '-workers')
+    split_arg = ArgumentsManager.get_str(sys_args, '-split')
+    use_cache_arg = '-no_cache' not in sys_args
+
+    # basic checks
+    if input_rvr_fpath_arg is None:
+        print("Missing '-in_rvr' argument.")
+        return 1
+    if split_arg is not None:
+        try:
+            split_arg = [int(v) for v in split_arg.split(",")]
+        except ValueError:
+            print("Invalid argument for '-split': expected comma-separated link ids.")
+            return 1
+
+    try:
+        is_valid = check_file(input_rvr_fpath_arg, check='all' if check_arg is None else check_arg,
+                              use_cache=use_cache_arg, num_workers=1 if workers_arg is None else workers_arg,
+                              split_link_ids=split_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+    return 0 if is_valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
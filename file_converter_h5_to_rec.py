@@ -0,0 +1,188 @@
+from def_lib import ArgumentsManager, JobsRunner, RecFile, Hdf5Layout, Profiler, ToolError
+import numpy as np
+import h5py
+import sys
+import os
+
+memory_budget_default = 64
+
+
+# ###################################################### DEFS ######################################################## #
+
+def iterate_snapshot_blocks(rfile, memory_budget_mb=memory_budget_default):
+    """
+    Reads the states of a snapshot file in Asynch 1.3 format ('snapshot' dataset) or in Asynch 1.2 format ('index' and
+    'state' datasets) in slices aligned to the chunks of the datasets (see Hdf5Layout.get_slice_rows).
+    :param rfile: h5py File object.
+    :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+    :return: Generator of tuples (1-D array of link ids, 2-D array of states). Buffers are reused, so each block must be
+    consumed before asking for the next one
+    """
+
+    if 'snapshot' in rfile:
+        in_dataset = rfile['snapshot']
+        num_rows, state_names = in_dataset.shape[0], in_dataset.dtype.names[1:]
+        slice_rows = Hdf5Layout.get_slice_rows(num_rows, 2 * in_dataset.dtype.itemsize, memory_budget_mb,
+                                               in_chunk_rows=None if in_dataset.chunks is None else
+                                               in_dataset.chunks[0])
+        in_data = np.empty(slice_rows, dtype=in_dataset.dtype)
+        states = np.empty((slice_rows, len(state_names)), dtype=np.float64)
+        for cur_first in range(0, num_rows, slice_rows):
+            cur_count = min(slice_rows, num_rows - cur_first)
+            with Profiler.stage("h5_read"):
+                in_dataset.read_direct(in_data, np.s_[cur_first:cur_first + cur_count], np.s_[0:cur_count])
+                for cur_idx, cur_name in enumerate(state_names):
+                    states[:cur_count, cur_idx] = in_data[cur_name][:cur_count]
+            yield in_data['link_id'][:cur_count], states[:cur_count]
+
+    else:
+        index_dataset, state_dataset = rfile['index'], rfile['state']
+        num_rows = index_dataset.shape[0]
+        slice_rows = Hdf5Layout.get_slice_rows(num_rows, index_dataset.dtype.itemsize + state_dataset.dtype.itemsize *
+                                               state_dataset.shape[1], memory_budget_mb,
+                                               in_chunk_rows=None if state_dataset.chunks is None else
+                                               state_dataset.chunks[0])
+        for cur_first in range(0, num_rows, slice_rows):
+            cur_slice = np.s_[cur_first:cur_first + slice_rows]
+            with Profiler.stage("h5_read"):
+                link_ids, states = index_dataset[cur_slice], state_dataset[cur_slice]
+            yield link_ids, states
+
+
+def convert_file(input_file_path, output_file_path, precision=None, memory_budget_mb=memory_budget_default):
+    """
+    Writes a snapshot file (Asynch 1.2 or 1.3 format) as a .rec file, slice by slice.
+    :param input_file_path: File path for the .h5 file.
+    :param output_file_path: File path for the new .rec file.
+    :param precision: Integer. Number of significant digits of the states. If None, states are written with the
+    shortest representation that reads back as the same value.
+    :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+    :return: True. Raises ToolError if unable to read the file
+    """
+
+    # basic checks
+    if not os.path.exists(input_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(input_file_path))
+    if (precision is not None) and (precision < 1):
+        raise ToolError("Precision must be at least 1 digit.")
+
+    try:
+        with h5py.File(input_file_path, 'r') as rfile:
+            if ('snapshot' not in rfile) and (('index' not in rfile) or ('state' not in rfile)):
+                raise ToolError("Unable to find 'snapshot' dataset in file: {0}.".format(input_file_path))
+            hlm_id = int(rfile.attrs['model'][0])
+            if 'snapshot' in rfile:
+                num_links, num_states = rfile['snapshot'].shape[0], len(rfile['snapshot'].dtype.names) - 1
+            else:
+                num_links, num_states = rfile['index'].shape[0], rfile['state'].shape[1]
+
+            value_formats = None if precision is None else ["%.{0}g".format(precision)] * num_states
+            RecFile.write_blocks(output_file_path, hlm_id, num_links,
+                                 iterate_snapshot_blocks(rfile, memory_budget_mb=memory_budget_mb),
+                                 value_formats=value_formats)
+            Profiler.count("links", num_links)
+    except (KeyError, OSError) as e:
+        raise ToolError("Invalid snapshot file '{0}': {1}".format(input_file_path, e))
+
+    print("Wrote file '{0}'.".format(output_file_path))
+    return True
+
+
+def convert_directory(input_dir_path, output_dir_path, precision=None, num_workers=1,
+                      memory_budget_mb=memory_budget_default):
+    """
+
+    :param input_dir_path:
+    :param output_dir_path:
+    :param precision: Integer. Number of significant digits of the states. If None, the shortest exact representation.
+    :param num_workers: Number of files converted in parallel.
+    :param memory_budget_mb: Memory budget of each conversion, in MB.
+    :return: True if all files were converted, False otherwise. Raises ToolError if a directory does not exist
+    """
+
+    # basic checks
+    if not os.path.exists(input_dir_path):
+        raise ToolError("Directory does not exist: '{0}'.".format(input_dir_path))
+    if not os.path.exists(output_dir_path):
+        raise ToolError("Directory does not exist: '{0}'.".format(output_dir_path))
+
+    # convert each .h5 file in input directory
+    all_jobs = []
+    for cur_h5_file_name in sorted(os.listdir(input_dir_path)):
+        if not cur_h5_file_name.endswith(".h5"):
+            continue
+        cur_rec_file_path = os.path.join(output_dir_path, cur_h5_file_name[:-len(".h5")] + ".rec")
+        cur_h5_file_path = os.path.join(input_dir_path, cur_h5_file_name)
+        all_jobs.append((cur_h5_file_name, (cur_h5_file_path, cur_rec_file_path, precision, memory_budget_mb)))
+
+    return JobsRunner.print_summary(JobsRunner.run(convert_file, all_jobs, num_workers=num_workers))
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all files were converted, 1 otherwise
+    """
+
+    # help message
+    if '-h' in sys_args:
+        print("Converts a .h5 snapshot file or all .h5 snapshot files in a folder into a .rec file or a set of .rec files, respectively.")
+        print("Usage: python file_converter_h5_to_rec.py -mode MODE -input INPUT_PATH -output OUTPUT_PATH [-precision PRECISION] [-workers WORKERS] [-mem_budget MEM_BUDGET] [-profile PROFILE]")
+        print("  MODE        : Must be 'f' for 'single file' or 'd' for 'directory of files'.")
+        print("  INPUT_PATH  : Path for a .h5 file in Asynch 1.2 or 1.3 format (if MODE=f) or for a folder containing .h5 files (if MODE=d).")
+        print("  OUTPUT_PATH : Path for the new .rec file (if MODE=f) or for the receiving directory (if MODE=d)")
+        print("  PRECISION   : Number of significant digits of the states. If not provided, states are written with all digits needed to read back the same values.")
+        print("  WORKERS     : Number of files converted in parallel (if MODE=d). If not provided, it is assumed 1.")
+        print("  MEM_BUDGET  : Maximum size, in MB, of the states of a file kept in memory. Files are read in slices aligned to their chunks. If not provided, it is assumed {0}.".format(memory_budget_default))
+        Profiler.print_help()
+        return 0
+
+    # get all arguments and perform basic check
+    mode_arg = ArgumentsManager.get_str(sys_args, "-mode")
+    if mode_arg is None:
+        print("Missing '-mode' argument.")
+        return 1
+
+    inpt_arg = ArgumentsManager.get_str(sys_args, "-input")
+    if inpt_arg is None:
+        print("Missing '-input' argument.")
+        return 1
+
+    outt_arg = ArgumentsManager.get_str(sys_args, "-output")
+    if outt_arg is None:
+        print("Missing '-output' argument.")
+        return 1
+
+    prec_arg = ArgumentsManager.get_int(sys_args, "-precision")
+    if ('-precision' in sys_args) and (prec_arg is None):
+        return 1
+
+    work_arg = ArgumentsManager.get_int(sys_args, "-workers")
+    if work_arg is None:
+        work_arg = 1
+
+    memb_arg = ArgumentsManager.get_flt(sys_args, "-mem_budget")
+    if memb_arg is None:
+        memb_arg = memory_budget_default
+
+    try:
+        if mode_arg == 'd':
+            all_ok = convert_directory(inpt_arg, outt_arg, precision=prec_arg, num_workers=work_arg,
+                                       memory_budget_mb=memb_arg)
+        elif mode_arg == 'f':
+            all_ok = convert_file(inpt_arg, outt_arg, precision=prec_arg, memory_budget_mb=memb_arg)
+        else:
+            print("Unexpected argument for mode: '{0}'. Expects 'f' or 'd'.".format(mode_arg))
+            all_ok = False
+    except ToolError as e:
+        print(e)
+        all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
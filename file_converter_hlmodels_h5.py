@@ -1,199 +1,411 @@
-from def_lib import ArgumentsManager
-import numpy as np
-import h5py
-import sys
-import os
-
-# ###################################################### HELP ######################################################## #
-
-if '-h' in sys.argv:
-    print("Converts a snapshot file (.h5) from an hl-model format to another (example: from 254 to 195).")
-    print("Usage: python file_converter_hlmodels_h5.py -mode MODE -in_path INPUT_PATH -out_path OUTPUT_PATH -out_hl HL")
-    print("  MODE        : Must be 'f' for 'single file' or 'd' for 'directory of files'.")
-    print("  INPUT_PATH  : Path for a .h5 file (if MODE=f) or for a folder containing .h5 files (if MODE=d).")
-    print("  OUTPUT_PATH : Path for the new .h5 file (if MODE=f) or for the receiving directory (if MODE=d)")
-    print("  HL          : An Asynch Hillslope-Link model code (example: 190, 195, 254...)")
-    quit()
-
-# ###################################################### ARGS ######################################################## #
-
-# get arguments
-mode_arg = ArgumentsManager.get_str(sys.argv, "-mode")
-inpp_arg = ArgumentsManager.get_str(sys.argv, "-in_path")
-outp_arg = ArgumentsManager.get_str(sys.argv, "-out_path")
-outhl_arg = ArgumentsManager.get_int(sys.argv, "-out_hl")
-
-# basic checks
-if mode_arg is None:
-    print("Missing '-mode' argument.")
-    quit()
-if inpp_arg is None:
-    print("Missing '-in_path' argument.")
-    quit()
-if outp_arg is None:
-    print("Missing '-out_path' argument.")
-    quit()
-if outhl_arg is None:
-    print("Missing '-out_hl' argument.")
-    quit()
-
-
-# ###################################################### CLAS ######################################################## #
-
-class InitialConditionConverter:
-
-    _OUT_ASYNCH_VERSION = "1.3.2"
-
-    @staticmethod
-    def convert_directory(input_folder_path, output_folder_path, output_hlmodel_id):
-        """
-
-        :param input_folder_path:
-        :param output_folder_path:
-        :param output_hlmodel_id:
-        :return:
-        """
-
-        # basic check - folders exist
-        if (not os.path.exists(input_folder_path)) or (not os.path.isdir(input_folder_path)):
-            print("Folder not found: {0}.".format(input_folder_path))
-            return False
-        elif (not os.path.exists(output_folder_path)) or (not os.path.isdir(output_folder_path)):
-            print("Folder not found: {0}.".format(output_folder_path))
-            return False
-
-        #
-        all_in_file_names = os.listdir(input_folder_path)
-        for cur_in_file_name in all_in_file_names:
-            if not cur_in_file_name.endswith(".h5"):
-                continue
-            cur_out_file_name = InitialConditionConverter.try_to_guess_output_file_name(cur_in_file_name,
-                                                                                        output_hlmodel_id)
-            cur_out_file_name = cur_out_file_name if cur_out_file_name is not None else None
-
-            cur_in_file_path = os.path.join(input_folder_path, cur_in_file_name)
-            cur_out_file_path = os.path.join(output_folder_path, cur_out_file_name)
-
-            InitialConditionConverter.convert_file(cur_in_file_path, cur_out_file_path, output_hlmodel_id)
-
-    @staticmethod
-    def convert_file(input_file_path, output_file_path, output_hlmodel_id):
-        """
-
-        :param input_file_path:
-        :param output_file_path:
-        :param output_hlmodel_id:
-        :return:
-        """
-
-        # basic check - file exists
-        if not os.path.exists(input_file_path):
-            print("File not found: {0}.".format(input_file_path))
-            return False
-
-        # get input hl-model version and basic check it
-        input_hlmodel = InitialConditionConverter.identify_hlmodel_id(input_file_path)
-        if input_hlmodel is None:
-            print("Unable to identify HL-Model version of file: {0}".format(input_file_path))
-            return False
-
-        # route to proper converter
-        if (input_hlmodel == 254) and (output_hlmodel_id == 195):
-            return InitialConditionConverter.convert_from_254_to_195(input_file_path, output_file_path)
-        else:
-            print("Conversion from {0} to {1} not available.".format(input_hlmodel, output_hlmodel_id))
-            print("  ({0}) and ({1})".format(type(input_hlmodel), type(output_hlmodel_id)))
-            return False
-
-    @staticmethod
-    def identify_hlmodel_id(in_path):
-        """
-
-        :param in_path:
-        :return:
-        """
-
-        try:
-            with h5py.File(in_path, 'r') as hdf_file:
-                return int(hdf_file.attrs['model'][0])
-        except IndexError:
-            return None
-
-    @staticmethod
-    def convert_from_254_to_195(in_path, out_path):
-        """
-
-        :param in_path:
-        :param out_path:
-        :return:
-        """
-
-        # read inp file
-        with h5py.File(in_path, 'r') as r_file:
-            unix_time = int(r_file.attrs['unix_time'][0])
-            in_hdf_data = np.array(r_file.get('snapshot'))
-
-        # basic check
-        if in_hdf_data.size == 1:
-            print("Unable to find 'snapshot' dataset in file: {0}.".format(in_path))
-            return False
-
-        # create data type
-        dtype_arg = list()
-        dtype_arg.append(("link_id", np.uint32))
-        for cur_idx in range(4):
-            dtype_arg.append(("state_{0}".format(cur_idx), np.float64))
-        the_dtype = np.dtype(dtype_arg)
-
-        # compress data
-        compress_data = []
-        for cur_hdf_row in in_hdf_data:
-            cur_list = []
-            cur_list.append(cur_hdf_row[0])                                 # link id
-            cur_list.append(cur_hdf_row[1])                                 # discharge
-            cur_list.append(cur_hdf_row[2])                                 # ponded water
-            cur_list.append(float(cur_hdf_row[3]) + float(cur_hdf_row[4]))  # soil water
-            cur_list.append(cur_hdf_row[5])                                 # acc. precip.
-
-            cur_list_np = np.array(tuple(cur_list), dtype=the_dtype)
-            compress_data.append(cur_list_np)
-
-        # write output file
-        with h5py.File(out_path, 'w') as w_file:
-            w_file.attrs.create('model', [195], dtype='uint16')
-            w_file.attrs.create('unix_time', [unix_time], dtype='uint32')
-            w_file.attrs.create('version', InitialConditionConverter._OUT_ASYNCH_VERSION, dtype='S6')
-            w_file.create_dataset('snapshot', dtype=the_dtype, data=compress_data, compression="gzip",
-                                  compression_opts=5)
-
-        print("Created file: {0}".format(out_path))
-        return True
-
-    @staticmethod
-    def try_to_guess_output_file_name(input_file_name, output_hlmodel_id):
-        """
-
-        :param input_file_name:
-        :param output_hlmodel_id:
-        :return:
-        """
-        splitted_file_name = input_file_name.split('_')
-        if len(splitted_file_name) != 2:
-            return None
-        if not splitted_file_name[0].startswith('state'):
-            return None
-
-        out_file_name = "state{0}_{1}".format(output_hlmodel_id, splitted_file_name[1])
-        return out_file_name
-
-    def __init__(self):
-        return
-
-# ###################################################### RUNS ######################################################## #
-
-if mode_arg == "f":
-    InitialConditionConverter.convert_file(inpp_arg, outp_arg, outhl_arg)
-elif mode_arg == "d":
-    InitialConditionConverter.convert_directory(inpp_arg, outp_arg, outhl_arg)
-else:
-    print("Unexpected value for '-mode' argument: '{0}'. Expecting 'f' or 'd'.")
\ No newline at end of file
+from def_lib import ArgumentsManager, JobsRunner, RvrNetwork, SnapshotFile, Hdf5Layout, Profiler, ToolError
+import numpy as np
+import h5py
+import sys
+import os
+
+memory_budget_default = 64
+
+# ###################################################### CLAS ######################################################## #
+
+class InitialConditionConverter:
+
+    _OUT_ASYNCH_VERSION = "1.3.2"
+
+    # Available conversions, by (input hl-model, output hl-model). Each output state is a row of 'matrix', with the
+    # coefficients of the input states, plus the optional 'offsets' value. A 'functions' entry may replace an output
+    # state by a function receiving the list of input state columns.
+    # States: 190 (q, s_p, s_s), 195 (q, s_p, s_soil, s_precip), 252 (q, s_p, s_t, s_s),
+    #         254 (q, s_p, s_t, s_s, s_precip, V_r, q_b)
+    _CONVERSIONS = {
+        (254, 195): {
+            "matrix": [[1, 0, 0, 0, 0, 0, 0],   # discharge
+                       [0, 1, 0, 0, 0, 0, 0],   # ponded water
+                       [0, 0, 1, 1, 0, 0, 0],   # soil water: top layer + subsurface
+                       [0, 0, 0, 0, 1, 0, 0]]   # acc. precip.
+        },
+        (254, 190): {
+            "matrix": [[1, 0, 0, 0, 0, 0, 0],   # discharge
+                       [0, 1, 0, 0, 0, 0, 0],   # ponded water
+                       [0, 0, 1, 1, 0, 0, 0]]   # soil water: top layer + subsurface
+        },
+        (254, 252): {
+            "matrix": [[1, 0, 0, 0, 0, 0, 0],   # discharge
+                       [0, 1, 0, 0, 0, 0, 0],   # ponded water
+                       [0, 0, 1, 0, 0, 0, 0],   # top layer
+                       [0, 0, 0, 1, 0, 0, 0]]   # subsurface
+        },
+        (252, 254): {
+            "matrix": [[1, 0, 0, 0],            # discharge
+                       [0, 1, 0, 0],            # ponded water
+                       [0, 0, 1, 0],            # top layer
+                       [0, 0, 0, 1],            # subsurface
+                       [0, 0, 0, 0],            # acc. precip.
+                       [0, 0, 0, 0],            # acc. runoff
+                       [1, 0, 0, 0]]            # base flow: all discharge
+        },
+        (195, 190): {
+            "matrix": [[1, 0, 0, 0],            # discharge
+                       [0, 1, 0, 0],            # ponded water
+                       [0, 0, 1, 0]]            # soil water
+        }
+    }
+
+    @staticmethod
+    def convert_directory(input_folder_path, output_folder_path, output_hlmodel_id, num_workers=1, layout=None,
+                          memory_budget_mb=memory_budget_default, order='input', rvr_file_path=None,
+                          write_index=False):
+        """
+
+        :param input_folder_path:
+        :param output_folder_path:
+        :param output_hlmodel_id:
+        :param num_workers: Number of files converted in parallel.
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :param memory_budget_mb: Memory budget of each conversion, in MB.
+        :param order: String. Order of the links in the snapshots. One of SnapshotFile.ORDERS.
+        :param rvr_file_path: File path for the .rvr file of the links. Required for 'topological' order.
+        :param write_index: Boolean. If True, writes the sorted link id index of each snapshot.
+        :return: True if all files were converted, False otherwise. Raises ToolError if a folder does not exist
+        """
+
+        # basic check - folders exist
+        if (not os.path.exists(input_folder_path)) or (not os.path.isdir(input_folder_path)):
+            raise ToolError("Folder not found: {0}.".format(input_folder_path))
+        elif (not os.path.exists(output_folder_path)) or (not os.path.isdir(output_folder_path)):
+            raise ToolError("Folder not found: {0}.".format(output_folder_path))
+
+        # the topology is shared by all files: read it once instead of once per file
+        rvr_network = None
+        if (order == 'topological') and (rvr_file_path is not None):
+            rvr_network = RvrNetwork.read_file(rvr_file_path)
+            if rvr_network is None:
+                raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+
+        #
+        all_in_file_names = os.listdir(input_folder_path)
+        all_jobs, all_results = [], []
+        for cur_in_file_name in all_in_file_names:
+            if not cur_in_file_name.endswith(".h5"):
+                continue
+            cur_out_file_name = InitialConditionConverter.try_to_guess_output_file_name(cur_in_file_name,
+                                                                                        output_hlmodel_id)
+            if cur_out_file_name is None:
+                all_results.append((cur_in_file_name, False, "unable to guess output file name"))
+                continue
+
+            cur_in_file_path = os.path.join(input_folder_path, cur_in_file_name)
+            cur_out_file_path = os.path.join(output_folder_path, cur_out_file_name)
+
+            all_jobs.append((cur_in_file_name, (cur_in_file_path, cur_out_file_path, output_hlmodel_id, layout,
+                                                memory_budget_mb, order, rvr_file_path, write_index,
+                                                rvr_network)))
+
+        all_results += JobsRunner.run(InitialConditionConverter.convert_file, all_jobs, num_workers=num_workers)
+        return JobsRunner.print_summary(all_results)
+
+    @staticmethod
+    def convert_file(input_file_path, output_file_path, output_hlmodel_id, layout=None,
+                     memory_budget_mb=memory_budget_default, order='input', rvr_file_path=None, write_index=False,
+                     rvr_network=None):
+        """
+
+        :param input_file_path:
+        :param output_file_path:
+        :param output_hlmodel_id:
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+        :param order: String. Order of the links in the snapshot. One of SnapshotFile.ORDERS.
+        :param rvr_file_path: File path for the .rvr file of the links. Required for 'topological' order.
+        :param write_index: Boolean. If True, writes the sorted link id index of the snapshot.
+        :param rvr_network: RvrNetwork object of the links, used instead of reading 'rvr_file_path'.
+        :return: True. Raises ToolError if unable to convert file
+        """
+
+        # basic check - file exists
+        if not os.path.exists(input_file_path):
+            raise ToolError("File not found: {0}.".format(input_file_path))
+
+        # get input hl-model version and basic check it
+        input_hlmodel = InitialConditionConverter.identify_hlmodel_id(input_file_path)
+        if input_hlmodel is None:
+            raise ToolError("Unable to identify HL-Model version of file: {0}".format(input_file_path))
+
+        # route to proper converter
+        if (input_hlmodel, output_hlmodel_id) not in InitialConditionConverter._CONVERSIONS:
+            raise ToolError("Conversion from {0} to {1} not available. Available: {2}".format(
+                input_hlmodel, output_hlmodel_id, ", ".join(["{0}->{1}".format(*k) for k in
+                                                             sorted(InitialConditionConverter._CONVERSIONS.keys())])))
+        if (rvr_network is None) and (rvr_file_path is not None):
+            rvr_network = RvrNetwork.read_file(rvr_file_path)
+            if rvr_network is None:
+                raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+        return InitialConditionConverter.convert_hlmodel(input_file_path, output_file_path, input_hlmodel,
+                                                         output_hlmodel_id, layout=layout,
+                                                         memory_budget_mb=memory_budget_mb, order=order,
+                                                         rvr_network=rvr_network, write_index=write_index)
+
+    @staticmethod
+    def identify_hlmodel_id(in_path):
+        """
+
+        :param in_path:
+        :return:
+        """
+
+        try:
+            with h5py.File(in_path, 'r') as hdf_file:
+                return int(hdf_file.attrs['model'][0])
+        except (IndexError, KeyError, OSError):
+            return None
+
+    @staticmethod
+    def convert_states(in_data, input_hlmodel_id, output_hlmodel_id):
+        """
+        Applies a registered conversion to a whole snapshot at once. Output states are computed column-wise from the
+        nonzero coefficients of the conversion matrix only, so values of dropped states never leak into the output.
+        :param in_data: Structured array with 'link_id' and the states of the input hl-model.
+        :param input_hlmodel_id:
+        :param output_hlmodel_id:
+        :return: Structured array with 'link_id' and the states of the output hl-model. Raises ToolError if the number
+        of input states does not match the conversion
+        """
+
+        conversion = InitialConditionConverter._CONVERSIONS[(input_hlmodel_id, output_hlmodel_id)]
+        matrix = np.asarray(conversion["matrix"], dtype=np.float64)
+        offsets = conversion.get("offsets", None)
+        functions = conversion.get("functions", {})
+
+        # basic check
+        in_columns = [in_data[cur_name] for cur_name in in_data.dtype.names[1:]]
+        if len(in_columns) != matrix.shape[1]:
+            raise ToolError("Expected {0} states for hl-model {1}, found {2}.".format(matrix.shape[1], input_hlmodel_id,
+                                                                                      len(in_columns)))
+
+        # fill data, column by column
+        out_data = np.empty(in_data.shape, dtype=SnapshotFile.get_dtype(matrix.shape[0]))
+        out_data["link_id"] = in_data[in_data.dtype.names[0]]
+        for cur_out_idx, cur_coefficients in enumerate(matrix):
+            cur_name = "state_{0}".format(cur_out_idx)
+            if cur_out_idx in functions:
+                cur_values = functions[cur_out_idx](in_columns)
+            else:
+                cur_values = None
+                for cur_in_idx in np.flatnonzero(cur_coefficients):
+                    cur_term = in_columns[cur_in_idx] if cur_coefficients[cur_in_idx] == 1 else \
+                        cur_coefficients[cur_in_idx] * in_columns[cur_in_idx]
+                    cur_values = cur_term if cur_values is None else cur_values + cur_term
+                cur_values = 0 if cur_values is None else cur_values
+            if offsets is not None:
+                cur_values = cur_values + offsets[cur_out_idx]
+            out_data[cur_name] = cur_values
+
+        return out_data
+
+    @staticmethod
+    def convert_hlmodel(in_path, out_path, input_hlmodel_id, output_hlmodel_id, layout=None,
+                        memory_budget_mb=memory_budget_default, order='input', rvr_network=None, write_index=False):
+        """
+        Converts the snapshot slice by slice (see Hdf5Layout.get_slice_rows), so memory use does not depend on its
+        size. When links are reordered, the whole input snapshot is kept in memory.
+        :param in_path:
+        :param out_path:
+        :param input_hlmodel_id:
+        :param output_hlmodel_id:
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+        :param order: String. Order of the links in the snapshot. One of SnapshotFile.ORDERS.
+        :param rvr_network: RvrNetwork object. Required for 'topological' order.
+        :param write_index: Boolean. If True, writes the sorted link id index of the snapshot (see SnapshotFile).
+        :return: True. Raises ToolError if unable to convert file
+        """
+
+        with h5py.File(in_path, 'r') as r_file:
+            unix_time = int(r_file.attrs['unix_time'][0])
+            in_dataset = r_file.get('snapshot')
+
+            # basic check
+            if in_dataset is None:
+                raise ToolError("Unable to find 'snapshot' dataset in file: {0}.".format(in_path))
+
+            # checks the states and gets the output data type
+            num_rows = in_dataset.shape[0]
+            out_dtype = InitialConditionConverter.convert_states(np.empty(0, dtype=in_dataset.dtype), input_hlmodel_id,
+                                                                 output_hlmodel_id).dtype
+
+            with h5py.File(out_path, 'w') as w_file:
+                w_file.attrs.create('model', [output_hlmodel_id], dtype='uint16')
+                w_file.attrs.create('unix_time', [unix_time], dtype='uint32')
+                w_file.attrs.create('version', InitialConditionConverter._OUT_ASYNCH_VERSION, dtype='S6')
+                layout = Hdf5Layout() if layout is None else layout
+                out_dataset = w_file.create_dataset('snapshot', shape=(num_rows, ), dtype=out_dtype,
+                                                    **layout.get_dataset_args((num_rows, )))
+
+                # convert slice by slice
+                slice_rows = Hdf5Layout.get_slice_rows(
+                    num_rows, in_dataset.dtype.itemsize + out_dtype.itemsize, memory_budget_mb,
+                    in_chunk_rows=None if in_dataset.chunks is None else in_dataset.chunks[0],
+                    out_chunk_rows=None if out_dataset.chunks is None else out_dataset.chunks[0])
+                all_link_ids = np.empty(num_rows if write_index else 0, dtype=np.uint32)
+                if order == 'input':
+                    in_data = np.empty(slice_rows, dtype=in_dataset.dtype)
+                    rows = None
+                else:
+                    # reordered links are gathered from the whole input snapshot
+                    with Profiler.stage("h5_read"):
+                        in_data = in_dataset[()]
+                    with Profiler.stage("transform"):
+                        rows = SnapshotFile.get_row_order(in_data['link_id'], order, rvr_network=rvr_network)
+
+                for cur_first in range(0, num_rows, slice_rows):
+                    cur_count = min(slice_rows, num_rows - cur_first)
+                    if rows is None:
+                        with Profiler.stage("h5_read"):
+                            in_dataset.read_direct(in_data, np.s_[cur_first:cur_first + cur_count],
+                                                   np.s_[0:cur_count])
+                        cur_in_data = in_data[:cur_count]
+                    else:
+                        cur_in_data = in_data[rows[cur_first:cur_first + cur_count]]
+                    with Profiler.stage("transform"):
+                        out_data = InitialConditionConverter.convert_states(cur_in_data, input_hlmodel_id,
+                                                                            output_hlmodel_id)
+                    with Profiler.stage("h5_write"):
+                        out_dataset[cur_first:cur_first + cur_count] = out_data
+                    if write_index:
+                        all_link_ids[cur_first:cur_first + cur_count] = out_data['link_id']
+
+                if write_index:
+                    SnapshotFile.write_index(w_file, all_link_ids, layout=layout)
+                with Profiler.stage("h5_write"):
+                    Profiler.count_dataset(out_dataset)
+                Profiler.count("links", num_rows)
+
+        print("Created file: {0}".format(out_path))
+        return True
+
+    @staticmethod
+    def convert_from_254_to_195(in_path, out_path, layout=None, memory_budget_mb=memory_budget_default,
+                                order='input', rvr_network=None, write_index=False):
+        """
+
+        :param in_path:
+        :param out_path:
+        :param layout: Hdf5Layout object. If None, default layout is used.
+        :param memory_budget_mb: Float. Maximum size, in MB, of the rows kept in memory.
+        :param order: String. Order of the links in the snapshot. One of SnapshotFile.ORDERS.
+        :param rvr_network: RvrNetwork object. Required for 'topological' order.
+        :param write_index: Boolean. If True, writes the sorted link id index of the snapshot.
+        :return:
+        """
+
+        return InitialConditionConverter.convert_hlmodel(in_path, out_path, 254, 195, layout=layout,
+                                                         memory_budget_mb=memory_budget_mb, order=order,
+                                                         rvr_network=rvr_network, write_index=write_index)
+
+    @staticmethod
+    def try_to_guess_output_file_name(input_file_name, output_hlmodel_id):
+        """
+
+        :param input_file_name:
+        :param output_hlmodel_id:
+        :return:
+        """
+        splitted_file_name = input_file_name.split('_')
+        if len(splitted_file_name) != 2:
+            return None
+        if not splitted_file_name[0].startswith('state'):
+            return None
+
+        out_file_name = "state{0}_{1}".format(output_hlmodel_id, splitted_file_name[1])
+        return out_file_name
+
+    def __init__(self):
+        return
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all files were converted, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Converts a snapshot file (.h5) from an hl-model format to another (example: from 254 to 195).")
+        print("Usage: python file_converter_hlmodels_h5.py -mode MODE -in_path INPUT_PATH -out_path OUTPUT_PATH -out_hl HL [-workers WORKERS] [-mem_budget MEM_BUDGET] [-order ORDER [-in_rvr RVR_PATH]] [-index] [H5_OPTIONS] [-profile PROFILE]")
+        print("  MODE        : Must be 'f' for 'single file' or 'd' for 'directory of files'.")
+        print("  INPUT_PATH  : Path for a .h5 file (if MODE=f) or for a folder containing .h5 files (if MODE=d).")
+        print("  OUTPUT_PATH : Path for the new .h5 file (if MODE=f) or for the receiving directory (if MODE=d)")
+        print("  HL          : An Asynch Hillslope-Link model code (example: 190, 195, 254...)")
+        print("  WORKERS     : Number of files converted in parallel (if MODE=d). If not provided, it is assumed 1.")
+        print("  MEM_BUDGET  : Maximum size, in MB, of the states of a file kept in memory. Files are converted in slices aligned to their chunks. If not provided, it is assumed {0}.".format(memory_budget_default))
+        print("  ORDER       : Order of the links in the new snapshot: 'input', 'link_id' (increasing link id) or 'topological' (from headwaters to outlets). Reordered files are kept in memory. If not provided, it is assumed 'input'.")
+        print("  RVR_PATH    : Path for the .rvr file of the links. Required for 'topological' order.")
+        print("  -index      : If provided, writes a 'link_id' dataset with the sorted link ids and a 'row' dataset with their row in 'snapshot'.")
+        Hdf5Layout.print_help()
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    mode_arg = ArgumentsManager.get_str(sys_args, "-mode")
+    inpp_arg = ArgumentsManager.get_str(sys_args, "-in_path")
+    outp_arg = ArgumentsManager.get_str(sys_args, "-out_path")
+    outhl_arg = ArgumentsManager.get_int(sys_args, "-out_hl")
+    work_arg = ArgumentsManager.get_int(sys_args, "-workers")
+    memb_arg = ArgumentsManager.get_flt(sys_args, "-mem_budget")
+    order_arg = ArgumentsManager.get_str(sys_args, "-order")
+    rvr_arg = ArgumentsManager.get_str(sys_args, "-in_rvr")
+    index_arg = '-index' in sys_args
+    layout_arg = Hdf5Layout.from_args(sys_args)
+
+    # basic checks
+    if mode_arg is None:
+        print("Missing '-mode' argument.")
+        return 1
+    if inpp_arg is None:
+        print("Missing '-in_path' argument.")
+        return 1
+    if outp_arg is None:
+        print("Missing '-out_path' argument.")
+        return 1
+    if outhl_arg is None:
+        print("Missing '-out_hl' argument.")
+        return 1
+    if work_arg is None:
+        work_arg = 1
+    if memb_arg is None:
+        memb_arg = memory_budget_default
+    if order_arg is None:
+        order_arg = 'input'
+    elif order_arg not in SnapshotFile.ORDERS:
+        print("Invalid '-order' argument: '{0}'. Expected one of {1}.".format(order_arg, SnapshotFile.ORDERS))
+        return 1
+    if (order_arg == 'topological') and (rvr_arg is None):
+        print("Missing '-in_rvr' argument.")
+        return 1
+    if layout_arg is None:
+        return 1
+
+    try:
+        if mode_arg == "f":
+            all_ok = InitialConditionConverter.convert_file(inpp_arg, outp_arg, outhl_arg, layout=layout_arg,
+                                                            memory_budget_mb=memb_arg, order=order_arg,
+                                                            rvr_file_path=rvr_arg, write_index=index_arg)
+        elif mode_arg == "d":
+            all_ok = InitialConditionConverter.convert_directory(inpp_arg, outp_arg, outhl_arg, num_workers=work_arg,
+                                                                 layout=layout_arg, memory_budget_mb=memb_arg,
+                                                                 order=order_arg, rvr_file_path=rvr_arg,
+                                                                 write_index=index_arg)
+        else:
+            print("Unexpected value for '-mode' argument: '{0}'. Expecting 'f' or 'd'.".format(mode_arg))
+            all_ok = False
+    except ToolError as e:
+        print(e)
+        all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
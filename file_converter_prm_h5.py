@@ -0,0 +1,123 @@
+from def_lib import ArgumentsManager, PrmFile, Profiler, ToolError
+import sys
+import os
+
+
+# ###################################################### DEFS ######################################################## #
+
+def convert_to_binary(prm_file_path, h5_file_path, use_cache=True):
+    """
+    Writes the parameters of a .prm file as a binary parameters file (see PrmFile.write_binary_file). A header
+    declaring a wrong number of links is reported, and the binary file keeps the number of links actually described.
+    :param prm_file_path: File path for the .prm file.
+    :param h5_file_path: File path for the new .h5 file.
+    :param use_cache: Boolean. If True, uses the binary cache file of the .prm file.
+    :return: True. Raises ToolError if unable to read the file
+    """
+
+    prm_content = PrmFile.read_file(prm_file_path, use_cache=use_cache)
+    if prm_content is None:
+        raise ToolError("Unable to read file '{0}'.".format(prm_file_path))
+    link_ids, parameters = prm_content
+
+    PrmFile.write_binary_file(h5_file_path, link_ids, parameters)
+    Profiler.count("links", link_ids.size)
+    print("Wrote file '{0}'.".format(h5_file_path))
+    return True
+
+
+def convert_to_text(h5_file_path, prm_file_path, precision=None):
+    """
+    Writes a binary parameters file back as a .prm file.
+    :param h5_file_path: File path for the binary parameters file.
+    :param prm_file_path: File path for the new .prm file.
+    :param precision: Integer. Number of significant digits of the parameters. If None, parameters are written with the
+    shortest representation that reads back as the same value.
+    :return: True. Raises ToolError if unable to read the file
+    """
+
+    # basic check
+    if (precision is not None) and (precision < 1):
+        raise ToolError("Precision must be at least 1 digit.")
+
+    prm_content = PrmFile.read_file(h5_file_path)
+    if prm_content is None:
+        raise ToolError("Unable to read file '{0}'.".format(h5_file_path))
+    link_ids, parameters = prm_content
+
+    value_formats = None if precision is None else ["%.{0}g".format(precision)] * parameters.shape[1]
+    PrmFile.write_file(prm_file_path, link_ids, parameters, value_formats=value_formats)
+    Profiler.count("links", link_ids.size)
+    print("Wrote file '{0}'.".format(prm_file_path))
+    return True
+
+
+def convert_file(input_file_path, output_file_path, precision=None, use_cache=True):
+    """
+    Converts a .prm file into a binary parameters file (.h5) or a binary parameters file into a .prm file, following
+    the extension of the input file.
+    :param input_file_path:
+    :param output_file_path:
+    :param precision: Integer. Number of significant digits of the parameters written in a .prm file.
+    :param use_cache: Boolean. If True, uses the binary cache file of an input .prm file.
+    :return: True. Raises ToolError if unable to convert file
+    """
+
+    # basic checks
+    if not os.path.exists(input_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(input_file_path))
+    if PrmFile.is_binary_file(input_file_path) == PrmFile.is_binary_file(output_file_path):
+        raise ToolError("Expected a .prm file and a .h5 file, got '{0}' and '{1}'.".format(input_file_path,
+                                                                                           output_file_path))
+
+    if PrmFile.is_binary_file(input_file_path):
+        return convert_to_text(input_file_path, output_file_path, precision=precision)
+    return convert_to_binary(input_file_path, output_file_path, use_cache=use_cache)
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if the file was converted, 1 otherwise
+    """
+
+    # help message
+    if '-h' in sys_args:
+        print("Converts a .prm file into a binary parameters file (.h5), memory-mapped by the readers of .prm files, or a binary parameters file back into a .prm file.")
+        print("Usage: python file_converter_prm_h5.py -input INPUT_PATH -output OUTPUT_PATH [-precision PRECISION] [-no_cache] [-profile PROFILE]")
+        print("  INPUT_PATH  : Path for a .prm file or for a binary parameters file (.h5).")
+        print("  OUTPUT_PATH : Path for the new .h5 file (if INPUT_PATH is a .prm file) or for the new .prm file (if INPUT_PATH is a .h5 file).")
+        print("  PRECISION   : Number of significant digits of the parameters written in a .prm file. If not provided, parameters are written with all digits needed to read back the same values.")
+        print("  -no_cache   : If provided, neither reads nor writes the binary cache file of the .prm file.")
+        Profiler.print_help()
+        return 0
+
+    # get all arguments and perform basic check
+    inpt_arg = ArgumentsManager.get_str(sys_args, "-input")
+    if inpt_arg is None:
+        print("Missing '-input' argument.")
+        return 1
+
+    outt_arg = ArgumentsManager.get_str(sys_args, "-output")
+    if outt_arg is None:
+        print("Missing '-output' argument.")
+        return 1
+
+    prec_arg = ArgumentsManager.get_int(sys_args, "-precision")
+    if ('-precision' in sys_args) and (prec_arg is None):
+        return 1
+
+    try:
+        all_ok = convert_file(inpt_arg, outt_arg, precision=prec_arg, use_cache='-no_cache' not in sys_args)
+    except ToolError as e:
+        print(e)
+        all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
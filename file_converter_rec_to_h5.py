@@ -1,277 +1,385 @@
-from def_lib import ArgumentsManager
-from datetime import datetime
-from calendar import timegm
-import numpy as np
-import pytz
-import time
-import h5py
-import sys
-import os
-
-has_error = False
-asynch_version_default = '1.3'
-
-# ###################################################### ARGS ######################################################## #
-
-# help message
-if '-h' in sys.argv:
-    print("Converts a .rec file or all .rec files in a folder into a .h5 files or a set of .h5 files, respectively.")
-    print("Usage: python file_converter_rec_to_h5.py -mode MODE -input INPUT_PATH -output OUTPUT_PATH [-version VERSION]")
-    print("  MODE        : Must be 'f' for 'single file' or 'd' for 'directory of files'.")
-    print("  INPUT_PATH  : Path for a .rec file (if MODE=f) or for a folder containing .h5 files (if MODE=d).")
-    print("  OUTPUT_PATH : Path for the new .h5 file (if MODE=f) or for the receiving directory (if MODE=d)")
-    print("  VERSION : Asynch version. Expects values '1.2' or '1.3'. If not provided, it is assumed '1.3'.")
-    quit()
-
-# get all arguments and perform basic check
-
-mode_arg = ArgumentsManager.get_str(sys.argv, "-mode")
-if mode_arg is None:
-    print("Missing '-mode' argument.")
-    quit(0)
-
-inpt_arg = ArgumentsManager.get_str(sys.argv, "-input")
-if mode_arg is None:
-    print("Missing '-input' argument.")
-    quit(0)
-
-outt_arg = ArgumentsManager.get_str(sys.argv, "-output")
-if mode_arg is None:
-    print("Missing '-output' argument.")
-    quit(0)
-
-vers_arg = ArgumentsManager.get_str(sys.argv, "-version")
-if vers_arg is None:
-    vers_arg = asynch_version_default
-elif vers_arg not in ('1.2', '1.3'):
-    print("Invalid '-version' argument: '{0}'. Expected '1.2' or '1.3'.".format(vers_arg))
-    quit(0)
-
-
-# ###################################################### DEFS ######################################################## #
-
-def convert_file(input_file_path, output_file_path, asynch_version):
-    """
-
-    :param input_file_path:
-    :param output_file_path:
-    :return: True if able to convert file, False otherwise
-    """
-
-    # basic checks - input file must exist and have .rec extension
-    if not os.path.exists(input_file_path):
-        print("File does not exist: '{0}'.".format(input_file_path))
-        return False
-    if not input_file_path.endswith(".rec"):
-        print("File does not have .rec extension: '{0}'.".format(input_file_path))
-        return False
-
-    # tries to extract timestamp from file name
-    # TODO - perform it
-    init_timestamp = extract_timestamp_from_filepath(input_file_path)
-
-    # basic check
-    if init_timestamp is None:
-        print("Invalid filename '{0}': must have format '..._YYYY_MM_DD.rec'".format(os.path.basename(input_file_path)))
-        return False
-
-    # print("Got '{0}' from '{1}'.".format(init_timestamp, input_file_path))
-
-    # write hdf5 file
-    if asynch_version == '1.2':
-        convert_file_1_2(input_file_path, output_file_path, init_timestamp=init_timestamp)
-    elif asynch_version == '1.3':
-        convert_file_1_3(input_file_path, output_file_path, init_timestamp=init_timestamp)
-    else:
-        return False
-
-    print("Wrote file '{0}'.".format(output_file_path))
-
-    # did it
-    return True
-
-
-def convert_file_1_2(input_file_path, output_file_path, init_timestamp=0):
-    """
-
-    :param input_file_path:
-    :param output_file_path:
-    :param init_timestamp:
-    :return:
-    """
-
-    # read rec file and stores content in 'link_ids' and 'link_prm' variables
-    with open(input_file_path, "r") as rfile:
-        link_ids = []
-        link_prm = []
-        line_count = 1
-        hlm_id = None
-        for cur_line in rfile:
-            cur_line_clean = cur_line.strip()
-            if line_count == 1:
-                hlm_id = int(cur_line.strip())
-            elif (line_count not in (1, 2, 3)) and (cur_line.strip() != ""):
-                cur_line_split = cur_line_clean.split(" ")
-                if len(cur_line_split) == 1:
-                    link_ids.append(int(cur_line_clean))
-                else:
-                    link_prm.append([float(cur_line_split[i]) for i in range(len(cur_line_split))])
-            line_count += 1
-
-    # basic check
-    if hlm_id is None:
-        print("Hillslope-Link Model id not identified.")
-        return False
-
-    # write hdf5 file
-    with h5py.File(output_file_path, 'w') as wfile:
-        wfile.attrs.create('model', [hlm_id], dtype='uint16')
-        wfile.attrs.create('unix_time', [init_timestamp], dtype='uint32')
-        wfile.create_dataset('index', data=link_ids, dtype='uint32')
-        wfile.create_dataset('state', data=link_prm)
-
-    # did it
-    return True
-
-
-def convert_file_1_3(input_file_path, output_file_path, init_timestamp=0):
-    """
-
-    :param input_file_path:
-    :param output_file_path:
-    :param init_timestamp:
-    :return:
-    """
-
-    # read rec file and stores content in 'link_ids' and 'link_prm' variables
-    with open(input_file_path, "r") as rfile:
-        link_ids = []
-        link_prm = []
-        link_prms = []
-        line_count = 1
-        hlm_id = None
-        for cur_line in rfile:
-            cur_line_clean = cur_line.strip()
-            if line_count == 1:
-                hlm_id = int(cur_line.strip())
-            elif (line_count not in (1, 2, 3)) and (cur_line.strip() != ""):
-                cur_line_split = cur_line_clean.split(" ")
-                if len(cur_line_split) == 1:
-                    link_ids.append(np.uint32(int(cur_line_clean)))
-                else:
-                    cur_params = [np.float64(float(cur_line_split[i])) for i in range(len(cur_line_split))]
-
-                    link_prms.append(cur_params)
-
-                    # build matrix if necessary
-                    if len(link_prm) == 0:
-                        for cur_state in range(len(cur_params)):
-                            link_prm.append([])
-
-                    # fill content
-                    for cur_idx, cur_val in enumerate(cur_params):
-                        link_prm[cur_idx].append(cur_val)
-            line_count += 1
-
-    # basic check
-    if hlm_id is None:
-        print("Hillslope-Link Model id not identified.")
-        return False
-
-    # create data type
-    dtype_arg = list()
-    dtype_arg.append(("link_id", np.uint32))
-    for cur_idx in range(len(link_prm)):
-        dtype_arg.append(("state_{0}".format(cur_idx), np.float64))
-    the_dtype = np.dtype(dtype_arg)
-
-    # compress data
-    compress_data = []
-    for cur_idx in range(len(link_ids)):
-        cur_list = [link_ids[cur_idx]]
-        for cur_par in link_prms[cur_idx]:
-            cur_list.append(cur_par)
-        cur_list_np = np.array(tuple(cur_list), dtype=the_dtype)
-        compress_data.append(cur_list_np)
-
-    # write hdf5 file
-    with h5py.File(output_file_path, 'w') as wfile:
-        wfile.attrs.create('model', [hlm_id], dtype='uint16')
-        wfile.attrs.create('unix_time', [init_timestamp], dtype='uint32')
-        wfile.attrs.create('version', "1.3.2", dtype='S6')
-        wfile.create_dataset('snapshot', dtype=the_dtype, data=compress_data, compression="gzip", compression_opts=5)
-
-    # did it
-    return True
-
-
-def extract_timestamp_from_filepath(filepath):
-    """
-
-    :param filepath:
-    :return:
-    """
-
-    file_basename = os.path.basename(os.path.splitext(filepath)[0])
-    splitted_filename = file_basename.split("_")
-
-    if len(splitted_filename) == 1:
-        return None
-    elif len(splitted_filename) == 2:
-        try:
-            return int(splitted_filename[1])
-        except ValueError:
-            return None
-    elif len(splitted_filename) == 4:
-        try:
-            year = splitted_filename[1]
-            month = splitted_filename[2]
-            day = splitted_filename[3]
-
-            time_string = "{0}-{1}-{2} 00:00:00 GMT".format(year, month, day)
-
-            timestamp = timegm(time.strptime(time_string, '%Y-%m-%d %H:%M:%S %Z'))
-
-            return timestamp
-        except ValueError:
-            return None
-
-
-def convert_directory(input_dir_path, output_dir_path, asynch_version):
-    """
-
-    :param input_dir_path:
-    :param output_dir_path:
-    :return:
-    """
-
-    # basic checks
-    if not os.path.exists(input_dir_path):
-        print("Directory does not exist: '{0}'.".format(input_dir_path))
-        return False
-    if not os.path.exists(output_dir_path):
-        print("Directory does not exist: '{0}'.".format(output_dir_path))
-        return False
-
-    # list all rec files in input directory
-    all_rec_file_names = []
-    for cur_file_name in os.listdir(input_dir_path):
-        if cur_file_name.endswith(".rec"):
-            all_rec_file_names.append(cur_file_name)
-
-    # convert each of listed files
-    for cur_rec_file_name in all_rec_file_names:
-        cur_hf5_file_name = cur_rec_file_name.replace(".rec", ".h5")
-        cur_hf5_file_path = os.path.join(output_dir_path, cur_hf5_file_name)
-        cur_rec_file_path = os.path.join(input_dir_path, cur_rec_file_name)
-        convert_file(cur_rec_file_path, cur_hf5_file_path, asynch_version)
-
-
-# ###################################################### CALL ######################################################## #
-
-if mode_arg == 'd':
-    convert_directory(inpt_arg, outt_arg, vers_arg)
-elif mode_arg == 'f':
-    convert_file(inpt_arg, outt_arg, vers_arg)
-else:
-    print("Unexpected argument for mode: '{0}'. Expects 'f' or 'd'.".format(mode_arg))
+from def_lib import ArgumentsManager, JobsRunner, RecFile, RvrNetwork, SnapshotFile, Hdf5Layout, Profiler, ToolError
+from calendar import timegm
+import numpy as np
+import time
+import h5py
+import sys
+import os
+
+asynch_version_default = '1.3'
+memory_budget_default = 512
+
+
+# ###################################################### DEFS ######################################################## #
+
+def convert_file(input_file_path, output_file_path, asynch_version, memory_budget_mb=memory_budget_default,
+                 layout=None, order='input', rvr_file_path=None, write_index=False, rvr_network=None):
+    """
+
+    :param input_file_path:
+    :param output_file_path:
+    :param asynch_version:
+    :param memory_budget_mb:
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :param order: String. Order of the links in the snapshot (Asynch 1.3 only). One of SnapshotFile.ORDERS.
+    :param rvr_file_path: File path for the .rvr file of the links. Required for 'topological' order.
+    :param write_index: Boolean. If True, writes the sorted link id index of the snapshot (Asynch 1.3 only).
+    :param rvr_network: RvrNetwork object of the links, used instead of reading 'rvr_file_path'.
+    :return: True. Raises ToolError if unable to convert file
+    """
+
+    # basic checks - input file must exist and have .rec extension
+    if not os.path.exists(input_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(input_file_path))
+    if not input_file_path.endswith(".rec"):
+        raise ToolError("File does not have .rec extension: '{0}'.".format(input_file_path))
+
+    # tries to extract timestamp from file name
+    init_timestamp = extract_timestamp_from_filepath(input_file_path)
+
+    # basic check
+    if init_timestamp is None:
+        raise ToolError("Invalid filename '{0}': must have format '..._YYYY_MM_DD.rec'".format(
+            os.path.basename(input_file_path)))
+
+    # print("Got '{0}' from '{1}'.".format(init_timestamp, input_file_path))
+
+    # basic check
+    if (asynch_version != '1.3') and ((order != 'input') or write_index):
+        raise ToolError("Link order and index are only available for Asynch 1.3 snapshots.")
+
+    # write hdf5 file
+    try:
+        if asynch_version == '1.2':
+            convert_file_1_2(input_file_path, output_file_path, init_timestamp=init_timestamp,
+                             memory_budget_mb=memory_budget_mb, layout=layout)
+        elif asynch_version == '1.3':
+            if (rvr_network is None) and (rvr_file_path is not None):
+                rvr_network = RvrNetwork.read_file(rvr_file_path)
+                if rvr_network is None:
+                    raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+            convert_file_1_3(input_file_path, output_file_path, init_timestamp=init_timestamp,
+                             memory_budget_mb=memory_budget_mb, layout=layout, order=order, rvr_network=rvr_network,
+                             write_index=write_index)
+        else:
+            raise ToolError("Invalid Asynch version: '{0}'. Expected '1.2' or '1.3'.".format(asynch_version))
+    except ValueError as e:
+        raise ToolError(str(e))
+
+    print("Wrote file '{0}'.".format(output_file_path))
+
+    # did it
+    return True
+
+
+def convert_file_1_2(input_file_path, output_file_path, init_timestamp=0, memory_budget_mb=memory_budget_default,
+                     layout=None):
+    """
+
+    :param input_file_path:
+    :param output_file_path:
+    :param init_timestamp:
+    :param memory_budget_mb: Maximum size, in MB, of the states kept in memory. Bigger files are written in parts.
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :return: True. Raises ToolError if the header is not valid and ValueError if the records are not
+    """
+
+    # read rec file header
+    rec_header = RecFile.read_header(input_file_path)
+    if rec_header is None:
+        raise ToolError("Hillslope-Link Model id not identified.")
+    hlm_id, num_links, num_states = rec_header
+    block_rows = max(int(memory_budget_mb * 1024 * 1024) // SnapshotFile.get_dtype(num_states).itemsize, 1)
+
+    # write hdf5 file, block by block
+    with h5py.File(output_file_path, 'w') as wfile:
+        wfile.attrs.create('model', [hlm_id], dtype='uint16')
+        wfile.attrs.create('unix_time', [init_timestamp], dtype='uint32')
+        layout = Hdf5Layout() if layout is None else layout
+        # row-major chunks, the same rows for both datasets
+        state_args = layout.get_dataset_args((num_links, num_states))
+        index_args = dict(layout.get_dataset_args((num_links, )), chunks=state_args["chunks"][:1])
+        index_dataset = wfile.create_dataset('index', shape=(num_links, ), maxshape=(None, ), dtype='uint32',
+                                             **index_args)
+        state_dataset = wfile.create_dataset('state', shape=(num_links, num_states), maxshape=(None, num_states),
+                                             dtype='float64', **state_args)
+
+        cur_row = 0
+        for cur_block in RecFile.iterate_blocks(input_file_path, num_states, block_rows):
+            with Profiler.stage("h5_write"):
+                next_row = cur_row + cur_block.size
+                if next_row > index_dataset.shape[0]:
+                    index_dataset.resize((next_row, ))
+                    state_dataset.resize((next_row, num_states))
+                index_dataset[cur_row:next_row] = cur_block['link_id']
+                state_dataset[cur_row:next_row, :] = np.column_stack([cur_block[cur_name] for cur_name in
+                                                                      cur_block.dtype.names[1:]])
+            cur_row = next_row
+
+        # basic check
+        if cur_row != num_links:
+            raise ToolError("REC file '{0}' has a header of '{1}' but describes '{2}' links.".format(
+                input_file_path, num_links, cur_row))
+
+        with Profiler.stage("h5_write"):
+            Profiler.count_dataset(index_dataset)
+            Profiler.count_dataset(state_dataset)
+        Profiler.count("links", cur_row)
+
+    # did it
+    return True
+
+
+def convert_file_1_3(input_file_path, output_file_path, init_timestamp=0, memory_budget_mb=memory_budget_default,
+                     layout=None, order='input', rvr_network=None, write_index=False):
+    """
+
+    :param input_file_path:
+    :param output_file_path:
+    :param init_timestamp:
+    :param memory_budget_mb: Maximum size, in MB, of the states kept in memory. Bigger files are written in parts,
+    unless links are reordered (all states are then kept in memory).
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :param order: String. Order of the links in the snapshot. One of SnapshotFile.ORDERS.
+    :param rvr_network: RvrNetwork object. Required for 'topological' order.
+    :param write_index: Boolean. If True, writes the sorted link id index of the snapshot (see SnapshotFile).
+    :return: True. Raises ToolError if the header is not valid or the order cannot be computed and ValueError if the
+    records are not
+    """
+
+    # read rec file header
+    rec_header = RecFile.read_header(input_file_path)
+    if rec_header is None:
+        raise ToolError("Hillslope-Link Model id not identified.")
+    hlm_id, num_links, num_states = rec_header
+    the_dtype = SnapshotFile.get_dtype(num_states)
+    block_rows = max(int(memory_budget_mb * 1024 * 1024) // the_dtype.itemsize, 1)
+
+    # write hdf5 file, block by block
+    with h5py.File(output_file_path, 'w') as wfile:
+        wfile.attrs.create('model', [hlm_id], dtype='uint16')
+        wfile.attrs.create('unix_time', [init_timestamp], dtype='uint32')
+        wfile.attrs.create('version', "1.3.2", dtype='S6')
+        layout = Hdf5Layout() if layout is None else layout
+        snapshot_dataset = wfile.create_dataset('snapshot', shape=(num_links, ), maxshape=(None, ), dtype=the_dtype,
+                                                **layout.get_dataset_args((num_links, )))
+
+        cur_row = 0
+        all_link_ids = []
+        if order == 'input':
+            for cur_block in RecFile.iterate_blocks(input_file_path, num_states, block_rows):
+                with Profiler.stage("h5_write"):
+                    next_row = cur_row + cur_block.size
+                    if next_row > snapshot_dataset.shape[0]:
+                        snapshot_dataset.resize((next_row, ))
+                    snapshot_dataset[cur_row:next_row] = cur_block
+                if write_index:
+                    all_link_ids.append(cur_block['link_id'].copy())
+                cur_row = next_row
+        else:
+            # links are reordered with all states in memory, then written in parts
+            all_blocks = [cur_block.copy() for cur_block in RecFile.iterate_blocks(input_file_path, num_states,
+                                                                                   block_rows)]
+            snapshot = np.concatenate(all_blocks) if all_blocks else np.empty(0, dtype=the_dtype)
+            del all_blocks
+            with Profiler.stage("transform"):
+                rows = SnapshotFile.get_row_order(snapshot['link_id'], order, rvr_network=rvr_network)
+            snapshot_dataset.resize((snapshot.size, ))
+            for cur_row in range(0, snapshot.size, block_rows):
+                with Profiler.stage("h5_write"):
+                    snapshot_dataset[cur_row:cur_row + block_rows] = snapshot[rows[cur_row:cur_row + block_rows]]
+            cur_row = snapshot.size
+            all_link_ids.append(snapshot['link_id'][rows])
+            del snapshot
+
+        # basic check
+        if cur_row != num_links:
+            raise ToolError("REC file '{0}' has a header of '{1}' but describes '{2}' links.".format(
+                input_file_path, num_links, cur_row))
+
+        if write_index:
+            SnapshotFile.write_index(wfile, np.concatenate(all_link_ids) if all_link_ids else
+                                     np.empty(0, dtype=np.uint32), layout=layout)
+
+        with Profiler.stage("h5_write"):
+            Profiler.count_dataset(snapshot_dataset)
+        Profiler.count("links", cur_row)
+
+    # did it
+    return True
+
+
+def extract_timestamp_from_filepath(filepath):
+    """
+
+    :param filepath:
+    :return:
+    """
+
+    file_basename = os.path.basename(os.path.splitext(filepath)[0])
+    splitted_filename = file_basename.split("_")
+
+    if len(splitted_filename) == 1:
+        return None
+    elif len(splitted_filename) == 2:
+        try:
+            return int(splitted_filename[1])
+        except ValueError:
+            return None
+    elif len(splitted_filename) == 4:
+        try:
+            year = splitted_filename[1]
+            month = splitted_filename[2]
+            day = splitted_filename[3]
+
+            time_string = "{0}-{1}-{2} 00:00:00 GMT".format(year, month, day)
+
+            timestamp = timegm(time.strptime(time_string, '%Y-%m-%d %H:%M:%S %Z'))
+
+            return timestamp
+        except ValueError:
+            return None
+
+
+def convert_directory(input_dir_path, output_dir_path, asynch_version, num_workers=1,
+                      memory_budget_mb=memory_budget_default, layout=None, order='input', rvr_file_path=None,
+                      write_index=False):
+    """
+
+    :param input_dir_path:
+    :param output_dir_path:
+    :param asynch_version:
+    :param memory_budget_mb: Memory budget of each conversion, in MB.
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :param order: String. Order of the links in the snapshots. One of SnapshotFile.ORDERS.
+    :param rvr_file_path: File path for the .rvr file of the links. Required for 'topological' order.
+    :param write_index: Boolean. If True, writes the sorted link id index of each snapshot.
+    :param num_workers: Number of files converted in parallel.
+    :return: True if all files were converted, False otherwise. Raises ToolError if a directory does not exist
+    """
+
+    # basic checks
+    if not os.path.exists(input_dir_path):
+        raise ToolError("Directory does not exist: '{0}'.".format(input_dir_path))
+    if not os.path.exists(output_dir_path):
+        raise ToolError("Directory does not exist: '{0}'.".format(output_dir_path))
+
+    # list all rec files in input directory
+    all_rec_file_names = []
+    for cur_file_name in os.listdir(input_dir_path):
+        if cur_file_name.endswith(".rec"):
+            all_rec_file_names.append(cur_file_name)
+
+    # the topology is shared by all files: read it once instead of once per file
+    rvr_network = None
+    if (order == 'topological') and (rvr_file_path is not None) and (asynch_version == '1.3'):
+        rvr_network = RvrNetwork.read_file(rvr_file_path)
+        if rvr_network is None:
+            raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+
+    # convert each of listed files
+    all_jobs = []
+    for cur_rec_file_name in all_rec_file_names:
+        cur_hf5_file_name = cur_rec_file_name.replace(".rec", ".h5")
+        cur_hf5_file_path = os.path.join(output_dir_path, cur_hf5_file_name)
+        cur_rec_file_path = os.path.join(input_dir_path, cur_rec_file_name)
+        cur_job_args = (cur_rec_file_path, cur_hf5_file_path, asynch_version, memory_budget_mb, layout, order,
+                        rvr_file_path, write_index, rvr_network)
+        all_jobs.append((cur_rec_file_name, cur_job_args))
+
+    return JobsRunner.print_summary(JobsRunner.run(convert_file, all_jobs, num_workers=num_workers))
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all files were converted, 1 otherwise
+    """
+
+    # help message
+    if '-h' in sys_args:
+        print("Converts a .rec file or all .rec files in a folder into a .h5 files or a set of .h5 files, respectively.")
+        print("Usage: python file_converter_rec_to_h5.py -mode MODE -input INPUT_PATH -output OUTPUT_PATH [-version VERSION] [-workers WORKERS] [-mem_budget MEM_BUDGET] [-order ORDER [-in_rvr RVR_PATH]] [-index] [H5_OPTIONS] [-profile PROFILE]")
+        print("  MODE        : Must be 'f' for 'single file' or 'd' for 'directory of files'.")
+        print("  INPUT_PATH  : Path for a .rec file (if MODE=f) or for a folder containing .h5 files (if MODE=d).")
+        print("  OUTPUT_PATH : Path for the new .h5 file (if MODE=f) or for the receiving directory (if MODE=d)")
+        print("  VERSION : Asynch version. Expects values '1.2' or '1.3'. If not provided, it is assumed '1.3'.")
+        print("  WORKERS : Number of files converted in parallel (if MODE=d). If not provided, it is assumed 1.")
+        print("  MEM_BUDGET : Maximum size, in MB, of the states of a file kept in memory. Bigger files are written in parts. If not provided, it is assumed {0}.".format(memory_budget_default))
+        print("  ORDER : Order of the links in the snapshot (VERSION 1.3): 'input', 'link_id' (increasing link id) or 'topological' (from headwaters to outlets). Reordered files are kept in memory. If not provided, it is assumed 'input'.")
+        print("  RVR_PATH : Path for the .rvr file of the links. Required for 'topological' order.")
+        print("  -index : If provided, writes a 'link_id' dataset with the sorted link ids and a 'row' dataset with their row in 'snapshot' (VERSION 1.3).")
+        Hdf5Layout.print_help()
+        Profiler.print_help()
+        return 0
+
+    # get all arguments and perform basic check
+    mode_arg = ArgumentsManager.get_str(sys_args, "-mode")
+    if mode_arg is None:
+        print("Missing '-mode' argument.")
+        return 1
+
+    inpt_arg = ArgumentsManager.get_str(sys_args, "-input")
+    if inpt_arg is None:
+        print("Missing '-input' argument.")
+        return 1
+
+    outt_arg = ArgumentsManager.get_str(sys_args, "-output")
+    if outt_arg is None:
+        print("Missing '-output' argument.")
+        return 1
+
+    vers_arg = ArgumentsManager.get_str(sys_args, "-version")
+    if vers_arg is None:
+        vers_arg = asynch_version_default
+    elif vers_arg not in ('1.2', '1.3'):
+        print("Invalid '-version' argument: '{0}'. Expected '1.2' or '1.3'.".format(vers_arg))
+        return 1
+
+    work_arg = ArgumentsManager.get_int(sys_args, "-workers")
+    if work_arg is None:
+        work_arg = 1
+
+    memb_arg = ArgumentsManager.get_flt(sys_args, "-mem_budget")
+    if memb_arg is None:
+        memb_arg = memory_budget_default
+
+    order_arg = ArgumentsManager.get_str(sys_args, "-order")
+    if order_arg is None:
+        order_arg = 'input'
+    elif order_arg not in SnapshotFile.ORDERS:
+        print("Invalid '-order' argument: '{0}'. Expected one of {1}.".format(order_arg, SnapshotFile.ORDERS))
+        return 1
+
+    rvr_arg = ArgumentsManager.get_str(sys_args, "-in_rvr")
+    if (order_arg == 'topological') and (rvr_arg is None):
+        print("Missing '-in_rvr' argument.")
+        return 1
+
+    layout_arg = Hdf5Layout.from_args(sys_args)
+    if layout_arg is None:
+        return 1
+
+    try:
+        if mode_arg == 'd':
+            all_ok = convert_directory(inpt_arg, outt_arg, vers_arg, num_workers=work_arg, memory_budget_mb=memb_arg,
+                                       layout=layout_arg, order=order_arg, rvr_file_path=rvr_arg,
+                                       write_index='-index' in sys_args)
+        elif mode_arg == 'f':
+            all_ok = convert_file(inpt_arg, outt_arg, vers_arg, memory_budget_mb=memb_arg, layout=layout_arg,
+                                  order=order_arg, rvr_file_path=rvr_arg, write_index='-index' in sys_args)
+        else:
+            print("Unexpected argument for mode: '{0}'. Expects 'f' or 'd'.".format(mode_arg))
+            all_ok = False
+    except ToolError as e:
+        print(e)
+        all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
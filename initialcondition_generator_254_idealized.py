@@ -1,131 +1,252 @@
-from def_lib import ArgumentsManager
-import sys
-
-default_swc = 0.02
-default_k3 = 0.000002042
-
-# ###################################################### HELP ######################################################## #
-
-if '-h' in sys.argv:
-    print("Creates an initial condition file (.rec) extrapolating the discharge/area coefficient given at the outlet of a given drainage network.")
-    print("Usage: python initialconditions_generator_254_idealized.py -in_prm IN_PRM -ref_linkid LINK_ID -disc DISCHARGE -out_rec OUT_REC [-swc SWC] [-k3 K3]")
-    print("  IN_PRM    : File path for the .prm file of the modeled system.")
-    print("  LINK_ID   : Integer with the link id of the link taken as reference. Usually the outlet of a watersed.")
-    print("  DISCHARGE : Discharge value, in m3/s, at the reference link.")
-    print("  SWC       : Soil Water Column value in all links. If not provided, it is assumed 0.02.")
-    print("  K3        : Value of k3 coefficient. If not provided, it is assumed 0.000002042.")
-    quit()
-
-# ###################################################### ARGS ######################################################## #
-
-# get arguments
-input_fpath_arg = ArgumentsManager.get_str(sys.argv, '-in_prm')
-reference_linkid_arg = ArgumentsManager.get_int(sys.argv, '-ref_linkid')
-reference_discharge_arg = ArgumentsManager.get_flt(sys.argv, '-disc')
-output_fpath_arg = ArgumentsManager.get_str(sys.argv, '-out_rec')
-swc_arg = ArgumentsManager.get_flt(sys.argv, '-swc')
-k3_arg = ArgumentsManager.get_flt(sys.argv, '-k3')
-
-# basic checks
-if input_fpath_arg is None:
-    print("Missing '-in_prm' argument.")
-    quit()
-if reference_linkid_arg is None:
-    print("Missing '-ref_linkid' argument.")
-    quit()
-if reference_discharge_arg is None:
-    print("Missing '-disc' argument.")
-    quit()
-if output_fpath_arg is None:
-    print("Missing '-out_rec' argument.")
-    quit()
-the_swc = swc_arg if swc_arg is not None else default_swc
-the_k3 = k3_arg if k3_arg is not None else default_k3
-
-
-# ###################################################### CLAS ######################################################## #
-
-def read_prm_file(file_path):
-    """
-
-    :param file_path:
-    :return:
-    """
-
-    num_links = None
-    read_header = False
-    last_link_id = None
-    return_dict = {}
-    with open(file_path, "r+") as rfile:
-        for cur_line in rfile:
-            cur_line = cur_line.strip()
-            # read header
-            if not read_header:
-                num_links = int(cur_line)
-                read_header = True
-                continue
-
-            # ignore blank lines
-            if cur_line == "":
-                continue
-
-            if last_link_id is None:
-                last_link_id = int(cur_line)
-                continue
-            else:
-                return_dict[last_link_id] = [float(v) for v in cur_line.split(" ")]
-                last_link_id = None
-                continue
-
-    # basic check
-    if num_links != len(return_dict.keys()):
-        print("Be careful! PRM file has a header of '{0}' but describes '{1}' links.".format(num_links,
-                                                                                             len(return_dict.keys())))
-
-    return return_dict
-
-
-def write_rec_file(output_fpath, prm_content, ref_linkid, ref_discharg, swc, k3):
-    """
-
-    :param output_fpath:
-    :param prm_content:
-    :param ref_linkid:
-    :param ref_discharg:
-    :param swc:
-    :param k3:
-    :return:
-    """
-
-    # define ratio disch/up_area
-    ref_up_area = prm_content[ref_linkid][0]
-    c2 = ref_discharg / ref_up_area
-
-    with open(output_fpath, "w+") as wfile:
-        # write header
-        wfile.write("254\n")
-        wfile.write("{0}\n".format(len(prm_content.keys())))
-        wfile.write("0.0\n")
-        wfile.write("\n")
-        print("Wrote header.")
-
-        # write states
-        for cur_linkid in prm_content.keys():
-            cur_link_area = prm_content[cur_linkid][0]
-            tq = c2 * cur_link_area               # total discharge
-            ss = c2 / k3 * 0.06 / 1000            # water stored in subsurface
-            pd = 0                                # water ponded in surface
-            sw = swc                              # soil in topy layer
-            ap = 0                                # accumulated precipitation
-            ar = 0                                # accumulated runoff
-            bq = tq                               # base flow
-            wfile.write("{0}\n".format(cur_linkid))
-            wfile.write("{0} {1} {2} {3} {4} {5} {6}\n".format(tq, pd, sw, ss, ap, ar, bq))
-
-    print("Wrote file '{0}'.".format(output_fpath))
-
-
-# ###################################################### RUNS ######################################################## #
-
-prm_file_content = read_prm_file(input_fpath_arg)
-write_rec_file(output_fpath_arg, prm_file_content, reference_linkid_arg, reference_discharge_arg, the_swc, the_k3)
+from def_lib import ArgumentsManager, PrmFile, RvrNetwork, RecFile, SnapshotFile, Hdf5Layout, Profiler, ToolError
+import numpy as np
+import sys
+
+default_swc = 0.02
+default_k3 = 0.000002042
+default_unix_time = 0
+
+# ###################################################### DEFS ######################################################## #
+
+def read_prm_file(file_path, use_cache=True):
+    """
+    Reads only the upstream area (first parameter) of each link.
+    :param file_path:
+    :param use_cache: Boolean. If True, uses the binary cache file of the .prm file when available.
+    :return: Tuple (link ids, parameters matrix) as returned by PrmFile.read_columns (see def_lib). Raises ToolError if
+    unable to read file
+    """
+
+    prm_content = PrmFile.read_columns(file_path, [0], use_cache=use_cache)
+    if prm_content is None:
+        raise ToolError("Unable to read file '{0}'.".format(file_path))
+    return prm_content
+
+
+def read_gauges_file(file_path):
+    """
+    Reads a table of gauges: a link id and a discharge per line, separated by comma, semicolon or spaces. Blank lines,
+    lines starting with '#' and a non-numeric first line (header) are ignored.
+    :param file_path:
+    :return: Tuple of arrays (link ids, discharges). Raises ToolError if unable to read file
+    """
+
+    all_linkids, all_discharges = [], []
+    try:
+        with open(file_path, "r") as rfile:
+            for cur_line_idx, cur_line in enumerate(rfile):
+                cur_fields = cur_line.replace(",", " ").replace(";", " ").split()
+                if (len(cur_fields) == 0) or cur_fields[0].startswith("#"):
+                    continue
+                try:
+                    cur_linkid, cur_discharge = int(cur_fields[0]), float(cur_fields[1])
+                except (ValueError, IndexError):
+                    if not all_linkids:
+                        continue
+                    raise ToolError("Invalid line {0} in file '{1}'.".format(cur_line_idx + 1, file_path))
+                all_linkids.append(cur_linkid)
+                all_discharges.append(cur_discharge)
+    except IOError:
+        raise ToolError("File '{0}' does not exits.".format(file_path))
+
+    if not all_linkids:
+        raise ToolError("No gauge in file '{0}'.".format(file_path))
+    return np.array(all_linkids, dtype=np.int64), np.array(all_discharges, dtype=np.float64)
+
+
+def get_ratios(prm_content, ref_linkids, ref_discharges, rvr_network=None):
+    """
+    Defines the discharge/upstream area ratio of each link.
+    With a single reference link and no network, all links take its ratio. Otherwise, each link takes the ratio of its
+    nearest downstream reference link (see RvrNetwork.propagate_upstream), and links with no reference link downstream
+    take the mean ratio of the reference links.
+    :param prm_content: Tuple (link ids, parameters matrix) as returned by 'read_prm_file'.
+    :param ref_linkids: Array of reference link ids.
+    :param ref_discharges: Array of discharges at the reference links.
+    :param rvr_network: RvrNetwork object. Required if there is more than one reference link.
+    :return: Float (single ratio) or array of floats (one ratio per link of 'prm_content'). Raises ToolError if not
+    possible
+    """
+
+    link_ids, link_params = prm_content
+
+    # ratios at reference links
+    if link_ids.size == 0:
+        raise ToolError("No link in PRM file.")
+    sorted_positions = np.argsort(link_ids, kind="stable")
+    found_at = np.minimum(np.searchsorted(link_ids[sorted_positions], ref_linkids), link_ids.size - 1)
+    ref_positions = sorted_positions[found_at]
+    is_found = link_ids[ref_positions] == ref_linkids
+    if not np.all(is_found):
+        raise ToolError("Reference link id(s) {0} not found in PRM file.".format(
+            ", ".join([str(v) for v in np.asarray(ref_linkids)[~is_found]])))
+    ref_ratios = np.asarray(ref_discharges, dtype=np.float64) / link_params[ref_positions, 0]
+
+    if rvr_network is None:
+        if len(ref_ratios) > 1:
+            raise ToolError("A .rvr file is required with more than one reference link.")
+        return float(ref_ratios[0])
+
+    # propagate from the gauges to their upstream links
+    rvr_ratios = np.full(rvr_network.num_links, np.nan, dtype=np.float64)
+    rvr_is_gauge = np.zeros(rvr_network.num_links, dtype=bool)
+    rvr_gauge_positions = rvr_network.index_of(ref_linkids)
+    for cur_linkid in np.asarray(ref_linkids)[rvr_gauge_positions < 0]:
+        print("Reference link id {0} not found in RVR file.".format(cur_linkid))
+    rvr_ratios[rvr_gauge_positions[rvr_gauge_positions >= 0]] = ref_ratios[rvr_gauge_positions >= 0]
+    rvr_is_gauge[rvr_gauge_positions[rvr_gauge_positions >= 0]] = True
+    rvr_ratios, _ = rvr_network.propagate_upstream(rvr_ratios, rvr_is_gauge)
+
+    # map to the links of the prm file
+    rvr_positions = rvr_network.index_of(link_ids)
+    ratios = np.full(link_ids.size, np.nan, dtype=np.float64)
+    ratios[rvr_positions >= 0] = rvr_ratios[rvr_positions[rvr_positions >= 0]]
+    not_covered = np.isnan(ratios)
+    if np.any(not_covered):
+        print("{0} of {1} links have no reference link downstream. Using mean ratio.".format(
+            np.count_nonzero(not_covered), link_ids.size))
+        ratios[not_covered] = np.mean(ref_ratios)
+    return ratios
+
+
+def compute_states(link_params, ratios, swc, k3):
+    """
+    Computes the states of all links at once.
+    :param link_params: Parameters matrix as returned by 'read_prm_file' (upstream area in the first column).
+    :param ratios: Float or array of floats with the discharge/upstream area ratio of each link.
+    :param swc:
+    :param k3:
+    :return: 2-D array with one row per link and columns (tq, pd, sw, ss, ap, ar, bq)
+    """
+
+    states = np.zeros((link_params.shape[0], 7), dtype=np.float64)
+    states[:, 0] = ratios * link_params[:, 0]     # total discharge
+    states[:, 1] = 0                              # water ponded in surface
+    states[:, 2] = swc                            # soil in topy layer
+    states[:, 3] = ratios / k3 * 0.06 / 1000      # water stored in subsurface
+    states[:, 4] = 0                              # accumulated precipitation
+    states[:, 5] = 0                              # accumulated runoff
+    states[:, 6] = states[:, 0]                   # base flow
+    return states
+
+
+def write_rec_file(output_fpath, prm_content, ref_linkid, ref_discharg, swc, k3, output_h5_fpath=None,
+                   unix_time=default_unix_time, layout=None, rvr_network=None):
+    """
+
+    :param output_fpath: File path for the .rec file. If None, no .rec file is written.
+    :param prm_content: Tuple (link ids, parameters matrix) as returned by 'read_prm_file'.
+    :param ref_linkid: Integer or array of integers (gauges).
+    :param ref_discharg: Float or array of floats, one discharge per reference link.
+    :param swc:
+    :param k3:
+    :param output_h5_fpath: File path for a snapshot .h5 file (Asynch 1.3 format). If None, no .h5 file is written.
+    :param unix_time: Integer. Timestamp of the .h5 snapshot.
+    :param layout: Hdf5Layout object for the .h5 snapshot. If None, default layout is used.
+    :param rvr_network: RvrNetwork object. Required if there is more than one reference link (see 'get_ratios').
+    :return: True. Raises ToolError if the states cannot be defined
+    """
+
+    with Profiler.stage("transform"):
+        ratios = get_ratios(prm_content, np.atleast_1d(ref_linkid), np.atleast_1d(ref_discharg),
+                            rvr_network=rvr_network)
+        link_ids, link_params = prm_content
+        states = compute_states(link_params, ratios, swc, k3)
+    Profiler.count("links", len(link_ids))
+
+    if output_fpath is not None:
+        RecFile.write_file(output_fpath, 254, link_ids, states,
+                           value_formats=["%r", "%d", "%r", "%r", "%d", "%d", "%r"])
+        print("Wrote file '{0}'.".format(output_fpath))
+
+    if output_h5_fpath is not None:
+        SnapshotFile.write_file(output_h5_fpath, 254, unix_time, link_ids, states, layout=layout)
+        print("Wrote file '{0}'.".format(output_h5_fpath))
+
+    return True
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status
+    """
+
+    if '-h' in sys_args:
+        print("Creates an initial condition file (.rec) extrapolating the discharge/area coefficient given at the outlet of a given drainage network.")
+        print("Usage: python initialconditions_generator_254_idealized.py -in_prm IN_PRM (-ref_linkid LINK_ID -disc DISCHARGE | -gauges GAUGES -in_rvr IN_RVR) [-out_rec OUT_REC] [-out_h5 OUT_H5 [-unix_time UNIX_TIME] [H5_OPTIONS]] [-swc SWC] [-k3 K3] [-no_cache] [-profile PROFILE]")
+        print("  IN_PRM    : File path for the .prm file (or binary parameters file, .h5) of the modeled system.")
+        print("  LINK_ID   : Integer with the link id of the link taken as reference. Usually the outlet of a watersed.")
+        print("  DISCHARGE : Discharge value, in m3/s, at the reference link.")
+        print("  GAUGES    : File path for a table with a link id and a discharge (m3/s) per line, separated by comma or spaces. Each link takes the discharge/area ratio of its nearest downstream gauge.")
+        print("  IN_RVR    : File path for the .rvr file of the modeled system. Required with GAUGES.")
+        print("  OUT_REC   : File path for the new .rec file.")
+        print("  OUT_H5    : File path for a new snapshot .h5 file (Asynch 1.3 format). At least one of OUT_REC and OUT_H5 must be provided.")
+        print("  UNIX_TIME : Timestamp of the .h5 snapshot. If not provided, it is assumed {0}.".format(default_unix_time))
+        print("  SWC       : Soil Water Column value in all links. If not provided, it is assumed 0.02.")
+        print("  K3        : Value of k3 coefficient. If not provided, it is assumed 0.000002042.")
+        print("  -no_cache : If provided, does not use the binary cache files (IN_PRM.cache.h5, IN_RVR.cache.h5).")
+        Hdf5Layout.print_help()
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    input_fpath_arg = ArgumentsManager.get_str(sys_args, '-in_prm')
+    reference_linkid_arg = ArgumentsManager.get_int(sys_args, '-ref_linkid')
+    reference_discharge_arg = ArgumentsManager.get_flt(sys_args, '-disc')
+    gauges_fpath_arg = ArgumentsManager.get_str(sys_args, '-gauges')
+    input_rvr_fpath_arg = ArgumentsManager.get_str(sys_args, '-in_rvr')
+    output_fpath_arg = ArgumentsManager.get_str(sys_args, '-out_rec')
+    output_h5_fpath_arg = ArgumentsManager.get_str(sys_args, '-out_h5')
+    unix_time_arg = ArgumentsManager.get_int(sys_args, '-unix_time')
+    swc_arg = ArgumentsManager.get_flt(sys_args, '-swc')
+    k3_arg = ArgumentsManager.get_flt(sys_args, '-k3')
+    use_cache_arg = '-no_cache' not in sys_args
+    layout_arg = Hdf5Layout.from_args(sys_args)
+
+    # basic checks
+    if input_fpath_arg is None:
+        print("Missing '-in_prm' argument.")
+        return 1
+    if gauges_fpath_arg is not None:
+        if input_rvr_fpath_arg is None:
+            print("Missing '-in_rvr' argument.")
+            return 1
+    elif reference_linkid_arg is None:
+        print("Missing '-ref_linkid' or '-gauges' argument.")
+        return 1
+    elif reference_discharge_arg is None:
+        print("Missing '-disc' argument.")
+        return 1
+    if (output_fpath_arg is None) and (output_h5_fpath_arg is None):
+        print("Missing '-out_rec' or '-out_h5' argument.")
+        return 1
+    if layout_arg is None:
+        return 1
+    the_swc = swc_arg if swc_arg is not None else default_swc
+    the_k3 = k3_arg if k3_arg is not None else default_k3
+    the_unix_time = unix_time_arg if unix_time_arg is not None else default_unix_time
+
+    try:
+        prm_file_content = read_prm_file(input_fpath_arg, use_cache=use_cache_arg)
+        if gauges_fpath_arg is not None:
+            reference_linkid_arg, reference_discharge_arg = read_gauges_file(gauges_fpath_arg)
+            rvr_network_arg = RvrNetwork.read_file(input_rvr_fpath_arg, use_cache=use_cache_arg)
+            if rvr_network_arg is None:
+                raise ToolError("Unable to read file '{0}'.".format(input_rvr_fpath_arg))
+        else:
+            rvr_network_arg = None
+        write_rec_file(output_fpath_arg, prm_file_content, reference_linkid_arg, reference_discharge_arg, the_swc,
+                       the_k3, output_h5_fpath=output_h5_fpath_arg, unix_time=the_unix_time, layout=layout_arg,
+                       rvr_network=rvr_network_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
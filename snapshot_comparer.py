@@ -0,0 +1,215 @@
+from def_lib import ArgumentsManager, RecFile, SnapshotFile, Profiler, ToolError, find_in_sorted
+import numpy as np
+import json
+import sys
+
+max_listed_links = 10
+
+
+# ###################################################### DEFS ######################################################## #
+
+def read_snapshot_file(file_path):
+    """
+    Reads a snapshot from a .rec file or from a .h5 file (Asynch 1.2 or 1.3 format).
+    :param file_path:
+    :return: Tuple (hl-model id, link ids, 2-D array of states). Raises ToolError if unable to read file
+    """
+
+    if file_path.lower().endswith(".rec"):
+        snapshot = RecFile.read_file(file_path)
+    else:
+        snapshot = SnapshotFile.read_file(file_path)
+        snapshot = None if snapshot is None else (snapshot[0], ) + snapshot[2:]
+
+    if snapshot is None:
+        raise ToolError("Unable to read file '{0}'.".format(file_path))
+    return snapshot
+
+
+def join_link_ids(link_ids_a, link_ids_b):
+    """
+    Joins two sets of link ids through a merge of their sorted arrays (repeated link ids are joined once).
+    :param link_ids_a: 1-D array of link ids.
+    :param link_ids_b: 1-D array of link ids.
+    :return: Dictionary with the positions of the common links in each array ('positions_a', 'positions_b', in
+    increasing link id order), the links only in A ('missing') and only in B ('extra'), and the repeated link ids of
+    each array ('duplicated_a', 'duplicated_b')
+    """
+
+    all_orders, all_sorted, all_firsts = [], [], []
+    for cur_link_ids in (link_ids_a, link_ids_b):
+        cur_order = np.argsort(cur_link_ids, kind='stable')
+        cur_sorted = cur_link_ids[cur_order]
+        cur_firsts = np.ones(cur_sorted.size, dtype=bool)
+        cur_firsts[1:] = cur_sorted[1:] != cur_sorted[:-1]
+        all_orders.append(cur_order)
+        all_sorted.append(cur_sorted)
+        all_firsts.append(cur_firsts)
+
+    joint = {}
+    for cur_idx, cur_key in enumerate(("a", "b")):
+        cur_sorted, cur_firsts = all_sorted[cur_idx], all_firsts[cur_idx]
+        joint["duplicated_" + cur_key] = np.unique(cur_sorted[~cur_firsts])
+
+    unique_a, unique_b = all_sorted[0][all_firsts[0]], all_sorted[1][all_firsts[1]]
+    positions_in_b, found_in_b = find_in_sorted(all_sorted[1], unique_a)
+    _, found_in_a = find_in_sorted(all_sorted[0], unique_b)
+    joint["positions_a"] = all_orders[0][np.flatnonzero(all_firsts[0])[found_in_b]]
+    joint["positions_b"] = all_orders[1][positions_in_b[found_in_b]]
+    joint["missing"] = unique_a[~found_in_b]
+    joint["extra"] = unique_b[~found_in_a]
+    return joint
+
+
+def compare_states(link_ids, states_a, states_b, positions_a, positions_b):
+    """
+    Computes the differences of each state, one state at a time. The relative difference is |A - B| / max(|A|, |B|),
+    0 when both are 0.
+    :param link_ids: 1-D array of link ids of the compared links.
+    :param states_a: 2-D array of states.
+    :param states_b: 2-D array of states.
+    :param positions_a: 1-D array. Rows of 'states_a' of the compared links.
+    :param positions_b: 1-D array. Rows of 'states_b' of the compared links.
+    :return: List of dictionaries, one per state, with max/mean absolute and relative differences and the link id of
+    the maximum absolute difference (None if no state differs)
+    """
+
+    all_stats = []
+    for cur_idx in range(states_a.shape[1]):
+        cur_a, cur_b = states_a[positions_a, cur_idx], states_b[positions_b, cur_idx]
+        cur_abs_diff = np.abs(cur_a - cur_b)
+        cur_scale = np.maximum(np.abs(cur_a), np.abs(cur_b))
+        cur_rel_diff = np.divide(cur_abs_diff, cur_scale, out=np.zeros_like(cur_abs_diff), where=cur_scale > 0)
+        cur_stats = {"state": cur_idx, "max_abs": 0.0, "mean_abs": 0.0, "max_rel": 0.0, "mean_rel": 0.0,
+                     "max_abs_link_id": None}
+        if link_ids.size > 0:
+            cur_max_position = int(np.argmax(cur_abs_diff))
+            cur_stats.update({
+                "max_abs": float(cur_abs_diff[cur_max_position]),
+                "mean_abs": float(cur_abs_diff.mean()),
+                "max_rel": float(cur_rel_diff.max()),
+                "mean_rel": float(cur_rel_diff.mean()),
+                "max_abs_link_id": int(link_ids[cur_max_position]) if cur_abs_diff[cur_max_position] > 0 else None
+            })
+        all_stats.append(cur_stats)
+    return all_stats
+
+
+def compare_files(file_path_a, file_path_b, abs_tolerance=0.0):
+    """
+    Joins two snapshots on link id and compares their states.
+    :param file_path_a: File path for a .rec or .h5 snapshot.
+    :param file_path_b: File path for a .rec or .h5 snapshot.
+    :param abs_tolerance: Float. Maximum absolute difference for states to be considered equal.
+    :return: Dictionary with the report. Its 'equal' field is True if both files describe the same links with states
+    equal within the tolerance. Raises ToolError if unable to read a file or the number of states differ
+    """
+
+    with Profiler.stage("read"):
+        hlm_id_a, link_ids_a, states_a = read_snapshot_file(file_path_a)
+        hlm_id_b, link_ids_b, states_b = read_snapshot_file(file_path_b)
+    if states_a.shape[1] != states_b.shape[1]:
+        raise ToolError("Files have {0} and {1} states: convert them to the same model first.".format(
+            states_a.shape[1], states_b.shape[1]))
+
+    with Profiler.stage("join"):
+        joint = join_link_ids(link_ids_a, link_ids_b)
+        common_ids = link_ids_a[joint["positions_a"]]
+    with Profiler.stage("compare"):
+        all_stats = compare_states(common_ids, states_a, states_b, joint["positions_a"], joint["positions_b"])
+    Profiler.count("links", link_ids_a.size + link_ids_b.size)
+
+    report = {
+        "file_a": file_path_a,
+        "file_b": file_path_b,
+        "model_a": hlm_id_a,
+        "model_b": hlm_id_b,
+        "num_links_a": int(link_ids_a.size),
+        "num_links_b": int(link_ids_b.size),
+        "num_common": int(common_ids.size),
+        "states": all_stats
+    }
+    for cur_key in ("missing", "extra", "duplicated_a", "duplicated_b"):
+        report[cur_key] = joint[cur_key].tolist()
+    report["equal"] = (hlm_id_a == hlm_id_b) and (not report["missing"]) and (not report["extra"]) and \
+        (not report["duplicated_a"]) and (not report["duplicated_b"]) and \
+        all([cur_stats["max_abs"] <= abs_tolerance for cur_stats in all_stats])
+    return report
+
+
+def print_report(report):
+    """
+
+    :param report: Dictionary as returned by 'compare_files'.
+    :return:
+    """
+
+    print("A: {0} (model {1}, {2} links)".format(report["file_a"], report["model_a"], report["num_links_a"]))
+    print("B: {0} (model {1}, {2} links)".format(report["file_b"], report["model_b"], report["num_links_b"]))
+    print("Common links: {0}".format(report["num_common"]))
+    for cur_key, cur_title in (("missing", "Links only in A"), ("extra", "Links only in B"),
+                               ("duplicated_a", "Repeated links in A"), ("duplicated_b", "Repeated links in B")):
+        if report[cur_key]:
+            print("{0}: {1}{2}".format(cur_title, len(report[cur_key]), " ({0}{1})".format(
+                ", ".join([str(v) for v in report[cur_key][:max_listed_links]]),
+                ", ..." if len(report[cur_key]) > max_listed_links else "")))
+
+    print("  state |      max abs |     mean abs |      max rel |     mean rel | link id of max abs")
+    for cur_stats in report["states"]:
+        print("  {0:>5} | {1:12.6g} | {2:12.6g} | {3:12.6g} | {4:12.6g} | {5}".format(
+            cur_stats["state"], cur_stats["max_abs"], cur_stats["mean_abs"], cur_stats["max_rel"],
+            cur_stats["mean_rel"], "-" if cur_stats["max_abs_link_id"] is None else cur_stats["max_abs_link_id"]))
+    print("Snapshots are {0}.".format("EQUAL" if report["equal"] else "DIFFERENT"))
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if the snapshots are equal, 1 otherwise
+    """
+
+    # help message
+    if '-h' in sys_args:
+        print("Compares two snapshots (.rec or .h5 files) link by link.")
+        print("Usage: python snapshot_comparer.py -in_a FILE_A -in_b FILE_B [-atol TOLERANCE] [-report REPORT] [-profile PROFILE]")
+        print("  FILE_A    : Path for a .rec file or a .h5 file (Asynch 1.2 or 1.3 format).")
+        print("  FILE_B    : Path for a .rec file or a .h5 file (Asynch 1.2 or 1.3 format).")
+        print("  TOLERANCE : Maximum absolute difference for states to be considered equal. If not provided, it is assumed 0.")
+        print("  REPORT    : File path for a .json file with the differences and the full lists of missing and extra links.")
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    in_a_arg = ArgumentsManager.get_str(sys_args, '-in_a')
+    in_b_arg = ArgumentsManager.get_str(sys_args, '-in_b')
+    atol_arg = ArgumentsManager.get_flt(sys_args, '-atol')
+    report_arg = ArgumentsManager.get_str(sys_args, '-report')
+
+    # basic checks
+    if in_a_arg is None:
+        print("Missing '-in_a' argument.")
+        return 1
+    if in_b_arg is None:
+        print("Missing '-in_b' argument.")
+        return 1
+
+    try:
+        report = compare_files(in_a_arg, in_b_arg, abs_tolerance=0.0 if atol_arg is None else atol_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+
+    print_report(report)
+    if report_arg is not None:
+        with open(report_arg, "w") as wfile:
+            json.dump(report, wfile, indent=2)
+        print("Wrote file '{0}'.".format(report_arg))
+
+    return 0 if report["equal"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
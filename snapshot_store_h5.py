@@ -0,0 +1,288 @@
+from def_lib import ArgumentsManager, JobsRunner, SnapshotFile, Hdf5Layout, Profiler, ToolError
+import numpy as np
+import h5py
+import sys
+import os
+
+store_version = "1"
+store_chunk_rows_default = 65536
+
+
+# ###################################################### DEFS ######################################################## #
+
+def create_store(wfile, hlm_id, link_ids, num_states, layout=None):
+    """
+    Creates the datasets of an empty store: 'link_id' (order of the links in every snapshot), 'states' (one
+    [links x states] slot per snapshot, chunked so a snapshot is read with contiguous chunks), 'unix_time' (sorted
+    timestamps) and 'slot' (slot of 'states' of each timestamp).
+    :param wfile: h5py File object opened for writing.
+    :param hlm_id: Integer. Hillslope-Link model id.
+    :param link_ids: 1-D array of link ids.
+    :param num_states: Integer.
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :return:
+    """
+
+    layout = Hdf5Layout() if layout is None else layout
+    num_links = link_ids.size
+    chunk_rows = store_chunk_rows_default if layout.chunk_rows is None else layout.chunk_rows
+    states_args = layout.get_dataset_args((num_links, ))
+    states_args["chunks"] = (1, max(1, min(chunk_rows, num_links)), max(num_states, 1))
+
+    wfile.attrs.create('model', [hlm_id], dtype='uint16')
+    wfile.attrs.create('version', "1.3.2", dtype='S6')
+    wfile.attrs.create('store_version', store_version, dtype='S6')
+    wfile.create_dataset('link_id', data=link_ids.astype(np.uint32), **layout.get_dataset_args((num_links, )))
+    wfile.create_dataset('states', shape=(0, num_links, num_states), maxshape=(None, num_links, num_states),
+                         dtype='float64', **states_args)
+    wfile.create_dataset('unix_time', shape=(0, ), maxshape=(None, ), dtype='uint32', chunks=(1024, ))
+    wfile.create_dataset('slot', shape=(0, ), maxshape=(None, ), dtype='uint32', chunks=(1024, ))
+
+
+def align_states(store_link_ids, store_order, link_ids, states):
+    """
+    Reorders the states of a snapshot to the link order of the store, by a join on sorted link ids.
+    :param store_link_ids: 1-D array of link ids of the store.
+    :param store_order: 1-D array. Positions that sort 'store_link_ids'.
+    :param link_ids: 1-D array of link ids of the snapshot.
+    :param states: 2-D array of states of the snapshot.
+    :return: 2-D array of states, one row per link of the store. Raises ToolError if the link sets differ
+    """
+
+    if np.array_equal(store_link_ids, link_ids):
+        return states
+
+    sorted_ids = store_link_ids[store_order]
+    positions = np.minimum(np.searchsorted(sorted_ids, link_ids), max(sorted_ids.size - 1, 0))
+    found = (sorted_ids[positions] == link_ids) if sorted_ids.size else np.zeros(link_ids.size, dtype=bool)
+    if (link_ids.size != store_link_ids.size) or (not found.all()) or \
+            (np.unique(positions).size != positions.size):
+        raise ToolError("Snapshot describes {0} links, {1} of them in the store of {2} links.".format(
+            link_ids.size, int(np.count_nonzero(found)), store_link_ids.size))
+
+    aligned_states = np.empty_like(states)
+    aligned_states[store_order[positions]] = states
+    return aligned_states
+
+
+def append_files(store_file_path, h5_file_paths, layout=None):
+    """
+    Appends snapshot files (Asynch 1.2 or 1.3 format) to a store, created if it does not exist. A snapshot with a
+    timestamp already in the store replaces the stored one.
+    :param store_file_path: File path for the store.
+    :param h5_file_paths: List of file paths for the snapshot files.
+    :param layout: Hdf5Layout object used if the store is created. If None, default layout is used.
+    :return: List of tuples (file path, success boolean, error message or None)
+    """
+
+    all_results = []
+    with h5py.File(store_file_path, 'a') as wfile:
+        store_link_ids, store_order = None, None
+        if 'states' in wfile:
+            store_link_ids = wfile['link_id'][()]
+            store_order = np.argsort(store_link_ids, kind='mergesort')
+        all_times = wfile['unix_time'][()] if 'unix_time' in wfile else np.empty(0, dtype=np.uint32)
+        all_slots = wfile['slot'][()] if 'slot' in wfile else np.empty(0, dtype=np.uint32)
+
+        for cur_file_path in h5_file_paths:
+            cur_snapshot = SnapshotFile.read_file(cur_file_path)
+            if cur_snapshot is None:
+                all_results.append((cur_file_path, False, "Unable to read file."))
+                continue
+            cur_hlm_id, cur_unix_time, cur_link_ids, cur_states = cur_snapshot
+
+            # first snapshot defines the links of the store
+            if store_link_ids is None:
+                create_store(wfile, cur_hlm_id, cur_link_ids, cur_states.shape[1], layout=layout)
+                store_link_ids = wfile['link_id'][()]
+                store_order = np.argsort(store_link_ids, kind='mergesort')
+
+            # basic checks
+            states_dataset = wfile['states']
+            if cur_hlm_id != int(wfile.attrs['model'][0]):
+                all_results.append((cur_file_path, False, "Model {0} differs from model {1} of the store.".format(
+                    cur_hlm_id, int(wfile.attrs['model'][0]))))
+                continue
+            if cur_states.shape[1] != states_dataset.shape[2]:
+                all_results.append((cur_file_path, False, "{0} states differ from {1} states of the store.".format(
+                    cur_states.shape[1], states_dataset.shape[2])))
+                continue
+            try:
+                with Profiler.stage("transform"):
+                    cur_states = align_states(store_link_ids, store_order, cur_link_ids, cur_states)
+            except ToolError as e:
+                all_results.append((cur_file_path, False, str(e)))
+                continue
+
+            # write in the slot of the same timestamp or in a new slot
+            cur_idx = int(np.searchsorted(all_times, cur_unix_time))
+            if (cur_idx < all_times.size) and (all_times[cur_idx] == cur_unix_time):
+                cur_slot = int(all_slots[cur_idx])
+                print("Replacing snapshot of {0}.".format(cur_unix_time))
+            else:
+                cur_slot = states_dataset.shape[0]
+                states_dataset.resize((cur_slot + 1, ) + states_dataset.shape[1:])
+                all_times = np.insert(all_times, cur_idx, cur_unix_time)
+                all_slots = np.insert(all_slots, cur_idx, cur_slot)
+            with Profiler.stage("h5_write"):
+                states_dataset[cur_slot] = cur_states
+            Profiler.count("snapshots")
+            all_results.append((cur_file_path, True, None))
+
+        # write sorted index
+        if 'unix_time' in wfile:
+            for cur_name, cur_values in (('unix_time', all_times), ('slot', all_slots)):
+                wfile[cur_name].resize((cur_values.size, ))
+                wfile[cur_name][:] = cur_values
+
+    return all_results
+
+
+def append_directory(store_file_path, input_dir_path, layout=None):
+    """
+    Appends all .h5 snapshot files of a directory to a store, in the order of their names.
+    :param store_file_path: File path for the store.
+    :param input_dir_path: Directory with the .h5 files.
+    :param layout: Hdf5Layout object used if the store is created. If None, default layout is used.
+    :return: True if all files were appended, False otherwise. Raises ToolError if the directory does not exist
+    """
+
+    # basic check
+    if not os.path.isdir(input_dir_path):
+        raise ToolError("Directory does not exist: '{0}'.".format(input_dir_path))
+
+    store_abs_path = os.path.abspath(store_file_path)
+    all_file_paths = [os.path.join(input_dir_path, v) for v in sorted(os.listdir(input_dir_path)) if v.endswith(".h5")]
+    all_file_paths = [v for v in all_file_paths if os.path.abspath(v) != store_abs_path]
+    return JobsRunner.print_summary(append_files(store_file_path, all_file_paths, layout=layout))
+
+
+def list_times(store_file_path):
+    """
+
+    :param store_file_path: File path for the store.
+    :return: 1-D array with the sorted timestamps of the store. Raises ToolError if unable to read the store
+    """
+
+    if not os.path.exists(store_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(store_file_path))
+    with h5py.File(store_file_path, 'r') as rfile:
+        if 'unix_time' not in rfile:
+            raise ToolError("File '{0}' is not a snapshot store.".format(store_file_path))
+        return rfile['unix_time'][()]
+
+
+def read_snapshot(store_file_path, unix_time):
+    """
+    Reads the snapshot of a timestamp with a binary search on the sorted timestamps and a single read of its slot.
+    :param store_file_path: File path for the store.
+    :param unix_time: Integer.
+    :return: Tuple (hlm id, link ids, 2-D array of states). Raises ToolError if the timestamp is not in the store
+    """
+
+    if not os.path.exists(store_file_path):
+        raise ToolError("File does not exist: '{0}'.".format(store_file_path))
+    with h5py.File(store_file_path, 'r') as rfile:
+        if 'unix_time' not in rfile:
+            raise ToolError("File '{0}' is not a snapshot store.".format(store_file_path))
+        all_times = rfile['unix_time'][()]
+        time_idx = int(np.searchsorted(all_times, unix_time))
+        if (time_idx >= all_times.size) or (all_times[time_idx] != unix_time):
+            nearest = all_times[max(time_idx - 1, 0):time_idx + 1]
+            raise ToolError("Timestamp {0} not in store. Nearest: {1}.".format(
+                unix_time, ", ".join([str(v) for v in nearest]) if nearest.size else "none"))
+        slot = int(rfile['slot'][time_idx])
+        return int(rfile.attrs['model'][0]), rfile['link_id'][()], rfile['states'][slot]
+
+
+def extract_file(store_file_path, unix_time, output_file_path, layout=None):
+    """
+    Writes the snapshot of a timestamp as a snapshot file in Asynch 1.3 format.
+    :param store_file_path: File path for the store.
+    :param unix_time: Integer.
+    :param output_file_path: File path for the new .h5 file.
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :return: True. Raises ToolError if the timestamp is not in the store
+    """
+
+    hlm_id, link_ids, states = read_snapshot(store_file_path, unix_time)
+    SnapshotFile.write_file(output_file_path, hlm_id, unix_time, link_ids, states, layout=layout)
+    print("Created file: {0}".format(output_file_path))
+    return True
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if succeeded, 1 otherwise
+    """
+
+    # help message
+    if '-h' in sys_args:
+        print("Keeps many snapshots of the same links in a single .h5 store, indexed by timestamp.")
+        print("Usage: python snapshot_store_h5.py -mode MODE -store STORE_PATH [-input INPUT_PATH] [-unix_time UNIX_TIME] [-output OUTPUT_PATH] [H5_OPTIONS] [-profile PROFILE]")
+        print("  MODE        : 'a' for appending snapshots, 'e' for extracting one snapshot or 'l' for listing timestamps.")
+        print("  STORE_PATH  : Path for the store file. Created when the first snapshot is appended.")
+        print("  INPUT_PATH  : Path for a .h5 snapshot file or for a folder containing .h5 snapshot files (if MODE=a).")
+        print("  UNIX_TIME   : Timestamp of the snapshot to be extracted (if MODE=e).")
+        print("  OUTPUT_PATH : Path for the new .h5 snapshot file, in Asynch 1.3 format (if MODE=e).")
+        Hdf5Layout.print_help()
+        Profiler.print_help()
+        return 0
+
+    # get all arguments and perform basic check
+    mode_arg = ArgumentsManager.get_str(sys_args, "-mode")
+    if mode_arg is None:
+        print("Missing '-mode' argument.")
+        return 1
+
+    store_arg = ArgumentsManager.get_str(sys_args, "-store")
+    if store_arg is None:
+        print("Missing '-store' argument.")
+        return 1
+
+    layout_arg = Hdf5Layout.from_args(sys_args)
+    if layout_arg is None:
+        return 1
+
+    try:
+        if mode_arg == 'a':
+            inpt_arg = ArgumentsManager.get_str(sys_args, "-input")
+            if inpt_arg is None:
+                print("Missing '-input' argument.")
+                return 1
+            if os.path.isdir(inpt_arg):
+                all_ok = append_directory(store_arg, inpt_arg, layout=layout_arg)
+            else:
+                all_ok = JobsRunner.print_summary(append_files(store_arg, [inpt_arg], layout=layout_arg))
+        elif mode_arg == 'e':
+            time_arg = ArgumentsManager.get_int(sys_args, "-unix_time")
+            outt_arg = ArgumentsManager.get_str(sys_args, "-output")
+            if time_arg is None:
+                print("Missing '-unix_time' argument.")
+                return 1
+            if outt_arg is None:
+                print("Missing '-output' argument.")
+                return 1
+            all_ok = extract_file(store_arg, time_arg, outt_arg, layout=layout_arg)
+        elif mode_arg == 'l':
+            all_times = list_times(store_arg)
+            for cur_time in all_times:
+                print(cur_time)
+            print("{0} snapshot(s).".format(all_times.size))
+            all_ok = True
+        else:
+            print("Unexpected argument for mode: '{0}'. Expects 'a', 'e' or 'l'.".format(mode_arg))
+            all_ok = False
+    except ToolError as e:
+        print(e)
+        all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))
@@ -0,0 +1,283 @@
+from def_lib import (ArgumentsManager, RvrNetwork, PrmFile, RecFile, SnapshotFile, Hdf5Layout, Profiler, ToolError,
+                     find_in_sorted)
+import numpy as np
+import sys
+
+file_kinds = ('prm', 'rec', 'h5')
+read_block_rows = 262144
+
+
+# ###################################################### DEFS ######################################################## #
+
+def find_subbasin(rvr_network, outlet_link_id):
+    """
+    Walks upstream from a link once, one vectorized step per level, visiting only the links of its sub-basin.
+    :param rvr_network: RvrNetwork object.
+    :param outlet_link_id: Integer. Link id of the outlet of the sub-basin.
+    :return: Sorted array of positions of the links of the sub-basin (outlet included). Raises ToolError if the outlet
+    is not described in the network
+    """
+
+    outlet_position = int(rvr_network.index_of([outlet_link_id])[0])
+    if outlet_position < 0:
+        raise ToolError("Link id {0} not described in rvr file.".format(outlet_link_id))
+
+    # 'visited' guards against loops and downstream bifurcations (only its touched pages are allocated)
+    visited = np.zeros(rvr_network.num_links, dtype=bool)
+    visited[outlet_position] = True
+    frontier = np.array([outlet_position], dtype=np.int64)
+    all_levels = [frontier]
+    while frontier.size > 0:
+        up_positions, _ = rvr_network.get_upstream(frontier)
+        up_positions = np.unique(up_positions[up_positions >= 0])
+        frontier = up_positions[~visited[up_positions]].astype(np.int64)
+        visited[frontier] = True
+        all_levels.append(frontier)
+
+    return np.sort(np.concatenate(all_levels))
+
+
+def find_rows(file_link_ids, link_ids, hint_positions, file_path):
+    """
+    Finds the rows of some links in a file. Files of the same setup usually list links in the same order, so the
+    positions of the links in the .rvr file are tried first, at a cost proportional to the number of links.
+    :param file_link_ids: 1-D array with the link ids of the file, in file order.
+    :param link_ids: 1-D array of link ids to be found.
+    :param hint_positions: Sorted 1-D array with the positions of the links in the .rvr file (may be empty).
+    :param file_path: File path, for error messages.
+    :return: Sorted array of rows of the file. Raises ToolError if a link is not in the file
+    """
+
+    if (hint_positions.size > 0) and (hint_positions[-1] < len(file_link_ids)) and \
+            np.array_equal(file_link_ids[hint_positions], link_ids):
+        return hint_positions
+
+    order = np.argsort(file_link_ids, kind='stable')
+    positions, found = find_in_sorted(file_link_ids[order], link_ids)
+    if not np.all(found):
+        raise ToolError("File '{0}' lacks {1} link id(s) of the sub-basin (first: {2}).".format(
+            file_path, int(np.count_nonzero(~found)), link_ids[~found][0]))
+    return np.sort(order[positions])
+
+
+def extract_prm_file(in_prm_file_path, out_prm_file_path, link_ids, hint_positions, use_cache=True):
+    """
+
+    :param in_prm_file_path: File path for the .prm file or for a binary parameters file (see PrmFile).
+    :param out_prm_file_path: File path for the new .prm file, or binary parameters file if its extension is .h5.
+    :param link_ids: 1-D array with the link ids of the sub-basin, in .rvr file order.
+    :param hint_positions: Sorted 1-D array with the positions of the links in the .rvr file.
+    :param use_cache: Boolean. If True, uses the binary cache file of the .prm file (its arrays are memory-mapped).
+    :return: True. Raises ToolError if unable to read file or if a link is not in it
+    """
+
+    prm_content = PrmFile.read_file(in_prm_file_path, use_cache=use_cache)
+    if prm_content is None:
+        raise ToolError("Unable to read file '{0}'.".format(in_prm_file_path))
+    prm_link_ids, parameters = prm_content
+
+    rows = find_rows(prm_link_ids, link_ids, hint_positions, in_prm_file_path)
+    if PrmFile.is_binary_file(out_prm_file_path):
+        PrmFile.write_binary_file(out_prm_file_path, prm_link_ids[rows], parameters[rows])
+    else:
+        PrmFile.write_file(out_prm_file_path, prm_link_ids[rows], parameters[rows])
+    print("Wrote file '{0}'.".format(out_prm_file_path))
+    return True
+
+
+def extract_rec_file(in_rec_file_path, out_rec_file_path, link_ids):
+    """
+    Keeps the links of the sub-basin in file order. As a text file, the .rec file is read in a single streaming pass.
+    :param in_rec_file_path:
+    :param out_rec_file_path:
+    :param link_ids: 1-D array with the link ids of the sub-basin.
+    :return: True. Raises ToolError if unable to read file or if a link is not in it
+    """
+
+    rec_header = RecFile.read_header(in_rec_file_path)
+    if rec_header is None:
+        raise ToolError("Unable to read file '{0}'.".format(in_rec_file_path))
+    hlm_id, num_links, num_states = rec_header
+
+    sorted_ids = np.sort(link_ids)
+    is_written = np.zeros(sorted_ids.size, dtype=bool)
+    all_link_ids, all_states = [], []
+    num_read = 0
+    try:
+        for cur_block in RecFile.iterate_blocks(in_rec_file_path, num_states, read_block_rows):
+            num_read += cur_block.size
+            cur_positions, cur_found = find_in_sorted(sorted_ids, cur_block["link_id"])
+            is_written[cur_positions[cur_found]] = True
+            cur_block = cur_block[cur_found]
+            all_link_ids.append(cur_block["link_id"].copy())
+            all_states.append(np.column_stack([cur_block[v] for v in cur_block.dtype.names[1:]]))
+    except ValueError as e:
+        raise ToolError(e)
+
+    # basic check
+    if num_read != num_links:
+        raise ToolError("REC file '{0}' has a header of '{1}' but describes '{2}' links.".format(
+            in_rec_file_path, num_links, num_read))
+    if not np.all(is_written):
+        raise ToolError("File '{0}' lacks {1} link id(s) of the sub-basin (first: {2}).".format(
+            in_rec_file_path, int(np.count_nonzero(~is_written)), sorted_ids[~is_written][0]))
+    rec_link_ids = np.concatenate(all_link_ids) if all_link_ids else np.empty(0, dtype=np.uint32)
+    states = np.concatenate(all_states) if all_states else np.empty((0, num_states))
+
+    RecFile.write_file(out_rec_file_path, hlm_id, rec_link_ids, states)
+    print("Wrote file '{0}'.".format(out_rec_file_path))
+    return True
+
+
+def extract_h5_file(in_h5_file_path, out_h5_file_path, link_ids, hint_positions, layout=None):
+    """
+    Reads only the chunks holding the links of the sub-basin when the snapshot lists links in the order of the .rvr
+    file or has a link id index (see SnapshotFile), the whole snapshot otherwise.
+    :param in_h5_file_path: File path for a snapshot in Asynch 1.2 or 1.3 format.
+    :param out_h5_file_path: File path for the new snapshot, in Asynch 1.3 format.
+    :param link_ids: 1-D array with the link ids of the sub-basin, in .rvr file order.
+    :param hint_positions: Sorted 1-D array with the positions of the links in the .rvr file.
+    :param layout: Hdf5Layout object. If None, default layout is used.
+    :return: True. Raises ToolError if unable to read file or if a link is not in it
+    """
+
+    snapshot = SnapshotFile.read_file(in_h5_file_path, rows=hint_positions)
+    if snapshot is None:
+        raise ToolError("Unable to read file '{0}'.".format(in_h5_file_path))
+    hlm_id, unix_time, h5_link_ids, states = snapshot
+
+    # links in another order: find their rows in the index of the snapshot, if any
+    index = None if np.array_equal(h5_link_ids, link_ids) else SnapshotFile.read_index(in_h5_file_path)
+    if index is not None:
+        index_link_ids, index_rows = index
+        positions, found = find_in_sorted(index_link_ids, link_ids)
+        if not np.all(found):
+            raise ToolError("File '{0}' lacks {1} link id(s) of the sub-basin (first: {2}).".format(
+                in_h5_file_path, int(np.count_nonzero(~found)), link_ids[~found][0]))
+        snapshot = SnapshotFile.read_file(in_h5_file_path, rows=np.sort(index_rows[positions]))
+        if snapshot is None:
+            raise ToolError("Unable to read file '{0}'.".format(in_h5_file_path))
+        hlm_id, unix_time, h5_link_ids, states = snapshot
+
+    # links in another order and no index: read the whole snapshot
+    elif not np.array_equal(h5_link_ids, link_ids):
+        snapshot = SnapshotFile.read_file(in_h5_file_path)
+        if snapshot is None:
+            raise ToolError("Unable to read file '{0}'.".format(in_h5_file_path))
+        hlm_id, unix_time, h5_link_ids, states = snapshot
+        rows = find_rows(h5_link_ids, link_ids, np.empty(0, dtype=np.int64), in_h5_file_path)
+        h5_link_ids, states = h5_link_ids[rows], states[rows]
+
+    SnapshotFile.write_file(out_h5_file_path, hlm_id, unix_time, h5_link_ids, states, layout=layout)
+    print("Wrote file '{0}'.".format(out_h5_file_path))
+    return True
+
+
+def extract_files(rvr_file_path, outlet_link_id, out_rvr_file_path=None, all_files=(), layout=None, use_cache=True):
+    """
+    Writes the sub-basin upstream of a link as a consistent set of files: the same links in the .rvr, .prm, .rec and
+    .h5 files, each one in the order of its input file.
+    :param rvr_file_path: File path for the .rvr file of the whole domain.
+    :param outlet_link_id: Integer. Link id of the outlet of the sub-basin.
+    :param out_rvr_file_path: File path for the new .rvr file. If None, no .rvr file is written.
+    :param all_files: List of tuples (kind, input file path, output file path). Kinds are one of 'file_kinds'.
+    :param layout: Hdf5Layout object for .h5 files. If None, default layout is used.
+    :param use_cache: Boolean. If True, uses the binary cache files of .rvr and .prm files.
+    :return: Integer. Number of links of the sub-basin. Raises ToolError if unable to read a file or if a file lacks a
+    link of the sub-basin
+    """
+
+    rvr_network = RvrNetwork.read_file(rvr_file_path, use_cache=use_cache)
+    if rvr_network is None:
+        raise ToolError("Unable to read file '{0}'.".format(rvr_file_path))
+
+    with Profiler.stage("walk"):
+        positions = find_subbasin(rvr_network, outlet_link_id)
+        link_ids = rvr_network.link_ids[positions]
+    print("Sub-basin of link id {0}: {1} of {2} links.".format(outlet_link_id, positions.size, rvr_network.num_links))
+    Profiler.count("links", positions.size)
+
+    if out_rvr_file_path is not None:
+        rvr_network.subset(positions).write_file(out_rvr_file_path)
+        print("Wrote file '{0}'.".format(out_rvr_file_path))
+
+    for cur_kind, cur_in_file_path, cur_out_file_path in all_files:
+        if cur_kind == 'prm':
+            extract_prm_file(cur_in_file_path, cur_out_file_path, link_ids, positions, use_cache=use_cache)
+        elif cur_kind == 'rec':
+            extract_rec_file(cur_in_file_path, cur_out_file_path, link_ids)
+        elif cur_kind == 'h5':
+            extract_h5_file(cur_in_file_path, cur_out_file_path, link_ids, positions, layout=layout)
+        else:
+            raise ToolError("Unknown file kind '{0}'. Expected one of {1}.".format(cur_kind, file_kinds))
+
+    return positions.size
+
+
+# ###################################################### CALL ######################################################## #
+
+def main(sys_args):
+    """
+    Command line interface.
+    :param sys_args: List of strings, as sys.argv.
+    :return: Integer. Exit status: 0 if all files were written, 1 otherwise
+    """
+
+    if '-h' in sys_args:
+        print("Extracts the sub-basin upstream of a link from the .rvr, .prm and initial state files of a larger domain.")
+        print("Usage: python subbasin_extractor.py -in_rvr IN_RVR -outlet LINK_ID [-out_rvr OUT_RVR] [-in_prm IN_PRM -out_prm OUT_PRM] [-in_rec IN_REC -out_rec OUT_REC] [-in_h5 IN_H5 -out_h5 OUT_H5 [H5_OPTIONS]] [-no_cache] [-profile PROFILE]")
+        print("  IN_RVR      : File path for the .rvr file of the whole domain.")
+        print("  LINK_ID     : Link id of the outlet of the sub-basin.")
+        print("  OUT_RVR     : File path for the new .rvr file.")
+        print("  IN_PRM      : File path for the .prm file (or binary parameters file, .h5) of the whole domain.")
+        print("  OUT_PRM     : File path for the new .prm file (or binary parameters file, if its extension is .h5).")
+        print("  IN_REC      : File path for a .rec file of the whole domain.")
+        print("  OUT_REC     : File path for the new .rec file.")
+        print("  IN_H5       : File path for a .h5 snapshot of the whole domain (Asynch 1.2 or 1.3 format).")
+        print("  OUT_H5      : File path for the new .h5 snapshot (Asynch 1.3 format).")
+        print("  -no_cache   : If provided, neither reads nor writes the binary cache files of .rvr and .prm files.")
+        Hdf5Layout.print_help()
+        Profiler.print_help()
+        return 0
+
+    # get arguments
+    in_rvr_arg = ArgumentsManager.get_str(sys_args, '-in_rvr')
+    outlet_arg = ArgumentsManager.get_int(sys_args, '-outlet')
+    out_rvr_arg = ArgumentsManager.get_str(sys_args, '-out_rvr')
+    use_cache_arg = '-no_cache' not in sys_args
+    layout_arg = Hdf5Layout.from_args(sys_args)
+
+    # basic checks
+    if in_rvr_arg is None:
+        print("Missing '-in_rvr' argument.")
+        return 1
+    if outlet_arg is None:
+        print("Missing '-outlet' argument.")
+        return 1
+    if layout_arg is None:
+        return 1
+
+    all_files = []
+    for cur_kind in file_kinds:
+        cur_in_arg = ArgumentsManager.get_str(sys_args, '-in_{0}'.format(cur_kind))
+        cur_out_arg = ArgumentsManager.get_str(sys_args, '-out_{0}'.format(cur_kind))
+        if (cur_in_arg is None) != (cur_out_arg is None):
+            print("Missing '-{0}_{1}' argument.".format("out" if cur_out_arg is None else "in", cur_kind))
+            return 1
+        if cur_in_arg is not None:
+            all_files.append((cur_kind, cur_in_arg, cur_out_arg))
+    if (out_rvr_arg is None) and (not all_files):
+        print("Missing '-out_rvr', '-out_prm', '-out_rec' or '-out_h5' argument.")
+        return 1
+
+    try:
+        extract_files(in_rvr_arg, outlet_arg, out_rvr_file_path=out_rvr_arg, all_files=all_files, layout=layout_arg,
+                      use_cache=use_cache_arg)
+    except ToolError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Profiler.run_main(main, sys.argv))